@@ -0,0 +1,89 @@
+"""micro-benchmarks of the entropy kernels of the heteroskedastic
+and gender-heteroskedastic Choo and Siow models,
+with freshly allocated outputs and with preallocated output buffers.
+
+Run from the root of the repository with `python -m benchmarks.bench_entropy`.
+"""
+
+from collections.abc import Callable
+from timeit import repeat
+
+import numpy as np
+from bs_python_utils.bsutils import print_stars
+
+from cupid_matching.choo_siow_gender_heteroskedastic import (
+    e0_derivative_mu_gender_heteroskedastic,
+    e0_derivative_r_gender_heteroskedastic,
+    e_choo_siow_gender_heteroskedastic,
+    e_derivative_mu_gender_heteroskedastic,
+    e_derivative_r_gender_heteroskedastic,
+)
+from cupid_matching.choo_siow_heteroskedastic import (
+    e0_derivative_mu_heteroskedastic,
+    e0_derivative_r_heteroskedastic,
+    e_choo_siow_heteroskedastic,
+    e_derivative_mu_heteroskedastic,
+    e_derivative_r_heteroskedastic,
+)
+from cupid_matching.matching_utils import Matching
+
+KERNELS: list[Callable] = [
+    e_choo_siow_heteroskedastic,
+    e0_derivative_mu_heteroskedastic,
+    e0_derivative_r_heteroskedastic,
+    e_derivative_mu_heteroskedastic,
+    e_derivative_r_heteroskedastic,
+    e_choo_siow_gender_heteroskedastic,
+    e0_derivative_mu_gender_heteroskedastic,
+    e0_derivative_r_gender_heteroskedastic,
+    e_derivative_mu_gender_heteroskedastic,
+    e_derivative_r_gender_heteroskedastic,
+]
+
+
+def random_matching(X: int, Y: int, seed: int = 0) -> Matching:
+    """draws a random Matching with `X` types of men and `Y` types of women"""
+    rng = np.random.default_rng(seed)
+    muxy = rng.uniform(1.0, 2.0, size=(X, Y))
+    n = np.sum(muxy, 1) + rng.uniform(1.0, 2.0, size=X)
+    m = np.sum(muxy, 0) + rng.uniform(1.0, 2.0, size=Y)
+    return Matching(muxy, n, m)
+
+
+def bench_kernel(
+    kernel: Callable, mus: Matching, n_repeats: int = 5
+) -> tuple[float, float]:
+    """times an entropy kernel with and without preallocated outputs
+
+    Args:
+        kernel: the entropy kernel
+        mus: the Matching it is evaluated at
+        n_repeats: we report the best of `n_repeats` runs
+
+    Returns:
+        the best times with freshly allocated and with preallocated outputs
+    """
+    result = kernel(mus)
+    out = result if isinstance(result, np.ndarray) else tuple(result)
+
+    def allocating():
+        return kernel(mus)
+
+    def preallocated():
+        return kernel(mus, out=out)
+
+    time_allocating = min(repeat(allocating, number=1, repeat=n_repeats))
+    time_preallocated = min(repeat(preallocated, number=1, repeat=n_repeats))
+    return time_allocating, time_preallocated
+
+
+if __name__ == "__main__":
+    for X, Y in [(10, 10), (30, 25), (60, 50)]:
+        mus = random_matching(X, Y)
+        print_stars(f"Entropy kernels with X={X}, Y={Y}")
+        for kernel in KERNELS:
+            time_allocating, time_preallocated = bench_kernel(kernel, mus)
+            print(
+                f"    {kernel.__name__}: {time_allocating:.2e} seconds,"
+                f" {time_preallocated:.2e} seconds with preallocated outputs"
+            )
@@ -0,0 +1,35 @@
+"""times the import of the package and of its main entry points,
+each in a fresh interpreter.
+
+Run from the root of the repository with `python -m benchmarks.bench_import`.
+"""
+
+import subprocess
+import sys
+from timeit import default_timer
+
+from bs_python_utils.bsutils import print_stars
+
+STATEMENTS = [
+    "import numpy",
+    "import cupid_matching",
+    "from cupid_matching import ipfp_homoskedastic_solver",
+    "from cupid_matching import estimate_semilinear_mde",
+    "from cupid_matching import choo_siow_poisson_glm",
+]
+
+
+def bench_import(statement: str, n_repeats: int = 5) -> float:
+    """returns the best wall time of running `statement` in a fresh interpreter"""
+    times = []
+    for _ in range(n_repeats):
+        start = default_timer()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        times.append(default_timer() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    print_stars("Import times (best of 5, including interpreter startup)")
+    for statement in STATEMENTS:
+        print(f"{statement:<56s} {1_000.0 * bench_import(statement):8.0f} ms")
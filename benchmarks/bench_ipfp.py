@@ -0,0 +1,66 @@
+"""benchmarks the IPFP solver of the gender-heteroskedastic model
+against the fully heteroskedastic solver with `sigma_x = 1` and `tau_y = tau`,
+which it used to delegate to.
+
+Run from the root of the repository with `python -m benchmarks.bench_ipfp`.
+"""
+
+from timeit import repeat
+
+import numpy as np
+from bs_python_utils.bsutils import print_stars
+
+from cupid_matching.ipfp_solvers import (
+    ipfp_gender_heteroskedastic_solver,
+    ipfp_heteroskedastic_solver,
+)
+
+
+def bench_gender_heteroskedastic(
+    X: int, Y: int, tau: float, n_repeats: int = 5, seed: int = 0
+) -> tuple[float, float, float]:
+    """times both solvers on a random market
+
+    Args:
+        X: number of types of men
+        Y: number of types of women
+        tau: the scale parameter for women
+        n_repeats: we report the best of `n_repeats` runs
+        seed: the seed of the random draws
+
+    Returns:
+        the best times of the dedicated and of the delegated solvers,
+        and the largest difference in their matching patterns
+    """
+    rng = np.random.default_rng(seed)
+    Phi = rng.normal(size=(X, Y))
+    n = rng.uniform(0.5, 1.5, size=X)
+    m = rng.uniform(0.5, 1.5, size=Y)
+    sigma_x = np.ones(X)
+    tau_y = np.full(Y, tau)
+
+    def dedicated():
+        return ipfp_gender_heteroskedastic_solver(Phi, n, m, tau)
+
+    def delegated():
+        return ipfp_heteroskedastic_solver(Phi, n, m, sigma_x, tau_y)
+
+    time_dedicated = min(repeat(dedicated, number=1, repeat=n_repeats))
+    time_delegated = min(repeat(delegated, number=1, repeat=n_repeats))
+    mus_dedicated, *_ = dedicated()
+    mus_delegated, *_ = delegated()
+    max_diff = np.max(np.abs(mus_dedicated.muxy - mus_delegated.muxy))
+    return time_dedicated, time_delegated, max_diff
+
+
+if __name__ == "__main__":
+    tau = 0.7
+    for X, Y in [(10, 10), (50, 40), (200, 150), (500, 500)]:
+        time_dedicated, time_delegated, max_diff = bench_gender_heteroskedastic(
+            X, Y, tau
+        )
+        print_stars(f"Gender-heteroskedastic IPFP with X={X}, Y={Y}, tau={tau}")
+        print(f"    dedicated solver: {time_dedicated:.4f} seconds")
+        print(f"    delegated solver: {time_delegated:.4f} seconds")
+        print(f"    speedup: {time_delegated / time_dedicated:.1f}")
+        print(f"    max difference in muxy: {max_diff:.2e}")
@@ -1 +1,220 @@
+"""Estimation and simulation of separable matching models with transferable utility.
 
+The public functions and classes are available from the package itself,
+e.g. `from cupid_matching import ipfp_homoskedastic_solver`.
+They are imported lazily on first access, so that `import cupid_matching`
+is cheap and scikit-learn and `scipy.stats` are only loaded
+by the estimators that need them; altair and streamlit are only used
+by the `cupid_streamlit` app.
+"""
+
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
+# the submodule that defines each public name
+_LAZY_NAMES: dict[str, str] = {
+    # matching patterns
+    "Matching": "matching_utils",
+    "VarianceMatching": "matching_utils",
+    "variance_muhat": "matching_utils",
+    "simulate_sample_from_mus": "matching_utils",
+    "MatchingCounts": "microdata",
+    "MicrodataSampler": "microdata",
+    "aggregate_microdata": "microdata",
+    "merge_counts": "microdata",
+    "read_microdata": "microdata",
+    "save_results": "persistence",
+    "load_results": "persistence",
+    # models
+    "ChooSiowPrimitives": "model_classes",
+    "ChooSiowPrimitivesNoSingles": "model_classes",
+    "NestedLogitPrimitives": "model_classes",
+    # solvers
+    "IPFPStats": "ipfp_solvers",
+    "ipfp_homoskedastic_solver": "ipfp_solvers",
+    "ipfp_homoskedastic_no_singles_solver": "ipfp_solvers",
+    "ipfp_gender_heteroskedastic_solver": "ipfp_solvers",
+    "ipfp_heteroskedastic_solver": "ipfp_solvers",
+    # entropies
+    "EntropyFunctions": "entropy",
+    "entropy_choo_siow": "choo_siow",
+    "entropy_choo_siow_corrected": "choo_siow",
+    "entropy_choo_siow_numeric": "choo_siow",
+    "entropy_choo_siow_corrected_numeric": "choo_siow",
+    "entropy_choo_siow_no_singles": "choo_siow_no_singles",
+    "entropy_choo_siow_no_singles_corrected": "choo_siow_no_singles",
+    "entropy_choo_siow_no_singles_numeric": "choo_siow_no_singles",
+    "entropy_choo_siow_no_singles_corrected_numeric": "choo_siow_no_singles",
+    "entropy_choo_siow_heteroskedastic": "choo_siow_heteroskedastic",
+    "entropy_choo_siow_heteroskedastic_numeric": "choo_siow_heteroskedastic",
+    "entropy_choo_siow_gender_heteroskedastic": "choo_siow_gender_heteroskedastic",
+    "entropy_choo_siow_gender_heteroskedastic_numeric": (
+        "choo_siow_gender_heteroskedastic"
+    ),
+    "setup_standard_nested_logit": "nested_logit",
+    # estimators
+    "PreparedMarket": "prepared_market",
+    "estimate_semilinear_mde": "min_distance",
+    "estimate_pooled_semilinear_mde": "min_distance",
+    "prepare_mde_specification_search": "min_distance",
+    "MDEResults": "min_distance_utils",
+    "PooledMDEResults": "min_distance_utils",
+    "MDESpecificationSearch": "min_distance_utils",
+    "IdentityWeighting": "weighting_matrix",
+    "DiagonalWeighting": "weighting_matrix",
+    "DenseWeighting": "weighting_matrix",
+    "FactoredWeighting": "weighting_matrix",
+    "InverseCovarianceWeighting": "weighting_matrix",
+    "choo_siow_poisson_glm": "poisson_glm",
+    "choo_siow_poisson_glm_multimarket": "poisson_glm",
+    "PoissonGLMEstimator": "poisson_glm",
+    "PoissonGLMResults": "poisson_glm_utils",
+    "PoissonGLMMultiMarketResults": "poisson_glm_utils",
+}
+
+__all__ = [
+    "ChooSiowPrimitives",
+    "ChooSiowPrimitivesNoSingles",
+    "DenseWeighting",
+    "DiagonalWeighting",
+    "EntropyFunctions",
+    "FactoredWeighting",
+    "IPFPStats",
+    "IdentityWeighting",
+    "InverseCovarianceWeighting",
+    "MDEResults",
+    "MDESpecificationSearch",
+    "Matching",
+    "MatchingCounts",
+    "MicrodataSampler",
+    "NestedLogitPrimitives",
+    "PoissonGLMEstimator",
+    "PoissonGLMMultiMarketResults",
+    "PoissonGLMResults",
+    "PooledMDEResults",
+    "PreparedMarket",
+    "VarianceMatching",
+    "aggregate_microdata",
+    "choo_siow_poisson_glm",
+    "choo_siow_poisson_glm_multimarket",
+    "entropy_choo_siow",
+    "entropy_choo_siow_corrected",
+    "entropy_choo_siow_corrected_numeric",
+    "entropy_choo_siow_gender_heteroskedastic",
+    "entropy_choo_siow_gender_heteroskedastic_numeric",
+    "entropy_choo_siow_heteroskedastic",
+    "entropy_choo_siow_heteroskedastic_numeric",
+    "entropy_choo_siow_no_singles",
+    "entropy_choo_siow_no_singles_corrected",
+    "entropy_choo_siow_no_singles_corrected_numeric",
+    "entropy_choo_siow_no_singles_numeric",
+    "entropy_choo_siow_numeric",
+    "estimate_pooled_semilinear_mde",
+    "estimate_semilinear_mde",
+    "ipfp_gender_heteroskedastic_solver",
+    "ipfp_heteroskedastic_solver",
+    "ipfp_homoskedastic_no_singles_solver",
+    "ipfp_homoskedastic_solver",
+    "load_results",
+    "merge_counts",
+    "prepare_mde_specification_search",
+    "read_microdata",
+    "save_results",
+    "setup_standard_nested_logit",
+    "simulate_sample_from_mus",
+    "variance_muhat",
+]
+
+
+def __getattr__(name: str) -> Any:
+    """imports the submodule that defines `name` on first access"""
+    try:
+        module_name = _LAZY_NAMES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(import_module(f"{__name__}.{module_name}"), name)
+    # cache it, so that __getattr__ is not called again for this name
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_NAMES))
+
+
+if TYPE_CHECKING:
+    from cupid_matching.choo_siow import (
+        entropy_choo_siow,
+        entropy_choo_siow_corrected,
+        entropy_choo_siow_corrected_numeric,
+        entropy_choo_siow_numeric,
+    )
+    from cupid_matching.choo_siow_gender_heteroskedastic import (
+        entropy_choo_siow_gender_heteroskedastic,
+        entropy_choo_siow_gender_heteroskedastic_numeric,
+    )
+    from cupid_matching.choo_siow_heteroskedastic import (
+        entropy_choo_siow_heteroskedastic,
+        entropy_choo_siow_heteroskedastic_numeric,
+    )
+    from cupid_matching.choo_siow_no_singles import (
+        entropy_choo_siow_no_singles,
+        entropy_choo_siow_no_singles_corrected,
+        entropy_choo_siow_no_singles_corrected_numeric,
+        entropy_choo_siow_no_singles_numeric,
+    )
+    from cupid_matching.entropy import EntropyFunctions
+    from cupid_matching.ipfp_solvers import (
+        IPFPStats,
+        ipfp_gender_heteroskedastic_solver,
+        ipfp_heteroskedastic_solver,
+        ipfp_homoskedastic_no_singles_solver,
+        ipfp_homoskedastic_solver,
+    )
+    from cupid_matching.matching_utils import (
+        Matching,
+        VarianceMatching,
+        simulate_sample_from_mus,
+        variance_muhat,
+    )
+    from cupid_matching.microdata import (
+        MatchingCounts,
+        MicrodataSampler,
+        aggregate_microdata,
+        merge_counts,
+        read_microdata,
+    )
+    from cupid_matching.min_distance import (
+        estimate_pooled_semilinear_mde,
+        estimate_semilinear_mde,
+        prepare_mde_specification_search,
+    )
+    from cupid_matching.min_distance_utils import (
+        MDEResults,
+        MDESpecificationSearch,
+        PooledMDEResults,
+    )
+    from cupid_matching.model_classes import (
+        ChooSiowPrimitives,
+        ChooSiowPrimitivesNoSingles,
+        NestedLogitPrimitives,
+    )
+    from cupid_matching.nested_logit import setup_standard_nested_logit
+    from cupid_matching.persistence import load_results, save_results
+    from cupid_matching.poisson_glm import (
+        PoissonGLMEstimator,
+        choo_siow_poisson_glm,
+        choo_siow_poisson_glm_multimarket,
+    )
+    from cupid_matching.poisson_glm_utils import (
+        PoissonGLMMultiMarketResults,
+        PoissonGLMResults,
+    )
+    from cupid_matching.prepared_market import PreparedMarket
+    from cupid_matching.weighting_matrix import (
+        DenseWeighting,
+        DiagonalWeighting,
+        FactoredWeighting,
+        IdentityWeighting,
+        InverseCovarianceWeighting,
+    )
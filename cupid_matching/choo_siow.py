@@ -1,8 +1,10 @@
 """The components of the derivative of the entropy for the Choo and Siow homoskedastic model."""
 
+from collections.abc import Callable
 from typing import cast
 
 import numpy as np
+import scipy.sparse as sp
 from bs_python_utils.bsnputils import ThreeArrays, TwoArrays
 from bs_python_utils.bsutils import bs_error_abort
 
@@ -11,7 +13,45 @@ from cupid_matching.entropy import (
     EntropyHessians,
     check_additional_parameters,
 )
-from cupid_matching.matching_utils import Matching
+from cupid_matching.matching_utils import Matching, MatchingBatch
+
+
+def _map_stored(
+    fun: Callable[[np.ndarray], np.ndarray], muxy: np.ndarray
+) -> np.ndarray:
+    """applies `fun` to `muxy`, or only to its stored values if it is sparse"""
+    if sp.issparse(muxy):
+        muxy_csr = cast(sp.csr_array, muxy)
+        return cast(
+            np.ndarray,
+            sp.csr_array(
+                (fun(muxy_csr.data), muxy_csr.indices, muxy_csr.indptr),
+                shape=muxy_csr.shape,
+            ),
+        )
+    return fun(muxy)
+
+
+def _der_xy_choo_siow(
+    logxy: np.ndarray, logx0: np.ndarray, log0y: np.ndarray
+) -> np.ndarray:
+    """the first derivative of the entropy given the logs of the matching patterns;
+    with a leading batch dimension, the B first derivatives;
+    if `logxy` is sparse, the derivative is only computed on its stored cells"""
+    if sp.issparse(logxy):
+        logxy_csr = cast(sp.csr_array, logxy)
+        rows = np.repeat(np.arange(logxy_csr.shape[0]), np.diff(logxy_csr.indptr))
+        der_data = -2.0 * logxy_csr.data + logx0[rows] + log0y[logxy_csr.indices]
+        return cast(
+            np.ndarray,
+            sp.csr_array(
+                (der_data, logxy_csr.indices, logxy_csr.indptr), shape=logxy_csr.shape
+            ),
+        )
+    return cast(
+        np.ndarray,
+        -2.0 * logxy + logx0[..., :, np.newaxis] + log0y[..., np.newaxis, :],
+    )
 
 
 def _entropy_choo_siow(
@@ -27,37 +67,37 @@ def _entropy_choo_siow(
     for the Choo and Siow model
 
     Args:
-        muhat: a Matching
+        muhat: a Matching; if its `muxy` is sparse, `deriv` cannot be 2
         deriv: if equal 1, we compute_ the first derivatives too;
                if equals 2, also the hessian
 
     Returns:
         the value of the generalized entropy
-        if deriv = 1 or 2, the (X,Y) matrix of the first derivative of the entropy
+        if deriv = 1 or 2, the (X,Y) matrix of the first derivative of the entropy,
+            sparse with the same stored cells as a sparse `muxy`
         if deriv = 2, the (X,Y,X,Y) array of the second derivative
             wrt $(\\mu,\\mu)$
           and the (X,Y,X+Y) second derivatives
             wrt $(\\mu,(n,m))$
     """
     muxy, mux0, mu0y, n, m = muhat.unpack()
+    if deriv == 2 and sp.issparse(muxy):
+        bs_error_abort("We do not compute the hessian with a sparse muxy.")
 
-    logxy = np.log(muxy)
-    logx0 = np.log(mux0)
-    log0y = np.log(mu0y)
+    logxy, logx0, log0y = muhat.log_muxy, muhat.log_mux0, muhat.log_mu0y
 
     val_entropy = (
         -2.0 * np.sum(muxy * logxy)
         - np.sum(mux0 * logx0)
         - np.sum(mu0y * log0y)
-        + np.sum(n * np.log(n))
-        + np.sum(m * np.log(m))
+        + np.sum(n * muhat.log_n)
+        + np.sum(m * muhat.log_m)
     )
 
     if deriv == 0:
         return cast(float, val_entropy)
     if deriv in [1, 2]:
-        der_xy = -2.0 * logxy + log0y
-        der_xy += logx0.reshape((-1, 1))
+        der_xy = _der_xy_choo_siow(logxy, logx0, log0y)
         if deriv == 1:
             return val_entropy, der_xy
         else:  # we compute_ the Hessians
@@ -84,14 +124,15 @@ def _entropy_choo_siow(
 
 
 def _der_entropy_choo_siow_corrected(
-    muhat: Matching, hessian: bool | None = False
+    muhat: Matching | MatchingBatch, hessian: bool | None = False
 ) -> np.ndarray | ThreeArrays:
     """Returns the corrected first derivative of $\\mathcal{E}$
     and the corrected second derivative (if `hessian` is True)
     for the Choo and Siow model
 
     Args:
-        muhat: a Matching
+        muhat: a Matching, or a MatchingBatch if `hessian` is False;
+            the Matching may have a sparse `muxy` if `hessian` is False
         hessian: if `True`, also compute_ the hessian
 
     Returns:
@@ -102,17 +143,24 @@ def _der_entropy_choo_siow_corrected(
             wrt $(\\mu,(n,m))$
     """
     muxy, mux0, mu0y, *_ = muhat.unpack()
-    n_households = np.sum(muxy) + np.sum(mux0) + np.sum(mu0y)
+    if hessian and (isinstance(muhat, MatchingBatch) or sp.issparse(muxy)):
+        bs_error_abort("We only compute the hessian for a Matching with a dense muxy.")
+    n_households = np.asarray(muhat.n_households)
+    if isinstance(muhat, MatchingBatch):
+        # one number of households per matching
+        n_households_x = n_households[:, np.newaxis]
+        n_households_xy = n_households[:, np.newaxis, np.newaxis]
+    else:
+        n_households_x = n_households_xy = n_households
 
-    muxy_corr = muxy + (1.0 - muxy / n_households) / 2.0
-    logxy = np.log(muxy_corr)
-    mux0_corr = mux0 + (1.0 - mux0 / n_households) / 2.0
+    muxy_corr = _map_stored(lambda mu: mu + (1.0 - mu / n_households_xy) / 2.0, muxy)
+    logxy = _map_stored(np.log, muxy_corr)
+    mux0_corr = mux0 + (1.0 - mux0 / n_households_x) / 2.0
     logx0 = np.log(mux0_corr)
-    mu0y_corr = mu0y + (1.0 - mu0y / n_households) / 2.0
+    mu0y_corr = mu0y + (1.0 - mu0y / n_households_x) / 2.0
     log0y = np.log(mu0y_corr)
 
-    der_xy = -2.0 * logxy + log0y
-    der_xy += logx0.reshape((-1, 1))
+    der_xy = _der_xy_choo_siow(logxy, logx0, log0y)
     if not hessian:
         return der_xy
     else:  # we compute_ the Hessians
@@ -137,32 +185,35 @@ def _der_entropy_choo_siow_corrected(
 
 
 def e0_fun_choo_siow(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching | MatchingBatch, additional_parameters: list | None = None
 ) -> np.ndarray:
     """Returns the values of $e_0$ for the Choo and Siow model.
 
     Args:
-        muhat: a Matching
+        muhat: a Matching, or a MatchingBatch of B matchings
 
     Returns:
-        the (X,Y) matrix of the first derivative of the entropy
+        the (X,Y) matrix of the first derivative of the entropy;
+        a (B,X,Y) array for a MatchingBatch;
+        a sparse matrix with the same stored cells if `muhat.muxy` is sparse
     """
     check_additional_parameters(0, additional_parameters)
-    entropy_res = cast(tuple[float, np.ndarray], _entropy_choo_siow(muhat, deriv=1))
-    return cast(np.ndarray, entropy_res[1])
+    return _der_xy_choo_siow(muhat.log_muxy, muhat.log_mux0, muhat.log_mu0y)
 
 
 def e0_fun_choo_siow_corrected(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching | MatchingBatch, additional_parameters: list | None = None
 ) -> np.ndarray:
     """Returns the values of $e_0$ for the Choo and Siow model,
     using the finite-sample correction log(p+(1-p)/(2N))
 
     Args:
-        muhat: a Matching
+        muhat: a Matching, or a MatchingBatch of B matchings
 
     Returns:
-        the (X,Y) matrix of the first derivative of the entropy
+        the (X,Y) matrix of the first derivative of the entropy;
+        a (B,X,Y) array for a MatchingBatch;
+        a sparse matrix with the same stored cells if `muhat.muxy` is sparse
     """
     check_additional_parameters(0, additional_parameters)
     e0_val_corrected = _der_entropy_choo_siow_corrected(muhat, hessian=False)
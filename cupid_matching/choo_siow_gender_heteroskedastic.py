@@ -10,7 +10,12 @@ from typing import cast
 import numpy as np
 from bs_python_utils.bsnputils import ThreeArrays, TwoArrays
 
-from cupid_matching.entropy import EntropyFunctions, EntropyHessians
+from cupid_matching.entropy import (
+    EntropyFunctions,
+    EntropyHessians,
+    EntropyHessiansAlpha,
+    get_output_buffers,
+)
 from cupid_matching.matching_utils import Matching
 
 
@@ -33,13 +38,17 @@ def e0_choo_siow_gender_heteroskedastic(
 
 
 def e0_derivative_mu_gender_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: ThreeArrays | None = None,
 ) -> ThreeArrays:
     """Returns the derivatives of the parameter-independent part $e_0$ in $\\mu$.
     for the Choo and Siow gender-heteroskedastic model; we normalized $\\sigma=1$.
 
     Args:
         muhat: a Matching
+        out: if given, the three arrays to write the results into
 
     Returns:
         the  parameter-independent part of the hessian of the entropy
@@ -47,27 +56,25 @@ def e0_derivative_mu_gender_heteroskedastic(
     """
     muxy, mux0, *_ = muhat.unpack()
     X, Y = muxy.shape
-    hess_x = np.zeros((X, Y, Y))
-    hess_y = np.zeros((X, Y, X))
-    hess_xy = np.zeros((X, Y))
-    der_logxy = 1.0 / muxy
-    der_logx0 = 1.0 / mux0
-    for x in range(X):
-        dlogx0 = der_logx0[x]
-        for y in range(Y):
-            hess_x[x, y, :] = -dlogx0
-            hess_xy[x, y] = -der_logxy[x, y] - dlogx0
+    hess_x, hess_y, hess_xy = get_output_buffers(out, ((X, Y, Y), (X, Y, X), (X, Y)))
+    der_logx0 = (1.0 / mux0).reshape((-1, 1))
+    hess_x[...] = -der_logx0.reshape((-1, 1, 1))
+    hess_xy[...] = -1.0 / muxy - der_logx0
     return hess_x, hess_y, hess_xy
 
 
 def e0_derivative_r_gender_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: TwoArrays | None = None,
 ) -> TwoArrays:
     """Returns the derivatives of the parameter-independent part $e_0$ wrt $r$
     for the Choo and Siow gender-heteroskedastic model; we normalized $\\sigma=1$.
 
     Args:
         muhat: a Matching
+        out: if given, the two arrays to write the results into
 
     Returns:
         the parameter-independent part of the hessian of the entropy
@@ -75,13 +82,8 @@ def e0_derivative_r_gender_heteroskedastic(
     """
     muxy, mux0, *_ = muhat.unpack()
     X, Y = muxy.shape
-    hess_n = np.zeros((X, Y))
-    hess_m = np.zeros((X, Y))
-    der_logx0 = 1.0 / mux0
-    for x in range(X):
-        dlogx0 = der_logx0[x]
-        for y in range(Y):
-            hess_n[x, y] = dlogx0
+    hess_n, hess_m = get_output_buffers(out, ((X, Y), (X, Y)))
+    hess_n[...] = (1.0 / mux0).reshape((-1, 1))
     return hess_n, hess_m
 
 
@@ -92,29 +94,35 @@ e0_derivative_choo_siow_gender_heteroskedastic = (
 
 
 def e_choo_siow_gender_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: np.ndarray | None = None,
 ) -> np.ndarray:
     """Returns the values of the parameter-dependent part  $e$
     for the Choo and Siow gender-heteroskedastic model; we normalized $\\sigma=1$.
 
     Args:
         muhat: a Matching
+        out: if given, the array to write the results into
 
     Returns:
         the (X,Y,1) array of the parameter-dependent part
         of the first derivative of the entropy.
     """
-    muxy, _, mu0y, *_ = muhat.unpack()
-    X, Y = muxy.shape
+    X, Y = muhat.muxy.shape
     n_alpha = 1
 
-    e_vals = np.zeros((X, Y, n_alpha))
-    e_vals[:, :, 0] = -np.log(muxy / mu0y)
+    (e_vals,) = get_output_buffers(None if out is None else (out,), ((X, Y, n_alpha),))
+    e_vals[:, :, 0] = muhat.log_mu0y - muhat.log_muxy
     return e_vals
 
 
 def e_derivative_mu_gender_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: ThreeArrays | None = None,
 ) -> ThreeArrays:
     """Returns the derivatives of the parameter-dependent part $e$
      wrt $\\mu$ for the Choo and Siow gender-heteroskedastic model;
@@ -122,6 +130,7 @@ def e_derivative_mu_gender_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the three arrays to write the results into
 
     Returns:
         the parameter-dependent part of the hessian of the entropy
@@ -131,21 +140,20 @@ def e_derivative_mu_gender_heteroskedastic(
     X, Y = muxy.shape
 
     n_alpha = 1
-    hess_x = np.zeros((X, Y, Y, n_alpha))
-    hess_y = np.zeros((X, Y, X, n_alpha))
-    hess_xy = np.zeros((X, Y, n_alpha))
-    der_logxy = 1.0 / muxy
+    hess_x, hess_y, hess_xy = get_output_buffers(
+        out, ((X, Y, Y, n_alpha), (X, Y, X, n_alpha), (X, Y, n_alpha))
+    )
     der_log0y = 1.0 / mu0y
-    for x in range(X):
-        for y in range(Y):
-            dlog0y = der_log0y[y]
-            hess_y[x, y, :, 0] = -dlog0y
-            hess_xy[x, y, 0] = -der_logxy[x, y] - dlog0y
+    hess_y[..., 0] = -der_log0y.reshape((1, Y, 1))
+    hess_xy[..., 0] = -1.0 / muxy - der_log0y
     return hess_x, hess_y, hess_xy
 
 
 def e_derivative_r_gender_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: TwoArrays | None = None,
 ) -> TwoArrays:
     """Returns the derivatives of the parameter-dependent part $e$
      wrt $r$ for the Choo and Siow gender-heteroskedastic model;
@@ -153,6 +161,7 @@ def e_derivative_r_gender_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the two arrays to write the results into
 
     Returns:
         the parameter-dependent part of the hessian of the entropy
@@ -162,13 +171,8 @@ def e_derivative_r_gender_heteroskedastic(
     X, Y = muxy.shape
 
     n_alpha = 1
-    hess_n = np.zeros((X, Y, n_alpha))
-    hess_m = np.zeros((X, Y, n_alpha))
-    der_log0y = 1.0 / mu0y
-    for x in range(X):
-        for y in range(Y):
-            dlog0y = der_log0y[y]
-            hess_m[x, y, 0] = dlog0y
+    hess_n, hess_m = get_output_buffers(out, ((X, Y, n_alpha), (X, Y, n_alpha)))
+    hess_m[..., 0] = 1.0 / mu0y
     return hess_n, hess_m
 
 
@@ -177,6 +181,69 @@ e_derivative_choo_siow_gender_heteroskedastic = (
     e_derivative_r_gender_heteroskedastic,
 )
 
+
+def e_derivative_mu_gender_heteroskedastic_alpha(
+    muhat: Matching,
+    alpha: np.ndarray,
+    additional_parameters: list | None = None,
+    *,
+    out: ThreeArrays | None = None,
+) -> ThreeArrays:
+    """Returns the derivatives of $e \\cdot \\alpha$
+     wrt $\\mu$ for the Choo and Siow gender-heteroskedastic model;
+     we normalized $\\sigma_1=1$.
+
+    Args:
+        muhat: a Matching
+        alpha: the one-element array $(\\tau)$
+        out: if given, the three arrays to write the results into
+
+    Returns:
+        the parameter-dependent part of the hessian of the entropy
+        wrt $(\\mu,\\mu)$, contracted with `alpha`.
+    """
+    muxy, _, mu0y, *_ = muhat.unpack()
+    X, Y = muxy.shape
+    hess_x, hess_y, hess_xy = get_output_buffers(out, ((X, Y, Y), (X, Y, X), (X, Y)))
+    tau = alpha[0]
+    tau_0y = tau / mu0y
+    hess_y[...] = -tau_0y.reshape((1, Y, 1))
+    hess_xy[...] = -tau / muxy - tau_0y
+    return hess_x, hess_y, hess_xy
+
+
+def e_derivative_r_gender_heteroskedastic_alpha(
+    muhat: Matching,
+    alpha: np.ndarray,
+    additional_parameters: list | None = None,
+    *,
+    out: TwoArrays | None = None,
+) -> TwoArrays:
+    """Returns the derivatives of $e \\cdot \\alpha$
+     wrt $r$ for the Choo and Siow gender-heteroskedastic model;
+     we normalized $\\sigma_1=1$.
+
+    Args:
+        muhat: a Matching
+        alpha: the one-element array $(\\tau)$
+        out: if given, the two arrays to write the results into
+
+    Returns:
+        the parameter-dependent part of the hessian of the entropy
+        wrt $(\\mu,r)$, contracted with `alpha`.
+    """
+    muxy, _, mu0y, *_ = muhat.unpack()
+    X, Y = muxy.shape
+    hess_n, hess_m = get_output_buffers(out, ((X, Y), (X, Y)))
+    hess_m[...] = alpha[0] / mu0y
+    return hess_n, hess_m
+
+
+e_derivative_alpha_choo_siow_gender_heteroskedastic = (
+    e_derivative_mu_gender_heteroskedastic_alpha,
+    e_derivative_r_gender_heteroskedastic_alpha,
+)
+
 entropy_choo_siow_gender_heteroskedastic = EntropyFunctions(
     e0_fun=e0_choo_siow_gender_heteroskedastic,
     parameter_dependent=True,
@@ -184,6 +251,9 @@ entropy_choo_siow_gender_heteroskedastic = EntropyFunctions(
     hessian="provided",
     e0_derivative=cast(EntropyHessians, e0_derivative_choo_siow_gender_heteroskedastic),
     e_derivative=cast(EntropyHessians, e_derivative_choo_siow_gender_heteroskedastic),
+    e_derivative_alpha=cast(
+        EntropyHessiansAlpha, e_derivative_alpha_choo_siow_gender_heteroskedastic
+    ),
     description="Choo and Siow gender-heteroskedastic with analytic Hessian",
 )
 
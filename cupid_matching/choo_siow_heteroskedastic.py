@@ -10,7 +10,12 @@ from typing import cast
 import numpy as np
 from bs_python_utils.bsnputils import ThreeArrays, TwoArrays
 
-from cupid_matching.entropy import EntropyFunctions, EntropyHessians
+from cupid_matching.entropy import (
+    EntropyFunctions,
+    EntropyHessians,
+    EntropyHessiansAlpha,
+    get_output_buffers,
+)
 from cupid_matching.matching_utils import Matching
 
 
@@ -37,7 +42,10 @@ def e0_choo_siow_heteroskedastic(
 
 
 def e0_derivative_mu_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: ThreeArrays | None = None,
 ) -> ThreeArrays:
     """Returns the derivatives of the parameter-independent part $e_0$
     wrt $\\mu$ for the Choo and Siow heteroskedastic model;
@@ -45,6 +53,7 @@ def e0_derivative_mu_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the three arrays to write the results into
 
     Returns:
         the parameter-independent part of the hessian of the entropy
@@ -52,21 +61,18 @@ def e0_derivative_mu_heteroskedastic(
     """
     muxy, mux0, *_ = muhat.unpack()
     X, Y = muxy.shape
-    mu1y = muxy[0, :]
-    mu10 = mux0[0]
-    hess_x = np.zeros((X, Y, Y))
-    hess_y = np.zeros((X, Y, X))
-    hess_xy = np.zeros((X, Y))
-    der_log1y = 1.0 / mu1y
-    der_log10 = 1.0 / mu10
-    for y in range(Y):
-        hess_x[0, y, :] = -der_log10
-        hess_xy[0, y] = -der_log1y[y] - der_log10
+    hess_x, hess_y, hess_xy = get_output_buffers(out, ((X, Y, Y), (X, Y, X), (X, Y)))
+    der_log10 = 1.0 / mux0[0]
+    hess_x[0] = -der_log10
+    hess_xy[0] = -1.0 / muxy[0] - der_log10
     return hess_x, hess_y, hess_xy
 
 
 def e0_derivative_r_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: TwoArrays | None = None,
 ) -> TwoArrays:
     """Returns the derivatives of the parameter-independent part $e_0$
     wrt $r$ for the Choo and Siow heteroskedastic model;
@@ -74,6 +80,7 @@ def e0_derivative_r_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the two arrays to write the results into
 
     Returns:
         the parameter-independent part of the hessian of the entropy
@@ -81,12 +88,8 @@ def e0_derivative_r_heteroskedastic(
     """
     muxy, mux0, *_ = muhat.unpack()
     X, Y = muxy.shape
-    mu10 = mux0[0]
-    hess_n = np.zeros((X, Y))
-    hess_m = np.zeros((X, Y))
-    der_log10 = 1.0 / mu10
-    for y in range(Y):
-        hess_n[0, y] = der_log10
+    hess_n, hess_m = get_output_buffers(out, ((X, Y), (X, Y)))
+    hess_n[0] = 1.0 / mux0[0]
     return hess_n, hess_m
 
 
@@ -97,7 +100,10 @@ e0_derivative_choo_siow_heteroskedastic = (
 
 
 def e_choo_siow_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: np.ndarray | None = None,
 ) -> np.ndarray:
     """Returns the values of the parameter-dependent part  $e$
     for the Choo and Siow heteroskedastic model;
@@ -105,28 +111,27 @@ def e_choo_siow_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the array to write the results into
 
     Returns:
         the (X,Y,X+Y-1) parameter-dependent part of the hessian of the entropy.
     """
-    muxy, mux0, mu0y, *_ = muhat.unpack()
-    X, Y = muxy.shape
+    X, Y = muhat.muxy.shape
     n_alpha = X + Y - 1
-
-    e_vals = np.zeros((X, Y, n_alpha))
-    i = 0
-    for x in range(1, X):
-        e_vals[x, :, i] = -np.log(muxy[x, :] / mux0[x])
-        i += 1
-    for y in range(Y):
-        e_vals[:, y, i] = -np.log(muxy[:, y] / mu0y[y])
-        i += 1
-
+    (e_vals,) = get_output_buffers(None if out is None else (out,), ((X, Y, n_alpha),))
+    # the parameters are sigma_2, ..., sigma_X, then tau_1, ..., tau_Y
+    ix, iy = np.arange(1, X), np.arange(Y)
+    log_muxy = muhat.log_muxy
+    e_vals[ix, :, ix - 1] = muhat.log_mux0[1:].reshape((-1, 1)) - log_muxy[1:]
+    e_vals[:, iy, X - 1 + iy] = muhat.log_mu0y - log_muxy
     return e_vals
 
 
 def e_derivative_mu_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: ThreeArrays | None = None,
 ) -> ThreeArrays:
     """Returns the derivatives of the parameter-dependent part $e$
     wrt $\\mu$ for the Choo and Siow heteroskedastic model;
@@ -134,6 +139,7 @@ def e_derivative_mu_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the three arrays to write the results into
 
     Returns:
         the parameter-dependent part of the hessian of the entropy
@@ -142,36 +148,29 @@ def e_derivative_mu_heteroskedastic(
     muxy, mux0, mu0y, *_ = muhat.unpack()
     X, Y = muxy.shape
     n_alpha = X + Y - 1
-    hess_x = np.zeros((X, Y, Y, n_alpha))
-    hess_y = np.zeros((X, Y, X, n_alpha))
-    hess_xy = np.zeros((X, Y, n_alpha))
+    hess_x, hess_y, hess_xy = get_output_buffers(
+        out, ((X, Y, Y, n_alpha), (X, Y, X, n_alpha), (X, Y, n_alpha))
+    )
 
     der_logxy = 1.0 / muxy
     der_logx0 = 1.0 / mux0
     der_log0y = 1.0 / mu0y
-    i = 0
-    for x in range(1, X):
-        # derivatives wrt sigma_x
-        dlogx0 = der_logx0[x]
-        dlogxy = der_logxy[x, :]
-        for y in range(Y):
-            hess_x[x, y, :, i] = -dlogx0
-            hess_xy[x, y, i] = -dlogxy[y] - dlogx0
-        i += 1
-    for y in range(Y):
-        # derivatives wrt tau_y
-        dlog0y = der_log0y[y]
-        dlogxy = der_logxy[:, y]
-        for x in range(X):
-            hess_y[x, y, :, i] = -dlog0y
-            hess_xy[x, y, i] = -dlogxy[x] - dlog0y
-        i += 1
+    ix, iy = np.arange(1, X), np.arange(Y)
+    # derivatives wrt sigma_x
+    hess_x[ix, :, :, ix - 1] = -der_logx0[1:].reshape((-1, 1, 1))
+    hess_xy[ix, :, ix - 1] = -der_logxy[1:] - der_logx0[1:].reshape((-1, 1))
+    # derivatives wrt tau_y
+    hess_y[:, iy, :, X - 1 + iy] = -der_log0y.reshape((-1, 1, 1))
+    hess_xy[:, iy, X - 1 + iy] = -der_logxy - der_log0y
 
     return hess_x, hess_y, hess_xy
 
 
 def e_derivative_r_heteroskedastic(
-    muhat: Matching, additional_parameters: list | None = None
+    muhat: Matching,
+    additional_parameters: list | None = None,
+    *,
+    out: TwoArrays | None = None,
 ) -> TwoArrays:
     """Returns the derivatives of the parameter-dependent part $e$
     wrt $r$ for the Choo and Siow heteroskedastic model;
@@ -179,6 +178,7 @@ def e_derivative_r_heteroskedastic(
 
     Args:
         muhat: a Matching
+        out: if given, the two arrays to write the results into
 
     Returns:
         the parameter-dependent part of the hessian of the entropy
@@ -187,24 +187,13 @@ def e_derivative_r_heteroskedastic(
     muxy, mux0, mu0y, *_ = muhat.unpack()
     X, Y = muxy.shape
     n_alpha = X + Y - 1
-    hess_n = np.zeros((X, Y, n_alpha))
-    hess_m = np.zeros((X, Y, n_alpha))
+    hess_n, hess_m = get_output_buffers(out, ((X, Y, n_alpha), (X, Y, n_alpha)))
 
-    der_logx0 = 1.0 / mux0
-    der_log0y = 1.0 / mu0y
-    i = 0
-    for x in range(1, X):
-        # derivatives wrt sigma_x
-        dlogx0 = der_logx0[x]
-        for y in range(Y):
-            hess_n[x, y, i] = dlogx0
-        i += 1
-    for y in range(Y):
-        # derivatives wrt tau_y
-        dlog0y = der_log0y[y]
-        for x in range(X):
-            hess_m[x, y, i] = dlog0y
-        i += 1
+    ix, iy = np.arange(1, X), np.arange(Y)
+    # derivatives wrt sigma_x
+    hess_n[ix, :, ix - 1] = (1.0 / mux0[1:]).reshape((-1, 1))
+    # derivatives wrt tau_y
+    hess_m[:, iy, X - 1 + iy] = 1.0 / mu0y
 
     return hess_n, hess_m
 
@@ -214,6 +203,83 @@ e_derivative_choo_siow_heteroskedastic = (
     e_derivative_r_heteroskedastic,
 )
 
+
+def _split_alpha_heteroskedastic(
+    alpha: np.ndarray, X: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """returns the X values of $\\sigma_x$, with 0 for the normalized $x=1$,
+    and the Y values of $\\tau_y$"""
+    sigma_x = np.concatenate((np.zeros(1), alpha[: (X - 1)]))
+    tau_y = alpha[(X - 1) :]
+    return sigma_x, tau_y
+
+
+def e_derivative_mu_heteroskedastic_alpha(
+    muhat: Matching,
+    alpha: np.ndarray,
+    additional_parameters: list | None = None,
+    *,
+    out: ThreeArrays | None = None,
+) -> ThreeArrays:
+    """Returns the derivatives of $e \\cdot \\alpha$
+    wrt $\\mu$ for the Choo and Siow heteroskedastic model;
+    we normalized $\\sigma_1=1$
+
+    Args:
+        muhat: a Matching
+        alpha: the X+Y-1 parameters $(\\sigma_2, \\ldots, \\sigma_X, \\tau_1, \\ldots, \\tau_Y)$
+        out: if given, the three arrays to write the results into
+
+    Returns:
+        the parameter-dependent part of the hessian of the entropy
+        wrt $(\\mu,\\mu)$, contracted with `alpha`.
+    """
+    muxy, mux0, mu0y, *_ = muhat.unpack()
+    X, Y = muxy.shape
+    hess_x, hess_y, hess_xy = get_output_buffers(out, ((X, Y, Y), (X, Y, X), (X, Y)))
+    sigma_x, tau_y = _split_alpha_heteroskedastic(alpha, X)
+    sig_x0 = sigma_x / mux0
+    tau_0y = tau_y / mu0y
+    hess_x[...] = -sig_x0.reshape((X, 1, 1))
+    hess_y[...] = -tau_0y.reshape((1, Y, 1))
+    hess_xy[...] = -np.add.outer(sigma_x, tau_y) / muxy - np.add.outer(sig_x0, tau_0y)
+    return hess_x, hess_y, hess_xy
+
+
+def e_derivative_r_heteroskedastic_alpha(
+    muhat: Matching,
+    alpha: np.ndarray,
+    additional_parameters: list | None = None,
+    *,
+    out: TwoArrays | None = None,
+) -> TwoArrays:
+    """Returns the derivatives of $e \\cdot \\alpha$
+    wrt $r$ for the Choo and Siow heteroskedastic model;
+    we normalized $\\sigma_1=1$
+
+    Args:
+        muhat: a Matching
+        alpha: the X+Y-1 parameters $(\\sigma_2, \\ldots, \\sigma_X, \\tau_1, \\ldots, \\tau_Y)$
+        out: if given, the two arrays to write the results into
+
+    Returns:
+        the parameter-dependent part of the hessian of the entropy
+        wrt $(\\mu,r)$, contracted with `alpha`.
+    """
+    muxy, mux0, mu0y, *_ = muhat.unpack()
+    X, Y = muxy.shape
+    hess_n, hess_m = get_output_buffers(out, ((X, Y), (X, Y)))
+    sigma_x, tau_y = _split_alpha_heteroskedastic(alpha, X)
+    hess_n[...] = (sigma_x / mux0).reshape((X, 1))
+    hess_m[...] = tau_y / mu0y
+    return hess_n, hess_m
+
+
+e_derivative_alpha_choo_siow_heteroskedastic = (
+    e_derivative_mu_heteroskedastic_alpha,
+    e_derivative_r_heteroskedastic_alpha,
+)
+
 entropy_choo_siow_heteroskedastic = EntropyFunctions(
     e0_fun=e0_choo_siow_heteroskedastic,
     parameter_dependent=True,
@@ -221,6 +287,9 @@ entropy_choo_siow_heteroskedastic = EntropyFunctions(
     hessian="provided",
     e0_derivative=cast(EntropyHessians, e0_derivative_choo_siow_heteroskedastic),
     e_derivative=cast(EntropyHessians, e_derivative_choo_siow_heteroskedastic),
+    e_derivative_alpha=cast(
+        EntropyHessiansAlpha, e_derivative_alpha_choo_siow_heteroskedastic
+    ),
     description="Choo and Siow heteroskedastic with analytic Hessian",
 )
 
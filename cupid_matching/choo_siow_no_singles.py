@@ -3,14 +3,16 @@
 from typing import cast
 
 import numpy as np
+import scipy.sparse as sp
 from bs_python_utils.bsnputils import ThreeArrays, TwoArrays, bs_error_abort
 
+from cupid_matching.choo_siow import _map_stored
 from cupid_matching.entropy import (
     EntropyFunctions,
     EntropyHessians,
     check_additional_parameters,
 )
-from cupid_matching.matching_utils import Matching
+from cupid_matching.matching_utils import Matching, MatchingBatch
 
 
 def _entropy_choo_siow_no_singles(
@@ -39,9 +41,7 @@ def _entropy_choo_siow_no_singles(
     """
     muxy, *_, n, m = muhat.unpack()
 
-    logxy = np.log(muxy)
-    logn = np.log(n)
-    logm = np.log(m)
+    logxy, logn, logm = muhat.log_muxy, muhat.log_n, muhat.log_m
 
     val_entropy = -2.0 * np.sum(muxy * logxy) + np.sum(n * logn) + np.sum(m * logm)
 
@@ -65,13 +65,14 @@ def _entropy_choo_siow_no_singles(
 
 
 def _der_entropy_choo_siow_no_singles_corrected(
-    muhat: Matching, hessian: bool | None = False
+    muhat: Matching | MatchingBatch, hessian: bool | None = False
 ) -> np.ndarray | ThreeArrays:
     """Returns the corrected first derivative of $\\mathcal{E}$ and the corrected second derivative (if `hessian` is True)
         for the Choo and Siow model w/o singles
 
     Args:
-        muhat: a `Matching`
+        muhat: a `Matching`, or a `MatchingBatch` if `hessian` is False;
+            the `Matching` may have a sparse `muxy` if `hessian` is False
         hessian: if `True`, also compute_ the hessian
 
     Returns:
@@ -80,12 +81,17 @@ def _der_entropy_choo_siow_no_singles_corrected(
           and the (X,Y,X+Y) second derivatives wrt $(\\mu,(n,m))$
     """
     muxy, *_ = muhat.unpack()
-    n_households = np.sum(muxy)
+    if hessian and (isinstance(muhat, MatchingBatch) or sp.issparse(muxy)):
+        bs_error_abort("We only compute the hessian for a Matching with a dense muxy.")
+    n_households = np.asarray(muhat.n_couples)
+    if isinstance(muhat, MatchingBatch):
+        # one number of households per matching
+        n_households = n_households[:, np.newaxis, np.newaxis]
 
-    muxy_corr = muxy + (1.0 - muxy / n_households) / 2.0
-    logxy = np.log(muxy_corr)
+    muxy_corr = _map_stored(lambda mu: mu + (1.0 - mu / n_households) / 2.0, muxy)
+    logxy = _map_stored(np.log, muxy_corr)
 
-    der_xy = -2.0 * (logxy + 1.0)
+    der_xy = _map_stored(lambda logmu: -2.0 * (logmu + 1.0), logxy)
     if not hessian:
         return der_xy
     else:  # we compute_ the Hessians
@@ -101,36 +107,37 @@ def _der_entropy_choo_siow_no_singles_corrected(
 
 
 def e0_fun_choo_siow_no_singles(
-    muhat: Matching,
+    muhat: Matching | MatchingBatch,
     additional_parameters: list | None = None,
 ) -> np.ndarray:
     """Returns the values of $e_0$ for the Choo and Siow model w/o singles.
 
     Args:
-        muhat: a `Matching`
+        muhat: a `Matching`, or a `MatchingBatch` of B matchings
 
     Returns:
-        the `(X,Y)` matrix of the first derivative of the entropy
+        the `(X,Y)` matrix of the first derivative of the entropy;
+        a `(B,X,Y)` array for a `MatchingBatch`;
+        a sparse matrix with the same stored cells if `muhat.muxy` is sparse
     """
     check_additional_parameters(0, additional_parameters)
-    _, der_entropy = cast(
-        tuple[float, np.ndarray], _entropy_choo_siow_no_singles(muhat, deriv=1)
-    )
-    return der_entropy
+    return _map_stored(lambda logmu: -2.0 * (logmu + 1.0), muhat.log_muxy)
 
 
 def e0_fun_choo_siow_no_singles_corrected(
-    muhat: Matching,
+    muhat: Matching | MatchingBatch,
     additional_parameters: list | None = None,
 ) -> np.ndarray:
     """Returns the values of $e_0$ for the Choo and Siow model,
         using the finite-sample correction $\\log(p+(1-p)/(2N))$
 
     Args:
-        muhat: a `Matching`
+        muhat: a `Matching`, or a `MatchingBatch` of B matchings
 
     Returns:
-        the (X,Y) matrix of the first derivative of the entropy
+        the (X,Y) matrix of the first derivative of the entropy;
+        a `(B,X,Y)` array for a `MatchingBatch`;
+        a sparse matrix with the same stored cells if `muhat.muxy` is sparse
     """
     check_additional_parameters(0, additional_parameters)
     e0_val_corrected = _der_entropy_choo_siow_no_singles_corrected(muhat, hessian=False)
@@ -5,17 +5,19 @@ import pandas as pd
 import streamlit as st
 from bs_python_utils.bsnputils import nprepeat_col, nprepeat_row
 
-from cupid_matching.choo_siow import entropy_choo_siow
 from cupid_matching.cupid_streamlit_utils import (
+    cancel_stale_estimates,
     download_parameters_results,
+    iter_completed,
     make_margins,
     plot_heatmap,
     plot_matching,
+    simulate_choo_siow,
+    submit_estimates,
     table_estimates,
 )
-from cupid_matching.min_distance import estimate_semilinear_mde
-from cupid_matching.model_classes import ChooSiowPrimitives
-from cupid_matching.poisson_glm import choo_siow_poisson_glm
+
+MAX_ESTIMATION_CELLS = 2_500
 
 summary_file_name = "summary.txt"  # simulation will be domwloaded there on request
 
@@ -76,12 +78,15 @@ list_nhh = [10_000, 100_000, 1_000_000]
 st.sidebar.subheader("First, choose the total number of households")
 n_households = cast(int, st.sidebar.radio("Number of households", list_nhh))
 
-list_ncat = [2, 3, 5, 10]
+list_ncat = [2, 3, 5, 10, 20, 50, 100]
 st.sidebar.subheader("Now choose the numbers of types of each gender")
 ncat_men = cast(int, st.sidebar.radio("Number of categories of men", list_ncat))
 ncat_women = cast(int, st.sidebar.radio("Number of categories of women", list_ncat))
 
 enough_cells = (ncat_men - 1) * (ncat_women - 1) > 6
+# the variance of the matching patterns has (XY+X+Y)^2 elements,
+#   so we only estimate on the smaller markets
+can_estimate = enough_cells and ncat_men * ncat_women <= MAX_ESTIMATION_CELLS
 
 xvals = np.arange(ncat_men) + 1
 yvals = np.arange(ncat_women) + 1
@@ -127,20 +132,40 @@ if enough_cells:
 
     st.sidebar.write("Finally, choose the coefficients of the 6 basis functions:")
     st.sidebar.latex(r"\Phi_{xy}=c_0+c_1 x + c_2 y + c_3 x^2 + c_4 x y + c_5 y^2")
-    min_c = np.array([-3.0] + [-2.0 / ncat_men] * 5)
-    max_c = np.array([3.0] + [2.0 / ncat_women] * 5)
+    # each coefficient is scaled by the largest value of its basis function,
+    #   so that Phi stays moderate in markets with many types
+    max_c = 2.0 * np.array(
+        [
+            1.5,
+            1.0 / ncat_men,
+            1.0 / ncat_women,
+            1.0 / ncat_men**2,
+            1.0 / (ncat_men * ncat_women),
+            1.0 / ncat_women**2,
+        ]
+    )
+    min_c = -max_c
+    step_c = (max_c - min_c) / 200
     true_coeffs = np.zeros(6)
     coeff_names = [f"c[{i}]" for i in range(6)]
 
-    if "randoms" not in st.session_state:
-        random_coeffs = np.round(min_c + (max_c - min_c) * np.random.rand(6), 2)
+    # new random coefficients when the numbers of types change
+    randoms_key = (ncat_men, ncat_women)
+    if st.session_state.get("randoms_key") != randoms_key:
+        random_coeffs = min_c + step_c * np.random.randint(0, 201, size=6)
         st.session_state.randoms = random_coeffs
+        st.session_state.randoms_key = randoms_key
 
     random_coeffs = st.session_state["randoms"]
     for i in range(6):
         val_i = float(random_coeffs[i])
         true_coeffs[i] = st.sidebar.slider(
-            coeff_names[i], min_value=min_c[i], max_value=max_c[i], value=val_i
+            coeff_names[i],
+            min_value=min_c[i],
+            max_value=max_c[i],
+            value=val_i,
+            step=float(step_c[i]),
+            format="%.3g",
         )
 
     Phi = bases @ true_coeffs
@@ -195,28 +220,38 @@ else:
 
 
 st.subheader("Here is your joint surplus by categories:")
-st.altair_chart(plot_heatmap(Phi, ".2f"))
+st.altair_chart(plot_heatmap(Phi, ".2f", average=True))
 
-cs_market = ChooSiowPrimitives(Phi, nx, my)
+# the seed is drawn once per session, so that reruns with unchanged inputs
+#   reuse the cached simulations and estimates
+if "seed" not in st.session_state:
+    st.session_state.seed = int(np.random.default_rng().integers(2**31))
+seed = st.session_state["seed"]
 
 st.subheader(
     f"Here are the stable matching patterns in a sample of {n_households} households:"
 )
 
-mus_sim = cs_market.simulate(n_households)
+mus_sim = simulate_choo_siow(Phi, nx, my, n_households, seed)
 muxy_sim, mux0_sim, mu0y_sim, n_sim, m_sim = mus_sim.unpack()
 
 st.altair_chart(plot_matching(mus_sim))
 
 do_estimates = False
 
-if enough_cells:
+if can_estimate:
     st.subheader(
         "Estimating the parameters of the quadratic joint surplus $\\mathbb{\\Phi}$"
     )
 
+    market_args = (Phi, nx, my, n_households, seed, bases)
+    # estimates requested for inputs that have since changed are cancelled
+    cancel_stale_estimates(market_args)
+
     if st.button("Estimate"):
         do_estimates = True
+        # the two estimators run concurrently; we show each as soon as it is done
+        futures = submit_estimates(market_args)
         col1, col2 = st.columns(2)
         with col1:
             st.markdown(
@@ -224,23 +259,6 @@ if enough_cells:
                 " (2023)."
             )
             st.write("It also gives us a specification test.")
-            mde_results = estimate_semilinear_mde(mus_sim, bases, entropy_choo_siow)
-            mde_estimates = mde_results.estimated_coefficients
-            mde_stderrs = mde_results.stderrs_coefficients
-
-            df_mde = table_estimates(
-                coeff_names, true_coeffs, mde_estimates, mde_stderrs
-            )
-            st.table(df_mde)
-
-            specif_test_stat = round(mde_results.test_statistic, 2)
-            specif_test_pval = round(mde_results.test_pvalue, 2)
-            st.write(
-                f"Test statistic: chi2({mde_results.ndf}) = {specif_test_stat} has"
-                f" p-value {specif_test_pval}"
-            )
-            mde_test_results = (mde_results.ndf, specif_test_stat, specif_test_pval)
-
         with col2:
             st.markdown(
                 "#### Here is the Poisson GLM estimator in Galichon and Salanié (2023);"
@@ -254,33 +272,60 @@ if enough_cells:
                 "It also gives us the estimates of the expected utilities $u_x$ and"
                 " $v_y$."
             )
-
-            pglm_results = choo_siow_poisson_glm(mus_sim, bases)
-
-            u = pglm_results.estimated_u
-            v = pglm_results.estimated_v
-            pglm_estimates = pglm_results.estimated_beta
-            pglm_stderrs = pglm_results.stderrs_beta
-
-            df_poisson = table_estimates(
-                coeff_names, true_coeffs, pglm_estimates, pglm_stderrs
-            )
-            st.table(df_poisson)
-
-            x_names = [str(x) for x in range(ncat_men)]
-            y_names = [str(y) for y in range(ncat_women)]
-
-            st.write("The expected utilities are:")
-            df_u_estimates = pd.DataFrame(
-                {"Estimated": u, "True": -np.log(mux0_sim / n_sim)},
-                index=x_names,
-            )
-            st.table(df_u_estimates)
-            df_v_estimates = pd.DataFrame(
-                {"Estimated": v, "True": -np.log(mu0y_sim / m_sim)},
-                index=y_names,
-            )
-            st.table(df_v_estimates)
+        progress_bar = st.progress(0.0, text="Estimating...")
+
+        for estimator in iter_completed(futures, progress_bar):
+            if estimator == "mde":
+                with col1:
+                    mde_results = futures["mde"].result()
+                    mde_estimates = mde_results.estimated_coefficients
+                    mde_stderrs = mde_results.stderrs_coefficients
+
+                    df_mde = table_estimates(
+                        coeff_names, true_coeffs, mde_estimates, mde_stderrs
+                    )
+                    st.table(df_mde)
+
+                    specif_test_stat = round(mde_results.test_statistic, 2)
+                    specif_test_pval = round(mde_results.test_pvalue, 2)
+                    st.write(
+                        f"Test statistic: chi2({mde_results.ndf}) ="
+                        f" {specif_test_stat} has p-value {specif_test_pval}"
+                    )
+                    mde_test_results = (
+                        mde_results.ndf,
+                        specif_test_stat,
+                        specif_test_pval,
+                    )
+            else:
+                with col2:
+                    pglm_results = futures["poisson_glm"].result()
+
+                    u = pglm_results.estimated_u
+                    v = pglm_results.estimated_v
+                    pglm_estimates = pglm_results.estimated_beta
+                    pglm_stderrs = pglm_results.stderrs_beta
+
+                    df_poisson = table_estimates(
+                        coeff_names, true_coeffs, pglm_estimates, pglm_stderrs
+                    )
+                    st.table(df_poisson)
+
+                    x_names = [str(x) for x in range(ncat_men)]
+                    y_names = [str(y) for y in range(ncat_women)]
+
+                    st.write("The expected utilities are:")
+                    df_u_estimates = pd.DataFrame(
+                        {"Estimated": u, "True": -np.log(mux0_sim / n_sim)},
+                        index=x_names,
+                    )
+                    st.table(df_u_estimates)
+                    df_v_estimates = pd.DataFrame(
+                        {"Estimated": v, "True": -np.log(mu0y_sim / m_sim)},
+                        index=y_names,
+                    )
+                    st.table(df_v_estimates)
+        progress_bar.empty()
         pars_res = cast(
             Any,
             (
@@ -319,6 +364,11 @@ if enough_cells:
         )
         download_parameters_results(summary_file_name, False, pars_res)
 else:
+    if enough_cells:
+        st.write(
+            f"With more than {MAX_ESTIMATION_CELLS} cells, we do not estimate"
+            " the joint surplus in the app."
+        )
     pars_res = cast(
         Any, (ncat_men, ncat_women, n_sim, m_sim, Phi, muxy_sim, mux0_sim, mu0y_sim)
     )
@@ -1,4 +1,14 @@
-from math import pow
+from collections.abc import Callable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from math import ceil, pow, prod, sqrt
+from threading import Event
+from time import perf_counter
 from typing import Any, cast
 
 from altair import ConcatChart, LayerChart, VConcatChart
@@ -10,7 +20,26 @@ import streamlit as st
 from bs_python_utils.bsnputils import check_matrix, check_vector
 from bs_python_utils.bsutils import bs_error_abort
 
+from cupid_matching.choo_siow import entropy_choo_siow
 from cupid_matching.matching_utils import Matching
+from cupid_matching.min_distance import estimate_semilinear_mde
+from cupid_matching.min_distance_utils import MDEResults
+from cupid_matching.model_classes import ChooSiowPrimitives
+from cupid_matching.poisson_glm import choo_siow_poisson_glm
+from cupid_matching.poisson_glm_utils import PoissonGLMResults
+from cupid_matching.prepared_market import PreparedMarket
+
+# the number of parameter configurations whose results we keep across reruns
+MAX_CACHE_ENTRIES = 32
+# the number of threads that run the estimators, shared by all sessions
+MAX_ESTIMATION_WORKERS = 4
+# how often we update the progress bar while the estimators run, in seconds
+_POLL_SECONDS = 0.1
+# the size budget of the charts: heatmaps with more cells are plotted as rectangles
+#   and by groups of types, so that at most MAX_CHART_CELLS cells reach the browser
+MAX_LABELED_CELLS = 100
+MAX_CHART_CELLS = 2_500
+MAX_CHART_BARS = 50
 
 
 def _make_profile(lambda_val: float, n: float, ncat: int) -> np.ndarray:
@@ -56,6 +85,215 @@ def make_margins(n: float, ncat: int, scenario: str = "Constant") -> np.ndarray:
     return n_types
 
 
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner="Simulating...")
+def simulate_choo_siow(
+    Phi: np.ndarray, nx: np.ndarray, my: np.ndarray, n_households: int, seed: int
+) -> Matching:
+    """solves for the stable matching and draws a sample from it;
+    cached across reruns of the app
+
+    Args:
+        Phi: the joint surplus
+        nx: the numbers of men of each type
+        my: the numbers of women of each type
+        n_households: the number of households in the sample
+        seed: the seed of the random draws
+
+    Returns:
+        the simulated `Matching`
+    """
+    return ChooSiowPrimitives(Phi, nx, my).simulate(n_households, seed=seed)
+
+
+@st.cache_resource(max_entries=MAX_CACHE_ENTRIES)
+def _prepared_market(
+    Phi: np.ndarray,
+    nx: np.ndarray,
+    my: np.ndarray,
+    n_households: int,
+    seed: int,
+    bases: np.ndarray,
+) -> PreparedMarket:
+    """the simulated market, shared by the two estimators so that they
+    compute the variance of the matching patterns once"""
+    mus_sim = simulate_choo_siow(Phi, nx, my, n_households, seed)
+    prepared_market = PreparedMarket(mus_sim, bases)
+    # the cached properties of `PreparedMarket` have no lock, so we fill them here,
+    #   where `st.cache_resource` serializes the calls of the worker threads
+    _ = prepared_market.var_muhat, prepared_market.phi_mat
+    prepared_market.glm_data()
+    prepared_market.glm_design()
+    return prepared_market
+
+
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner="Estimating...")
+def estimate_choo_siow_mde(
+    Phi: np.ndarray,
+    nx: np.ndarray,
+    my: np.ndarray,
+    n_households: int,
+    seed: int,
+    bases: np.ndarray,
+) -> MDEResults:
+    """the minimum distance estimates on the sample of `simulate_choo_siow`;
+    cached across reruns of the app
+
+    Args:
+        Phi: the joint surplus
+        nx: the numbers of men of each type
+        my: the numbers of women of each type
+        n_households: the number of households in the sample
+        seed: the seed of the random draws
+        bases: the (X, Y, K) bases
+
+    Returns:
+        the `MDEResults`
+    """
+    prepared_market = _prepared_market(Phi, nx, my, n_households, seed, bases)
+    return estimate_semilinear_mde(prepared_market, None, entropy_choo_siow)
+
+
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES, show_spinner="Estimating...")
+def estimate_choo_siow_poisson_glm(
+    Phi: np.ndarray,
+    nx: np.ndarray,
+    my: np.ndarray,
+    n_households: int,
+    seed: int,
+    bases: np.ndarray,
+) -> PoissonGLMResults:
+    """the Poisson GLM estimates on the sample of `simulate_choo_siow`;
+    cached across reruns of the app
+
+    Args:
+        Phi: the joint surplus
+        nx: the numbers of men of each type
+        my: the numbers of women of each type
+        n_households: the number of households in the sample
+        seed: the seed of the random draws
+        bases: the (X, Y, K) bases
+
+    Returns:
+        the `PoissonGLMResults`
+    """
+    prepared_market = _prepared_market(Phi, nx, my, n_households, seed, bases)
+    return choo_siow_poisson_glm(prepared_market)
+
+
+@st.cache_resource
+def _estimation_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=MAX_ESTIMATION_WORKERS, thread_name_prefix="cupid_estimation"
+    )
+
+
+def _market_key(market_args: tuple) -> tuple:
+    return tuple(
+        arg.tobytes() if isinstance(arg, np.ndarray) else arg for arg in market_args
+    )
+
+
+def _run_estimator(
+    estimator: Callable[..., Any], market_args: tuple, cancelled: Event
+) -> Any:
+    """runs `estimator` in a worker thread, in two stages: the simulated
+    `PreparedMarket`, then the estimation on it; we stop before each stage
+    if the session has moved on to other inputs in the meantime
+
+    Args:
+        estimator: `estimate_choo_siow_mde` or `estimate_choo_siow_poisson_glm`
+        market_args: `(Phi, nx, my, n_households, seed, bases)`
+        cancelled: set by `cancel_stale_estimates`
+
+    Returns:
+        the results of `estimator`
+    """
+    if cancelled.is_set():
+        raise CancelledError
+    _prepared_market(*market_args)
+    if cancelled.is_set():
+        raise CancelledError
+    return estimator(*market_args)
+
+
+def cancel_stale_estimates(market_args: tuple) -> None:
+    """cancels the estimates that this session requested for other inputs:
+    those that have not started are dropped from the queue, and those
+    that have started stop before their next stage; a stage that is running
+    (the `PreparedMarket` or the estimation) completes and only fills the cache
+
+    Args:
+        market_args: the current `(Phi, nx, my, n_households, seed, bases)`
+    """
+    previous: tuple[tuple, dict[str, Future], Event] | None = st.session_state.get(
+        "estimates"
+    )
+    if previous is not None and previous[0] != _market_key(market_args):
+        _, previous_futures, cancelled = previous
+        cancelled.set()
+        for future in previous_futures.values():
+            future.cancel()
+        del st.session_state["estimates"]
+
+
+def submit_estimates(market_args: tuple) -> dict[str, Future]:
+    """runs the two estimators concurrently in a pool of threads,
+    unless this session already requested them for the same inputs
+
+    Args:
+        market_args: `(Phi, nx, my, n_households, seed, bases)`
+
+    Returns:
+        the futures of the `MDEResults` and of the `PoissonGLMResults`,
+        under the keys `"mde"` and `"poisson_glm"`
+    """
+    cancel_stale_estimates(market_args)
+    previous: tuple[tuple, dict[str, Future], Event] | None = st.session_state.get(
+        "estimates"
+    )
+    if previous is not None:
+        return previous[1]
+    pool = _estimation_pool()
+    cancelled = Event()
+    futures = {
+        "mde": pool.submit(
+            _run_estimator, estimate_choo_siow_mde, market_args, cancelled
+        ),
+        "poisson_glm": pool.submit(
+            _run_estimator, estimate_choo_siow_poisson_glm, market_args, cancelled
+        ),
+    }
+    st.session_state.estimates = (_market_key(market_args), futures, cancelled)
+    return futures
+
+
+def iter_completed(futures: dict[str, Future], progress_bar: Any) -> Iterator[str]:
+    """yields the names of the futures as they complete, updating a progress bar
+
+    Args:
+        futures: the futures, by name
+        progress_bar: the `st.progress` element to update
+
+    Returns:
+        an iterator over the names
+    """
+    names = {future: name for name, future in futures.items()}
+    pending = set(names)
+    time_start = perf_counter()
+    while pending:
+        done, pending = wait(
+            pending, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED
+        )
+        n_done = len(futures) - len(pending)
+        progress_bar.progress(
+            n_done / len(futures),
+            text=f"{n_done} of {len(futures)} estimators done"
+            f" after {perf_counter() - time_start:.1f}s",
+        )
+        for future in done:
+            yield names[future]
+
+
 def table_estimates(
     coeff_names: list[str],
     true_coeffs: np.ndarray,
@@ -85,48 +323,112 @@ def table_estimates(
     return df_coeffs_estimates
 
 
+def group_types(
+    mat: np.ndarray, max_cells: int, average: bool = False
+) -> tuple[np.ndarray, int]:
+    """merges blocks of consecutive types of men and of women
+    until the matrix has at most `max_cells` cells
+
+    Args:
+        mat: an (X, Y) matrix, or an X-vector
+        max_cells: the largest number of cells we keep
+        average: if `True`, we average the cells of each block; otherwise we sum them
+
+    Returns:
+        the matrix on the groups of types, and the number of types in each group
+    """
+    shape = mat.shape
+    n_cells = mat.size
+    group_size = max(1, ceil(sqrt(n_cells / max_cells)))
+    while prod(ceil(n / group_size) for n in shape) > max_cells:
+        group_size += 1
+    if group_size == 1:
+        return mat, 1
+    grouped = mat
+    n_per_group = np.ones(1)
+    for axis, n in enumerate(shape):
+        starts = np.arange(0, n, group_size)
+        grouped = np.add.reduceat(grouped, starts, axis=axis)
+        n_per_group = np.multiply.outer(n_per_group, np.diff(starts, append=n))
+    if average:
+        grouped = grouped / n_per_group.reshape(grouped.shape)
+    return grouped, group_size
+
+
 def plot_heatmap(
-    mat: np.ndarray, str_format: str, str_tit: str | None = None
-) -> LayerChart:
+    mat: np.ndarray,
+    str_format: str,
+    str_tit: str | None = None,
+    average: bool = False,
+) -> LayerChart | alt.Chart:
     """Plots a heatmap of the matrix
 
+    Up to `MAX_LABELED_CELLS` cells, each cell is a labeled circle.
+    Larger matrices are plotted as colored rectangles, after merging blocks
+    of types so that at most `MAX_CHART_CELLS` cells are sent to the browser.
+
     Args:
         mat: the matrix to plot
+        str_format: the format of the values
         str_tit: a title, if any
+        average: if `True`, merged cells are averaged (e.g. for the joint surplus);
+            otherwise they are summed (e.g. for numbers of couples)
 
     Returns:
         the heatmap
     """
-    ncat_men, ncat_women = check_matrix(mat)
-    mat_arr = np.empty((mat.size, 4), dtype=int)
-    imat = np.round(mat)
-    mat_min = np.min(imat)
-    i = 0
-    for ix in range(ncat_men):
-        for iy in range(ncat_women):
-            m = imat[ix, iy]
-            s = m - mat_min + 1
-            mat_arr[i, :] = np.array([ix, iy, m, s])
-            i += 1
-
-    mat_df = pd.DataFrame(mat_arr, columns=["Men", "Women", "Value", "Size"])
-    mat_df = mat_df.astype(
-        dtype={"Men": int, "Women": int, "Value": int, "Size": float}
-    )
-    base = alt.Chart(mat_df).encode(x="Men:O", y=alt.Y("Women:O", sort="descending"))
-    mat_map = base.mark_circle(opacity=0.4).encode(
-        size=alt.Size("Size:Q", legend=None, scale=alt.Scale(range=[1000, 10000])),
-        # color=alt.Color("Value:Q"),
-        # tooltip=alt.Tooltip('Value', format=".2f")
-    )
-    text = base.mark_text(baseline="middle", fontSize=16).encode(
-        text=alt.Text("Value:Q", format=str_format),
-    )
+    _, ncat_women = check_matrix(mat)
+    width, height = (500, 500) if str_tit is None else (400, 400)
+    if mat.size <= MAX_LABELED_CELLS:
+        imat = np.round(mat)
+        men, women = np.divmod(np.arange(mat.size), ncat_women)
+        mat_df = pd.DataFrame(
+            {
+                "Men": men,
+                "Women": women,
+                "Value": imat.ravel().astype(int),
+                "Size": (imat - np.min(imat) + 1).ravel().astype(float),
+            }
+        )
+        base = alt.Chart(mat_df).encode(
+            x="Men:O", y=alt.Y("Women:O", sort="descending")
+        )
+        mat_map = base.mark_circle(opacity=0.4).encode(
+            size=alt.Size("Size:Q", legend=None, scale=alt.Scale(range=[1000, 10000])),
+            # color=alt.Color("Value:Q"),
+            # tooltip=alt.Tooltip('Value', format=".2f")
+        )
+        text = base.mark_text(baseline="middle", fontSize=16).encode(
+            text=alt.Text("Value:Q", format=str_format),
+        )
+        chart = mat_map + text
+    else:
+        grouped, group_size = group_types(mat, MAX_CHART_CELLS, average=average)
+        n_groups_women = grouped.shape[1]
+        men, women = np.divmod(np.arange(grouped.size), n_groups_women)
+        mat_df = pd.DataFrame(
+            {
+                "Men": men * group_size,
+                "Women": women * group_size,
+                "Value": grouped.ravel(),
+            }
+        )
+        types_str = "" if group_size == 1 else f" (by groups of {group_size} types)"
+        chart = (
+            alt.Chart(mat_df)
+            .mark_rect()
+            .encode(
+                x=alt.X("Men:O", title=f"Men{types_str}"),
+                y=alt.Y("Women:O", sort="descending", title=f"Women{types_str}"),
+                color=alt.Color("Value:Q", legend=None),
+                tooltip=["Men:O", "Women:O", alt.Tooltip("Value:Q", format=str_format)],
+            )
+        )
     if str_tit is None:
-        both = (mat_map + text).properties(width=500, height=500)
+        both = chart.properties(width=width, height=height)
     else:
-        both = (mat_map + text).properties(title=str_tit, width=400, height=400)
-    return cast(LayerChart, both)
+        both = chart.properties(title=str_tit, width=width, height=height)
+    return cast(LayerChart | alt.Chart, both)
 
 
 def _gender_singles(xvals: np.ndarray, str_gender: str) -> alt.Chart:
@@ -145,7 +447,10 @@ def _gender_singles(xvals: np.ndarray, str_gender: str) -> alt.Chart:
     str_cat = "x" if str_gender == "men" else "y"
     str_val = f"Single {str_gender}"
     color_bar = "pink" if str_gender == "women" else "lightblue"
-    source = pd.DataFrame({str_cat: np.arange(1, ncat + 1, dtype=int), str_val: xvals})
+    grouped, group_size = group_types(xvals, MAX_CHART_BARS)
+    source = pd.DataFrame(
+        {str_cat: np.arange(1, ncat + 1, group_size, dtype=int), str_val: grouped}
+    )
 
     g_bars = (
         alt.Chart(source)
@@ -55,12 +55,39 @@ class EntropyHessianMuR(Protocol):
     """
 
 
+class EntropyHessianMuMuAlpha(Protocol):
+    def __call__(
+        self, mus: Matching, alpha: np.ndarray, additional_parameters=..., /
+    ) -> ThreeArrays: ...
+
+    """The type of a function that takes in a `Matching`, a vector of parameters $\\alpha$,
+    and possibly a list of additional parameters,
+    and returns the three components of the hessian of $e \\cdot \\alpha$
+    wrt $(\\mu,\\mu)$.
+    """
+
+
+class EntropyHessianMuRAlpha(Protocol):
+    def __call__(
+        self, mus: Matching, alpha: np.ndarray, additional_parameters=..., /
+    ) -> TwoArrays: ...
+
+    """The type of a function that takes in a `Matching`, a vector of parameters $\\alpha$,
+    and possibly a list of additional parameters,
+    and returns the two components of the hessian of $e \\cdot \\alpha$
+    wrt $(\\mu,n)$ and $(\\mu, m))$.
+    """
+
+
 EntropyHessianComponents = tuple[ThreeArrays, TwoArrays]
 """ combines the tuples of the values of the components of the hessians."""
 
 EntropyHessians = tuple[EntropyHessianMuMu, EntropyHessianMuR]
 """ combines the hessian functions. """
 
+EntropyHessiansAlpha = tuple[EntropyHessianMuMuAlpha, EntropyHessianMuRAlpha]
+""" combines the hessian functions contracted with $\\alpha$. """
+
 
 @dataclass
 class EntropyFunctions:
@@ -79,6 +106,10 @@ class EntropyFunctions:
             Defaults to `None`
         e_derivative: the derivative of `e_fun`, if available.
             Defaults to `None`
+        e_derivative_alpha: the derivative of `e_fun` contracted
+            with a vector of parameters $\\alpha$, if available;
+            it avoids storing the derivative for each parameter.
+            Defaults to `None`
         additional_parameters: additional parameters
             that define the distribution of errors.
             Defaults to `None`
@@ -96,6 +127,7 @@ class EntropyFunctions:
     # e_fun: MatchingFunction | MatchingFunctionParam | None = None
     e_fun: MatchingFunction | None = None
     e_derivative: EntropyHessians | None = None
+    e_derivative_alpha: EntropyHessiansAlpha | None = None
     hessian: str | None = "numerical"
     parameter_dependent: bool = False
 
@@ -115,14 +147,42 @@ class EntropyFunctions:
                     "Your entropy is parameter dependent "
                     + " but you did not provide the e_fun."
                 )
-            if self.hessian == "provided" and self.e_derivative is None:
+            if (
+                self.hessian == "provided"
+                and self.e_derivative is None
+                and self.e_derivative_alpha is None
+            ):
                 bs_error_abort(
                     "Your entropy is parameter dependent, "
                     + "you claim to provide the hessian,\n"
-                    + " but I do not see the e_derivative."
+                    + " but I do not see the e_derivative or the e_derivative_alpha."
                 )
 
 
+def get_output_buffers(
+    out: tuple[np.ndarray, ...] | None, shapes: tuple[tuple[int, ...], ...]
+) -> tuple[np.ndarray, ...]:
+    """Returns zero-filled arrays of the given shapes, reusing the buffers in `out`
+    if they are supplied
+
+    Args:
+        out: preallocated arrays, if any
+        shapes: the shapes of the arrays
+
+    Returns:
+        the arrays, filled with zeros
+    """
+    if out is None:
+        return tuple(np.zeros(shape) for shape in shapes)
+    if len(out) != len(shapes):
+        bs_error_abort(f"out should have {len(shapes)} arrays, not {len(out)}.")
+    for buffer, shape in zip(out, shapes, strict=True):
+        if buffer.shape != shape:
+            bs_error_abort(f"A buffer has shape {buffer.shape}, it should be {shape}.")
+        buffer.fill(0.0)
+    return out
+
+
 def entropy_gradient(
     entropy: EntropyFunctions,
     muhat: Matching,
@@ -15,35 +15,100 @@ Each solver, when fed the joint surplus and margins, returns the equilibrium mat
 the adding-up errors on the margins,
 and if requested (using `gr=True`) the derivatives of the matching patterns
 in all primitives.
+
+The homoskedastic solver with singles can also finish with Newton steps
+on the equilibrium equations (`method="newton"`).
+It and the fully heteroskedastic solver
+can report their iteration counts and timing (`return_stats=True`).
+For large markets, the fully heteroskedastic solver can write its derivatives
+into memory-mapped files (`jacobian_dir`), a contiguous block of rows at a time.
+
+When many pairs of types cannot match, the homoskedastic solvers
+and the gender-heteroskedastic solver also accept `Phi` as a `scipy.sparse` matrix
+whose stored cells are the feasible pairs; they then return a sparse `muxy`.
+
+The two homoskedastic solvers can run their IPFP sweeps in single precision
+(`dtype=np.float32`), optionally refining the solution in double precision
+(`refine=True`).
 """
 
-from math import sqrt
-from typing import Literal, overload
+from dataclasses import dataclass
+from math import log, sqrt
+from pathlib import Path
+from time import perf_counter
+from typing import Final, Literal, TypeAlias, cast, overload
 
 import numpy as np
 import scipy.linalg as spla
+import scipy.sparse as sp
+import scipy.sparse.linalg as spsla
 from bs_python_utils.bsnputils import (
     FourArrays,
     ThreeArrays,
     check_vector,
     npexp,
     npmaxabs,
-    nppow,
-    nprepeat_col,
-    nprepeat_row,
 )
 from bs_python_utils.bsutils import bs_error_abort
+from numpy.typing import DTypeLike
 
 from cupid_matching.matching_utils import Matching
+from cupid_matching.persistence import create_array, write_metadata
+
+SurplusMatrix: TypeAlias = np.ndarray | sp.sparray | sp.spmatrix
+"""a dense (X, Y) matrix of joint surplus, or a sparse one
+whose stored cells are the only feasible pairs"""
 
 IPFPNoGradientResults = tuple[Matching, np.ndarray, np.ndarray]
 IPFPGradientResults = tuple[
     Matching, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray
 ]
 
+# the number of IPFP sweeps we run before switching to Newton steps
+_NEWTON_IPFP_SWEEPS: Final = 10
+# Armijo constant and smallest step length in the Newton line search
+_NEWTON_ARMIJO: Final = 1e-4
+_NEWTON_MIN_STEP: Final = 1e-10
+# relative tolerance of the conjugate gradients in sparse Newton steps
+_NEWTON_CG_RTOL: Final = 1e-12
+# the smallest relative tolerance we use in single-precision IPFP sweeps
+_FLOAT32_TOL: Final = 10.0 * float(np.finfo(np.float32).eps)
+
+
+@dataclass
+class IPFPStats:
+    """iteration counts and timing of a call to an IPFP solver
+
+    Attributes:
+        n_ipfp_iterations: the number of IPFP sweeps
+        n_newton_iterations: the number of Newton steps, if any
+        n_inner_iterations: the number of Newton steps within IPFP sweeps, if any
+        elapsed: the time spent in the solver, in seconds
+    """
+
+    n_ipfp_iterations: int
+    n_newton_iterations: int = 0
+    n_inner_iterations: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self):
+        repr_str = f"{self.n_ipfp_iterations} IPFP iterations"
+        if self.n_newton_iterations > 0:
+            repr_str += f" and {self.n_newton_iterations} Newton iterations"
+        if self.n_inner_iterations > 0:
+            repr_str += f" with {self.n_inner_iterations} inner Newton steps"
+        repr_str += f" in {self.elapsed:.3f} seconds"
+        return repr_str
+
+
+IPFPNoGradientResultsWithStats = tuple[Matching, np.ndarray, np.ndarray, IPFPStats]
+IPFPGradientResultsWithStats = tuple[
+    Matching, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, IPFPStats
+]
+
 
 def _ipfp_check_sizes(
-    men_margins: np.ndarray, women_margins: np.ndarray, Phi: np.ndarray
+    men_margins: np.ndarray, women_margins: np.ndarray, Phi: SurplusMatrix
 ) -> tuple[int, int]:
     """checks that the margins and surplus have the correct shapes and sizes"""
     X = check_vector(men_margins)
@@ -53,41 +118,123 @@ def _ipfp_check_sizes(
     return X, Y
 
 
+def _check_ipfp_dtype(dtype: DTypeLike) -> np.dtype:
+    """checks that we run IPFP in single or double precision"""
+    ipfp_dtype = np.dtype(dtype)
+    if ipfp_dtype not in (np.float32, np.float64):
+        bs_error_abort(f"dtype should be float32 or float64, not {ipfp_dtype}")
+    return ipfp_dtype
+
+
+def _sparse_exp_surplus(Phi: SurplusMatrix, scale: float, gr: bool) -> sp.csr_array:
+    """exponentiates `Phi/scale` on the stored cells of a sparse `Phi`;
+    the other cells are infeasible pairs, with no matches"""
+    if gr:
+        bs_error_abort("The derivatives are only available for a dense Phi")
+    ephi = sp.csr_array(Phi, dtype=float, copy=True)
+    ephi.sum_duplicates()
+    ephi.data = cast(np.ndarray, npexp(ephi.data / scale))
+    return ephi
+
+
+def _outer_on_support(
+    ephi: np.ndarray | sp.csr_array, tx: np.ndarray, ty: np.ndarray
+) -> np.ndarray | sp.csr_array:
+    """computes `ephi * np.outer(tx, ty)`, keeping the sparsity of `ephi` if any"""
+    if not sp.issparse(ephi):
+        return cast(np.ndarray, ephi * np.outer(tx, ty))
+    ephi_csr = cast(sp.csr_array, ephi)
+    rows = np.repeat(np.arange(ephi_csr.shape[0]), np.diff(ephi_csr.indptr))
+    return sp.csr_array(
+        (
+            ephi_csr.data * tx[rows] * ty[ephi_csr.indices],
+            ephi_csr.indices.copy(),
+            ephi_csr.indptr.copy(),
+        ),
+        shape=ephi_csr.shape,
+    )
+
+
+def _ipfp_no_singles_sweeps(
+    ephi2: np.ndarray | sp.csr_array,
+    men_margins: np.ndarray,
+    women_margins: np.ndarray,
+    txi: np.ndarray,
+    tyi: np.ndarray,
+    tol_diff: float,
+    maxiter: int,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """runs IPFP sweeps on the equilibrium equations of the homoskedastic model
+    without singles, $\\mu_{xy} = \\exp(\\Phi_{xy}/2) t_x t_y$,
+    starting from `(txi, tyi)`
+
+    Returns:
+        the final `(tx, ty)` and the number of sweeps
+    """
+    ephi2T = ephi2.T
+    err_diff = tol_diff + 1.0
+    niter = 0
+    while (err_diff > tol_diff) and (niter < maxiter):
+        sx = ephi2 @ tyi
+        tx = men_margins / sx
+        sy = ephi2T @ tx
+        ty = women_margins / sy
+        err_x = npmaxabs(tx - txi)
+        err_y = npmaxabs(ty - tyi)
+        err_diff = err_x + err_y
+        txi, tyi = tx, ty
+        niter += 1
+    return txi, tyi, niter
+
+
 def ipfp_homoskedastic_no_singles_solver(
-    Phi: np.ndarray,
+    Phi: SurplusMatrix,
     men_margins: np.ndarray,
     women_margins: np.ndarray,
     tol: float = 1e-9,
     gr: bool = False,
     verbose: bool = False,
     maxiter: int = 1000,
+    dtype: DTypeLike = np.float64,
+    refine: bool = False,
 ) -> ThreeArrays | FourArrays:
     """Solves for equilibrium in a Choo and Siow market without singles,
     given systematic surplus and margins
 
     Args:
-        Phi: matrix of systematic surplus, shape (X, Y)
+        Phi: matrix of systematic surplus, shape (X, Y);
+            if sparse, only the stored cells are feasible pairs
         men_margins: vector of men margins, shape (X)
         women_margins: vector of women margins, shape (Y)
         tol: tolerance on change in solution
-        gr: if `True`, also evaluate derivatives of $(\\mu_{xy})$ wrt $\\Phi$
+        gr: if `True`, also evaluate derivatives of $(\\mu_{xy})$ wrt $\\Phi$;
+            only for a dense `Phi`
         verbose: if `True`, prints information
         maxiter: maximum number of iterations
+        dtype: `np.float64` (the default) or `np.float32`,
+            the precision of the IPFP sweeps and of the results
+        refine: if `True` and `dtype` is `np.float32`,
+            we finish with at most `maxiter` double-precision sweeps
+            and return double-precision results;
+            this is always done if `gr` is `True`
 
     Returns:
-         muxy: the matching patterns, shape (X, Y)
+         muxy: the matching patterns, shape (X, Y); sparse if `Phi` is
          marg_err_x, marg_err_y: the errors on the margins
          and the gradients of $(\\mu_{xy})$ wrt $\\Phi$ if `gr` is `True`
     """
     X, Y = _ipfp_check_sizes(men_margins, women_margins, Phi)
+    ipfp_dtype = _check_ipfp_dtype(dtype)
     n_couples = np.sum(men_margins)
 
     # check that there are as many men as women
     if np.abs(np.sum(women_margins) - n_couples) > n_couples * tol:
         bs_error_abort("There should be as many men as women")
 
-    ephi2, der_ephi2 = npexp(Phi / 2.0, deriv=1)
-    ephi2T = ephi2.T
+    if sp.issparse(Phi):
+        ephi2 = _sparse_exp_surplus(Phi, 2.0, gr)
+    else:
+        ephi2, der_ephi2 = npexp(Phi / 2.0, deriv=1)
 
     #############################################################################
     # we solve the equilibrium equations muxy = ephi2 * tx * ty
@@ -98,20 +245,33 @@ def ipfp_homoskedastic_no_singles_solver(
     txi = np.full(X, bigc)
     tyi = np.full(Y, bigc)
 
-    err_diff = bigc
-    tol_diff = tol * err_diff
+    tol_diff = tol * bigc
     niter = 0
-    while (err_diff > tol_diff) and (niter < maxiter):
-        sx = ephi2 @ tyi
-        tx = men_margins / sx
-        sy = ephi2T @ tx
-        ty = women_margins / sy
-        err_x = npmaxabs(tx - txi)
-        err_y = npmaxabs(ty - tyi)
-        err_diff = err_x + err_y
-        txi, tyi = tx, ty
-        niter += 1
-    muxy = ephi2 * np.outer(txi, tyi)
+    if ipfp_dtype == np.float32:
+        # single-precision sweeps cannot go beyond its resolution
+        ephi2_32 = ephi2.astype(np.float32)
+        men_margins_32 = men_margins.astype(np.float32)
+        women_margins_32 = women_margins.astype(np.float32)
+        txi, tyi, niter = _ipfp_no_singles_sweeps(
+            ephi2_32,
+            men_margins_32,
+            women_margins_32,
+            txi.astype(np.float32),
+            tyi.astype(np.float32),
+            max(tol, _FLOAT32_TOL) * bigc,
+            maxiter,
+        )
+        if refine or gr:
+            txi, tyi = txi.astype(np.float64), tyi.astype(np.float64)
+        else:
+            ephi2 = ephi2_32
+            men_margins, women_margins = men_margins_32, women_margins_32
+    if txi.dtype == np.float64:
+        txi, tyi, niter_64 = _ipfp_no_singles_sweeps(
+            ephi2, men_margins, women_margins, txi, tyi, tol_diff, maxiter
+        )
+        niter += niter_64
+    muxy = _outer_on_support(ephi2, txi, tyi)
     marg_err_x = np.sum(muxy, 1) - men_margins
     marg_err_y = np.sum(muxy, 0) - women_margins
     if verbose:
@@ -121,6 +281,7 @@ def ipfp_homoskedastic_no_singles_solver(
     if not gr:
         return muxy, marg_err_x, marg_err_y
     else:
+        ephi2T = ephi2.T
         sxi = ephi2 @ tyi
         syi = ephi2T @ txi
         n_sum_categories = X + Y
@@ -171,33 +332,187 @@ def ipfp_homoskedastic_no_singles_solver(
         return muxy, marg_err_x, marg_err_y, dmuxy
 
 
+def _ipfp_homoskedastic_sweeps(
+    ephi2: np.ndarray | sp.csr_array,
+    men_margins: np.ndarray,
+    women_margins: np.ndarray,
+    txi: np.ndarray,
+    tyi: np.ndarray,
+    tol_diff: float,
+    maxiter: int,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """runs IPFP sweeps on the equilibrium equations of the homoskedastic model
+    with singles, $\\mu_{xy} = \\exp(\\Phi_{xy}/2) t_x t_y$ with $\\mu_{x0}=t_x^2$
+    and $\\mu_{0y}=t_y^2$, starting from `(txi, tyi)`
+
+    Returns:
+        the final `(tx, ty)` and the number of sweeps
+    """
+    ephi2T = ephi2.T
+    err_diff = tol_diff + 1.0
+    niter = 0
+    while (err_diff > tol_diff) and (niter < maxiter):
+        sx = ephi2 @ tyi
+        tx = (np.sqrt(sx * sx + 4.0 * men_margins) - sx) / 2.0
+        sy = ephi2T @ tx
+        ty = (np.sqrt(sy * sy + 4.0 * women_margins) - sy) / 2.0
+        err_x = npmaxabs(tx - txi)
+        err_y = npmaxabs(ty - tyi)
+        err_diff = err_x + err_y
+        txi = tx
+        tyi = ty
+        niter += 1
+    return txi, tyi, niter
+
+
+def _homoskedastic_margin_errors(
+    ephi2: np.ndarray | sp.csr_array,
+    men_margins: np.ndarray,
+    women_margins: np.ndarray,
+    tx: np.ndarray,
+    ty: np.ndarray,
+) -> np.ndarray:
+    """the (X+Y) adding-up errors on the margins at `(tx, ty)`
+    in the homoskedastic model with singles"""
+    err_x = tx * (tx + ephi2 @ ty) - men_margins
+    err_y = ty * (ty + ephi2.T @ tx) - women_margins
+    return np.concatenate((err_x, err_y))
+
+
+def _homoskedastic_jacobian(
+    ephi2: np.ndarray | sp.csr_array, tx: np.ndarray, ty: np.ndarray
+) -> np.ndarray | sp.csc_array:
+    """the (X+Y, X+Y) Jacobian of the margin equations wrt `(tx, ty)`
+    in the homoskedastic model with singles; sparse if `ephi2` is"""
+    X, Y = ephi2.shape
+    n_sum_categories = X + Y
+    sx = ephi2 @ ty
+    sy = ephi2.T @ tx
+    if sp.issparse(ephi2):
+        return sp.block_array(
+            [
+                [sp.diags_array(2.0 * tx + sx), sp.diags_array(tx) @ ephi2],
+                [sp.diags_array(ty) @ ephi2.T, sp.diags_array(2.0 * ty + sy)],
+            ],
+            format="csc",
+        )
+    jac = np.zeros((n_sum_categories, n_sum_categories))
+    jac[:X, :X] = np.diag(2.0 * tx + sx)
+    jac[:X, X:] = ephi2 * tx.reshape((-1, 1))
+    jac[X:, X:] = np.diag(2.0 * ty + sy)
+    jac[X:, :X] = ephi2.T * ty.reshape((-1, 1))
+    return jac
+
+
+def _newton_homoskedastic(
+    ephi2: np.ndarray | sp.csr_array,
+    men_margins: np.ndarray,
+    women_margins: np.ndarray,
+    txi: np.ndarray,
+    tyi: np.ndarray,
+    tol_marg: float,
+    maxiter: int,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """takes Newton steps with a backtracking line search
+    on the margin equations of the homoskedastic model with singles,
+    starting from `(txi, tyi)`
+
+    Returns:
+        the final `(tx, ty)` and the number of Newton steps
+    """
+    X = txi.size
+    t_vec = np.concatenate((txi, tyi))
+    errs = _homoskedastic_margin_errors(
+        ephi2, men_margins, women_margins, t_vec[:X], t_vec[X:]
+    )
+    norm_errs = np.linalg.norm(errs)
+    niter = 0
+    while (npmaxabs(errs) > tol_marg) and (niter < maxiter):
+        jac = _homoskedastic_jacobian(ephi2, t_vec[:X], t_vec[X:])
+        if sp.issparse(jac):
+            # scaling the columns of the Jacobian by t makes it symmetric
+            #   and diagonally dominant: we use preconditioned conjugate gradients
+            jac_t = jac @ sp.diags_array(t_vec)
+            precond = sp.diags_array(1.0 / jac_t.diagonal())
+            z_vec, _ = spsla.cg(jac_t, -errs, rtol=_NEWTON_CG_RTOL, M=precond)
+            direction = t_vec * z_vec
+        else:
+            direction = spla.solve(jac, -errs)
+        # we stay in the positive orthant
+        step = 1.0
+        negative_dir = direction < 0.0
+        if np.any(negative_dir):
+            step = min(
+                1.0, 0.99 * np.min(-t_vec[negative_dir] / direction[negative_dir])
+            )
+        # and we backtrack until the norm of the margin errors decreases enough
+        while step > _NEWTON_MIN_STEP:
+            t_new = t_vec + step * direction
+            errs_new = _homoskedastic_margin_errors(
+                ephi2, men_margins, women_margins, t_new[:X], t_new[X:]
+            )
+            norm_errs_new = np.linalg.norm(errs_new)
+            if norm_errs_new <= (1.0 - _NEWTON_ARMIJO * step) * norm_errs:
+                break
+            step /= 2.0
+        niter += 1
+        if step <= _NEWTON_MIN_STEP:
+            # no further progress is possible at this precision
+            break
+        t_vec, errs, norm_errs = t_new, errs_new, norm_errs_new
+    return t_vec[:X], t_vec[X:], niter
+
+
 def ipfp_homoskedastic_solver(
-    Phi: np.ndarray,
+    Phi: SurplusMatrix,
     men_margins: np.ndarray,
     women_margins: np.ndarray,
     tol: float = 1e-9,
     gr: bool = False,
     verbose: bool = False,
     maxiter: int = 1000,
-) -> IPFPNoGradientResults | IPFPGradientResults:
+    method: str = "ipfp",
+    return_stats: bool = False,
+    dtype: DTypeLike = np.float64,
+    refine: bool = False,
+) -> (
+    IPFPNoGradientResults
+    | IPFPGradientResults
+    | IPFPNoGradientResultsWithStats
+    | IPFPGradientResultsWithStats
+):
     """Solves for equilibrium in a Choo and Siow market with singles,
     given systematic surplus and margins
 
     Args:
-        Phi: matrix of systematic surplus, shape (X, Y)
+        Phi: matrix of systematic surplus, shape (X, Y);
+            if sparse, only the stored cells are feasible pairs
+            and `muxy` is returned as a sparse array
         men_margins: vector of men margins, shape (X)
         women_margins: vector of women margins, shape (Y)
         tol: tolerance on change in solution
-        gr: if `True`, also evaluate derivatives of the matching patterns
+        gr: if `True`, also evaluate derivatives of the matching patterns;
+            only for a dense `Phi`
         verbose: if `True`, prints information
         maxiter: maximum number of iterations
+        method: `"ipfp"` (the default) only runs IPFP sweeps;
+            `"newton"` runs a few IPFP sweeps, then Newton steps with a line search
+            on the margin equations, which converge quadratically
+            even when there are few singles
+        return_stats: if `True`, an `IPFPStats` object is appended to the results
+        dtype: `np.float64` (the default) or `np.float32`,
+            the precision of the IPFP sweeps and of the results
+        refine: if `True` and `dtype` is `np.float32`,
+            we finish with at most `maxiter` double-precision sweeps
+            and return double-precision results;
+            this is always done if `gr` is `True` or `method` is `"newton"`
 
     Returns:
          (muxy, mux0, mu0y): the matching patterns
          marg_err_x, marg_err_y: the errors on the margins
          and the gradients of the matching patterns wrt (men_margins, women_margins, Phi)
          if `gr` is `True`
-
+         and the iteration counts and timing if `return_stats` is `True`
 
     Example:
         ```py
@@ -235,9 +550,16 @@ def ipfp_homoskedastic_solver(
         )
         ```
     """
+    time_start = perf_counter()
     X, Y = _ipfp_check_sizes(men_margins, women_margins, Phi)
+    if method not in ["ipfp", "newton"]:
+        bs_error_abort(f"method should be 'ipfp' or 'newton', not {method}")
+    ipfp_dtype = _check_ipfp_dtype(dtype)
 
-    ephi2, der_ephi2 = npexp(Phi / 2.0, deriv=1)
+    if sp.issparse(Phi):
+        ephi2 = _sparse_exp_surplus(Phi, 2.0, gr)
+    else:
+        ephi2, der_ephi2 = npexp(Phi / 2.0, deriv=1)
 
     #############################################################################
     # we solve the equilibrium equations muxy = ephi2 * tx * ty
@@ -246,52 +568,81 @@ def ipfp_homoskedastic_solver(
     #   it is important that it fit the number of individuals
     #############################################################################
 
-    ephi2T = ephi2.T
     nindivs = np.sum(men_margins) + np.sum(women_margins)
     bigc = sqrt(nindivs / (X + Y + 2.0 * np.sum(ephi2)))
     txi = np.full(X, bigc)
     tyi = np.full(Y, bigc)
 
-    err_diff = bigc
     tol_diff = tol * bigc
     niter = 0
-    while (err_diff > tol_diff) and (niter < maxiter):
-        sx = ephi2 @ tyi
-        tx = (np.sqrt(sx * sx + 4.0 * men_margins) - sx) / 2.0
-        sy = ephi2T @ tx
-        ty = (np.sqrt(sy * sy + 4.0 * women_margins) - sy) / 2.0
-        err_x = npmaxabs(tx - txi)
-        err_y = npmaxabs(ty - tyi)
-        err_diff = err_x + err_y
-        txi = tx
-        tyi = ty
-        niter += 1
+    if ipfp_dtype == np.float32:
+        # single-precision sweeps cannot go beyond its resolution
+        ephi2_32 = ephi2.astype(np.float32)
+        men_margins_32 = men_margins.astype(np.float32)
+        women_margins_32 = women_margins.astype(np.float32)
+        txi, tyi, niter = _ipfp_homoskedastic_sweeps(
+            ephi2_32,
+            men_margins_32,
+            women_margins_32,
+            txi.astype(np.float32),
+            tyi.astype(np.float32),
+            max(tol, _FLOAT32_TOL) * bigc,
+            maxiter,
+        )
+        if refine or gr or method == "newton":
+            txi, tyi = txi.astype(np.float64), tyi.astype(np.float64)
+        else:
+            ephi2 = ephi2_32
+            men_margins, women_margins = men_margins_32, women_margins_32
+    niter_newton = 0
+    if method == "ipfp":
+        if txi.dtype == np.float64:
+            txi, tyi, niter_64 = _ipfp_homoskedastic_sweeps(
+                ephi2, men_margins, women_margins, txi, tyi, tol_diff, maxiter
+            )
+            niter += niter_64
+    else:
+        if niter == 0:
+            # a few IPFP sweeps bring us close enough for Newton to take over
+            txi, tyi, niter = _ipfp_homoskedastic_sweeps(
+                ephi2,
+                men_margins,
+                women_margins,
+                txi,
+                tyi,
+                tol_diff,
+                min(_NEWTON_IPFP_SWEEPS, maxiter),
+            )
+        tol_marg = tol * min(np.min(men_margins), np.min(women_margins))
+        txi, tyi, niter_newton = _newton_homoskedastic(
+            ephi2, men_margins, women_margins, txi, tyi, tol_marg, maxiter
+        )
     mux0 = txi * txi
     mu0y = tyi * tyi
-    muxy = ephi2 * np.outer(txi, tyi)
+    muxy = _outer_on_support(ephi2, txi, tyi)
     marg_err_x = mux0 + np.sum(muxy, 1) - men_margins
     marg_err_y = mu0y + np.sum(muxy, 0) - women_margins
+    stats = IPFPStats(
+        n_ipfp_iterations=niter,
+        n_newton_iterations=niter_newton,
+        elapsed=perf_counter() - time_start,
+    )
     if verbose:
-        print(f"After {niter} iterations:")
+        print(f"After {stats}:")
         print(f"\tMargin error on x: {npmaxabs(marg_err_x)}")
         print(f"\tMargin error on y: {npmaxabs(marg_err_y)}")
     if not gr:
-        return (
+        results = (
             Matching(muxy, men_margins, women_margins),
             marg_err_x,
             marg_err_y,
         )
+        return (*results, stats) if return_stats else results
     else:  # we compute_ the derivatives
-        sxi = ephi2 @ tyi
-        syi = ephi2T @ txi
         n_sum_categories = X + Y
         n_prod_categories = X * Y
-        # start with the LHS of the linear system
-        lhs = np.zeros((n_sum_categories, n_sum_categories))
-        lhs[:X, :X] = np.diag(2.0 * txi + sxi)
-        lhs[:X, X:] = ephi2 * txi.reshape((-1, 1))
-        lhs[X:, X:] = np.diag(2.0 * tyi + syi)
-        lhs[X:, :X] = ephi2T * tyi.reshape((-1, 1))
+        # start with the LHS of the linear system: the Jacobian of the margin equations
+        lhs = _homoskedastic_jacobian(ephi2, txi, tyi)
         # now fill the RHS
         n_cols_rhs = n_sum_categories + n_prod_categories
         rhs = np.zeros((n_sum_categories, n_cols_rhs))
@@ -332,7 +683,7 @@ def ipfp_homoskedastic_solver(
         # add the term that comes from differentiating ephi2
         muxy_vec2 = (muxy * der_ephi2).reshape(n_prod_categories)
         dmuxy[:, n_sum_categories:] += np.diag(muxy_vec2)
-        return (
+        results_gr = (
             Matching(muxy, men_margins, women_margins),
             marg_err_x,
             marg_err_y,
@@ -340,11 +691,52 @@ def ipfp_homoskedastic_solver(
             dmux0,
             dmu0y,
         )
+        if return_stats:
+            stats.elapsed = perf_counter() - time_start
+            return (*results_gr, stats)
+        return results_gr
+
+
+def _solve_power_margins(
+    s: np.ndarray,
+    margins: np.ndarray,
+    power: float,
+    tol: float,
+    maxiter: int = 100,
+) -> np.ndarray:
+    """Solves $t^{power} + s t = margins$ for $t>0$, elementwise, by Newton
+
+    Args:
+        s: the positive coefficients of the linear term
+        margins: the positive margins
+        power: the exponent, larger than 1
+        tol: tolerance on the errors
+        maxiter: the maximum number of Newton steps
+
+    Returns:
+        the vector of solutions $t$
+    """
+    # the function is increasing and convex in t; starting above the root,
+    #   Newton steps decrease monotonically to the root
+    #   (s is zero for types with no feasible partner)
+    t = np.power(margins, 1.0 / power)
+    has_partners = s > 0.0
+    t[has_partners] = np.minimum(
+        margins[has_partners] / s[has_partners], t[has_partners]
+    )
+    for _ in range(maxiter):
+        t_pow = np.power(t, power)
+        err = t_pow + s * t - margins
+        if npmaxabs(err) <= tol:
+            return cast(np.ndarray, t)
+        t -= err / (power * t_pow / t + s)
+    bs_error_abort(f"Newton did not converge after {maxiter} iterations")
+    return cast(np.ndarray, t)  # for mypy
 
 
 @overload
 def ipfp_gender_heteroskedastic_solver(
-    Phi: np.ndarray,
+    Phi: SurplusMatrix,
     men_margins: np.ndarray,
     women_margins: np.ndarray,
     tau: float,
@@ -357,7 +749,7 @@ def ipfp_gender_heteroskedastic_solver(
 
 @overload
 def ipfp_gender_heteroskedastic_solver(
-    Phi: np.ndarray,
+    Phi: SurplusMatrix,
     men_margins: np.ndarray,
     women_margins: np.ndarray,
     tau: float,
@@ -369,7 +761,7 @@ def ipfp_gender_heteroskedastic_solver(
 
 
 def ipfp_gender_heteroskedastic_solver(
-    Phi: np.ndarray,
+    Phi: SurplusMatrix,
     men_margins: np.ndarray,
     women_margins: np.ndarray,
     tau: float,
@@ -382,12 +774,15 @@ def ipfp_gender_heteroskedastic_solver(
     given systematic surplus and margins and a scale parameter `tau`
 
     Args:
-        Phi: matrix of systematic surplus, shape (X, Y)
+        Phi: matrix of systematic surplus, shape (X, Y);
+            if sparse, only the stored cells are feasible pairs
+            and `muxy` is returned as a sparse array
         men_margins: vector of men margins, shape (X)
         women_margins: vector of women margins, shape (Y)
         tau: the standard error for all women
         tol: tolerance on change in solution
-        gr: if `True`, also evaluate derivatives of the matching patterns
+        gr: if `True`, also evaluate derivatives of the matching patterns;
+            only for a dense `Phi`
         verbose: if `True`, prints information
         maxiter: maximum number of iterations
 
@@ -403,45 +798,101 @@ def ipfp_gender_heteroskedastic_solver(
         bs_error_abort(f"We need a positive tau, not {tau}")
 
     #############################################################################
-    # we use ipfp_heteroxy_solver with sigma_x = 1 and tau_y = tau
+    # we solve the equilibrium equations muxy = ephi * tx * ty
+    #   with ephi = exp(Phi/(1+tau)), tx = mux0^(1/(1+tau))
+    #   and ty = mu0y^(tau/(1+tau))
+    #   so that mux0 = tx^pow_x and mu0y = ty^pow_y
+    #   given ty, each tx solves tx^pow_x + tx * (ephi @ ty) = n
+    #   and given tx, each ty solves ty^pow_y + ty * (ephi.T @ tx) = m
     #############################################################################
 
-    sigma_x = np.ones(X)
-    tau_y = np.full(Y, tau)
+    tau1 = 1.0 + tau
+    pow_x = tau1
+    pow_y = tau1 / tau
+    if sp.issparse(Phi):
+        ephi = _sparse_exp_surplus(Phi, tau1, gr)
+    else:
+        ephi, der_ephi = npexp(Phi / tau1, deriv=1)
 
-    if gr:
-        (
-            mus_hxy,
+    nindivs = np.sum(men_margins) + np.sum(women_margins)
+    bigc = nindivs / (X + Y + 2.0 * np.sum(ephi))
+    txi = np.full(X, bigc ** (1.0 / pow_x))
+    tyi = np.full(Y, bigc ** (1.0 / pow_y))
+    err_diff = bigc
+    tol_diff = tol * bigc
+    niter = 0
+    while (err_diff > tol_diff) and (niter < maxiter):  # IPFP main loop
+        tx = _solve_power_margins(ephi @ tyi, men_margins, pow_x, tol)
+        ty = _solve_power_margins(ephi.T @ tx, women_margins, pow_y, tol)
+        err_diff = npmaxabs(tx - txi) + npmaxabs(ty - tyi)
+        txi, tyi = tx, ty
+        niter += 1
+
+    mux0 = np.power(txi, pow_x)
+    mu0y = np.power(tyi, pow_y)
+    muxy = _outer_on_support(ephi, txi, tyi)
+    marg_err_x = mux0 + np.sum(muxy, 1) - men_margins
+    marg_err_y = mu0y + np.sum(muxy, 0) - women_margins
+
+    if verbose:
+        print(f"After {niter} iterations:")
+        print(f"\tMargin error on x: {npmaxabs(marg_err_x)}")
+        print(f"\tMargin error on y: {npmaxabs(marg_err_y)}")
+    if not gr:
+        return (
+            Matching(muxy, men_margins, women_margins),
             marg_err_x,
             marg_err_y,
-            dmus_xy,
-            dmus_x0,
-            dmus_0y,
-        ) = ipfp_heteroskedastic_solver(
-            Phi,
-            men_margins,
-            women_margins,
-            sigma_x,
-            tau_y,
-            tol=tol,
-            gr=True,
-            maxiter=maxiter,
-            verbose=verbose,
         )
-        muxy, _, _, _, _ = mus_hxy.unpack()
+    else:  # we compute the derivatives
         n_sum_categories = X + Y
         n_prod_categories = X * Y
-        n_cols = n_sum_categories + n_prod_categories
-        itau_y = n_cols + X
-        dmuxy = np.zeros((n_prod_categories, n_cols + 1))
-        dmuxy[:, :n_cols] = dmus_xy[:, :n_cols]
-        dmuxy[:, -1] = np.sum(dmus_xy[:, itau_y:], 1)
-        dmux0 = np.zeros((X, n_cols + 1))
-        dmux0[:, :n_cols] = dmus_x0[:, :n_cols]
-        dmux0[:, -1] = np.sum(dmus_x0[:, itau_y:], 1)
-        dmu0y = np.zeros((Y, n_cols + 1))
-        dmu0y[:, :n_cols] = dmus_0y[:, :n_cols]
-        dmu0y[:, -1] = np.sum(dmus_0y[:, itau_y:], 1)
+        n_cols_rhs = n_sum_categories + n_prod_categories + 1
+        # we work with (tx, ty); the LHS is the Jacobian of the equations
+        lhs = np.zeros((n_sum_categories, n_sum_categories))
+        lhs[:X, :X] = np.diag(pow_x * mux0 / txi + ephi @ tyi)
+        lhs[:X, X:] = ephi * txi.reshape((-1, 1))
+        lhs[X:, X:] = np.diag(pow_y * mu0y / tyi + ephi.T @ txi)
+        lhs[X:, :X] = (ephi * tyi).T
+
+        # now fill the RHS (derivatives wrt men_margins, then women_margins,
+        #    then Phi, then tau)
+        rhs = np.zeros((n_sum_categories, n_cols_rhs))
+        rhs[:X, :X] = np.eye(X)
+        rhs[X:, X:n_sum_categories] = np.eye(Y)
+        #   the derivative of muxy wrt Phi, with safeguards
+        big_a = muxy * der_ephi / (ephi * tau1)
+        iend_phi = n_sum_categories + n_prod_categories
+        cols_phi = np.arange(n_sum_categories, iend_phi)
+        rows_x = np.repeat(np.arange(X), Y)
+        rows_y = np.tile(np.arange(Y), X)
+        big_a_vec = big_a.reshape(n_prod_categories)
+        rhs[rows_x, cols_phi] = -big_a_vec
+        rhs[X + rows_y, cols_phi] = -big_a_vec
+        #   the derivative of muxy wrt tau, through ephi
+        dmuxy_tau = -Phi * big_a / tau1
+        log_tx = np.log(txi)
+        log_ty = np.log(tyi)
+        rhs[:X, -1] = -(mux0 * log_tx + np.sum(dmuxy_tau, 1))
+        rhs[X:, -1] = -(-mu0y * log_ty / (tau * tau) + np.sum(dmuxy_tau, 0))
+
+        # solve for the derivatives of tx and ty
+        dt = spla.solve(lhs, rhs)
+        dtx = dt[:X, :]
+        dty = dt[X:, :]
+
+        # mux0 = tx^pow_x and mu0y = ty^pow_y, with pow_x and pow_y functions of tau
+        dmux0 = (pow_x * mux0 / txi).reshape((-1, 1)) * dtx
+        dmux0[:, -1] += mux0 * log_tx
+        dmu0y = (pow_y * mu0y / tyi).reshape((-1, 1)) * dty
+        dmu0y[:, -1] -= mu0y * log_ty / (tau * tau)
+
+        # muxy = ephi * tx * ty
+        dmuxy = (ephi * tyi).reshape((-1, 1)) * dtx[rows_x, :]
+        dmuxy += (ephi * txi.reshape((-1, 1))).reshape((-1, 1)) * dty[rows_y, :]
+        dmuxy[np.arange(n_prod_categories), cols_phi] += big_a_vec
+        dmuxy[:, -1] += dmuxy_tau.reshape(n_prod_categories)
+
         return (
             Matching(muxy, men_margins, women_margins),
             marg_err_x,
@@ -451,18 +902,75 @@ def ipfp_gender_heteroskedastic_solver(
             dmu0y,
         )
 
-    else:
-        return ipfp_heteroskedastic_solver(
-            Phi,
-            men_margins,
-            women_margins,
-            sigma_x,
-            tau_y,
-            tol=tol,
-            gr=False,
-            maxiter=maxiter,
-            verbose=verbose,
+
+def _newton_log_singles(
+    c_xy: np.ndarray,
+    rat_xy: np.ndarray,
+    margins: np.ndarray,
+    log_mu0: np.ndarray,
+    tol: float,
+    maxiter: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Solves $\\mu_{x0} + \\sum_y c_{xy} \\mu_{x0}^{r_{xy}} = n_x$ in $\\log \\mu_{x0}$,
+    by Newton steps
+
+    Args:
+        c_xy: the positive coefficients, shape (X, Y)
+        rat_xy: the exponents, between 0 and 1, shape (X, Y)
+        margins: the margins, shape (X)
+        log_mu0: the starting values of $\\log \\mu_{x0}$, shape (X)
+        tol: tolerance on the errors on the margins
+        maxiter: the maximum number of Newton steps
+
+    Returns:
+        the values of $\\log \\mu_{x0}$ and of $\\mu_{x0}$,
+        the matrix of $\\mu_{xy}$, and the number of Newton steps
+    """
+    # the equation is increasing and convex in log_mu0, and the root is below
+    #   log(margins): capping the iterates there keeps them from overshooting
+    log_margins = np.log(margins)
+    n_steps = 0
+    while True:
+        mu0 = np.exp(log_mu0)
+        muxy = c_xy * np.exp(rat_xy * log_mu0.reshape((-1, 1)))
+        err = mu0 + np.sum(muxy, 1) - margins
+        if npmaxabs(err) <= tol or n_steps == maxiter:
+            return log_mu0, mu0, muxy, n_steps
+        log_mu0 = np.minimum(
+            log_mu0 - err / (mu0 + np.sum(rat_xy * muxy, 1)), log_margins
         )
+        n_steps += 1
+
+
+# the number of elements of each block of rows of `dmuxy`
+_JACOBIAN_BLOCK_ELEMENTS: Final[int] = 1 << 22
+
+
+def _heteroskedastic_dmuxy_block(
+    der1: np.ndarray,
+    der2: np.ndarray,
+    dmux0: np.ndarray,
+    dmu0y: np.ndarray,
+    rows: slice,
+) -> np.ndarray:
+    """the rows `rows` of the derivatives of `muxy`
+    through those of `mux0` and `mu0y`
+
+    Args:
+        der1: the (X, Y) derivatives of `muxy` wrt `mux0`
+        der2: the (X, Y) derivatives of `muxy` wrt `mu0y`
+        dmux0: the (X, n_cols) derivatives of `mux0`
+        dmu0y: the (Y, n_cols) derivatives of `mu0y`
+        rows: the rows, in the order of `muxy.ravel()`
+
+    Returns:
+        an (n_rows, n_cols) block
+    """
+    Y = der1.shape[1]
+    x_rows, y_rows = np.divmod(np.arange(rows.start, rows.stop), Y)
+    block = der1.ravel()[rows, np.newaxis] * dmux0[x_rows, :]
+    block += der2.ravel()[rows, np.newaxis] * dmu0y[y_rows, :]
+    return cast(np.ndarray, block)
 
 
 @overload
@@ -476,6 +984,9 @@ def ipfp_heteroskedastic_solver(
     gr: Literal[False],
     verbose: bool,
     maxiter: int,
+    maxiter_inner: int,
+    return_stats: Literal[False] = False,
+    jacobian_dir: str | Path | None = None,
 ) -> IPFPNoGradientResults: ...
 
 
@@ -490,9 +1001,46 @@ def ipfp_heteroskedastic_solver(
     gr: Literal[True],
     verbose: bool,
     maxiter: int,
+    maxiter_inner: int,
+    return_stats: Literal[False] = False,
+    jacobian_dir: str | Path | None = None,
 ) -> IPFPGradientResults: ...
 
 
+@overload
+def ipfp_heteroskedastic_solver(
+    Phi: np.ndarray,
+    men_margins: np.ndarray,
+    women_margins: np.ndarray,
+    sigma_x: np.ndarray,
+    tau_y: np.ndarray,
+    tol: float,
+    gr: Literal[False],
+    verbose: bool,
+    maxiter: int,
+    maxiter_inner: int,
+    return_stats: Literal[True],
+    jacobian_dir: str | Path | None = None,
+) -> IPFPNoGradientResultsWithStats: ...
+
+
+@overload
+def ipfp_heteroskedastic_solver(
+    Phi: np.ndarray,
+    men_margins: np.ndarray,
+    women_margins: np.ndarray,
+    sigma_x: np.ndarray,
+    tau_y: np.ndarray,
+    tol: float,
+    gr: Literal[True],
+    verbose: bool,
+    maxiter: int,
+    maxiter_inner: int,
+    return_stats: Literal[True],
+    jacobian_dir: str | Path | None = None,
+) -> IPFPGradientResultsWithStats: ...
+
+
 def ipfp_heteroskedastic_solver(
     Phi: np.ndarray,
     men_margins: np.ndarray,
@@ -503,7 +1051,15 @@ def ipfp_heteroskedastic_solver(
     gr: bool = False,
     verbose: bool = False,
     maxiter: int = 1000,
-) -> IPFPNoGradientResults | IPFPGradientResults:
+    maxiter_inner: int = 100,
+    return_stats: bool = False,
+    jacobian_dir: str | Path | None = None,
+) -> (
+    IPFPNoGradientResults
+    | IPFPGradientResults
+    | IPFPNoGradientResultsWithStats
+    | IPFPGradientResultsWithStats
+):
     """Solves for equilibrium in a in a fully heteroskedastic Choo and Siow market
     given systematic surplus and margins
     and standard errors `sigma_x` and `tau_y`
@@ -518,6 +1074,13 @@ def ipfp_heteroskedastic_solver(
         gr: if `True`, also evaluate derivatives of the matching patterns
         verbose: if `True`, prints information
         maxiter: maximum number of iterations
+        maxiter_inner: maximum number of Newton steps
+            in each half-iteration of IPFP
+        return_stats: if `True`, an `IPFPStats` object is appended to the results
+        jacobian_dir: if given with `gr=True`, the gradients are written
+            block by block into memory-mapped `dmuxy`, `dmux0` and `dmu0y` arrays
+            in this directory, which `persistence.load_arrays` reads back;
+            use it when the (XY, XY+2(X+Y)) `dmuxy` does not fit in memory
 
     Returns:
          (muxy, mux0, mu0y): the matching patterns
@@ -525,117 +1088,84 @@ def ipfp_heteroskedastic_solver(
          and the gradients of the matching patterns
          wrt (men_margins, women_margins, Phi, sigma_x, tau_y)
          if `gr` is `True`
+         and the iteration counts and timing if `return_stats` is `True`
     """
-
+    time_start = perf_counter()
     X, Y = _ipfp_check_sizes(men_margins, women_margins, Phi)
 
     if np.min(sigma_x) <= 0.0:
         bs_error_abort("All elements of sigma_x must be positive")
     if np.min(tau_y) <= 0.0:
         bs_error_abort("All elements of tau_y must be positive")
+    if sp.issparse(Phi):
+        bs_error_abort("The fully heteroskedastic solver needs a dense Phi")
 
     sumxy1 = 1.0 / np.add.outer(sigma_x, tau_y)
     ephi2, der_ephi2 = npexp(Phi * sumxy1, deriv=1)
+    # the exponents of mux0 and mu0y in muxy
+    sigrat_xy = sumxy1 * sigma_x.reshape((-1, 1))
+    taurat_xy = 1.0 - sigrat_xy
 
     #############################################################################
-    # we solve the equilibrium equations muxy = ephi2 * tx * ty
-    #   with tx = mux0^(sigma_x/(sigma_x + tau_max))
-    #   and ty = mu0y^(tau_y/(sigma_max + tau_y))
-    #   starting with a reasonable initial point for tx and ty: tx = ty = bigc
+    # we solve the equilibrium equations
+    #   muxy = ephi2 * mux0^sigrat_xy * mu0y^taurat_xy
+    #   in (log mux0, log mu0y), so that each inner Newton step
+    #   only takes one exp over the (X, Y) grid
+    #   starting with a reasonable initial point: mux0 = mu0y = bigc
     #   it is important that it fit the number of individuals
     #############################################################################
 
     nindivs = np.sum(men_margins) + np.sum(women_margins)
     bigc = nindivs / (X + Y + 2.0 * np.sum(ephi2))
-    # we find the largest values of sigma_x and tau_y
-    xmax = np.argmax(sigma_x)
-    sigma_max = sigma_x[xmax]
-    ymax = np.argmax(tau_y)
-    tau_max = tau_y[ymax]
-    # we use tx = mux0^(sigma_x/(sigma_x + tau_max))
-    #    and ty = mu0y^(tau_y/(sigma_max + tau_y))
-    sig_taumax = sigma_x + tau_max
-    txi = np.power(bigc, sigma_x / sig_taumax)
-    sigmax_tau = tau_y + sigma_max
-    tyi = np.power(bigc, tau_y / sigmax_tau)
+    log_bigc = log(bigc)
+    log_mux0, mux0 = np.full(X, log_bigc), np.full(X, bigc)
+    log_mu0y, mu0y = np.full(Y, log_bigc), np.full(Y, bigc)
     err_diff = bigc
     tol_diff = tol * bigc
     tol_newton = tol
-    niter = 0
-    while (err_diff > tol_diff) and (niter < maxiter):  # IPFP main loop
-        # Newton iterates for men
-        err_newton = bigc
-        txin = txi.copy()
-        mu0y_in = np.power(np.power(tyi, sigmax_tau), 1.0 / tau_y)
-        while err_newton > tol_newton:
-            txit = np.power(txin, sig_taumax)
-            mux0_in = np.power(txit, 1.0 / sigma_x)
-            out_xy = np.outer(np.power(mux0_in, sigma_x), np.power(mu0y_in, tau_y))
-            muxy_in = ephi2 * np.power(out_xy, sumxy1)
-            errxi = mux0_in + np.sum(muxy_in, 1) - men_margins
-            err_newton = npmaxabs(errxi)
-            txin -= errxi / (
-                sig_taumax * (mux0_in / sigma_x + np.sum(sumxy1 * muxy_in, 1)) / txin
-            )
-        tx = txin
-
-        # Newton iterates for women
-        err_newton = bigc
-        tyin = tyi.copy()
-        mux0_in = np.power(np.power(tx, sig_taumax), 1.0 / sigma_x)
-        while err_newton > tol_newton:
-            tyit = np.power(tyin, sigmax_tau)
-            mu0y_in = np.power(tyit, 1.0 / tau_y)
-            out_xy = np.outer(np.power(mux0_in, sigma_x), np.power(mu0y_in, tau_y))
-            muxy_in = ephi2 * np.power(out_xy, sumxy1)
-            erryi = mu0y_in + np.sum(muxy_in, 0) - women_margins
-            err_newton = npmaxabs(erryi)
-            tyin -= erryi / (
-                sigmax_tau * (mu0y_in / tau_y + np.sum(sumxy1 * muxy_in, 0)) / tyin
-            )
-
-        ty = tyin
-
-        err_x = npmaxabs(tx - txi)
-        err_y = npmaxabs(ty - tyi)
-        err_diff = err_x + err_y
-
-        txi = tx
-        tyi = ty
-
-        niter += 1
+    stats = IPFPStats(n_ipfp_iterations=0)
+    while (err_diff > tol_diff) and (stats.n_ipfp_iterations < maxiter):
+        # Newton iterates for men, given mu0y
+        ephi2_y = ephi2 * np.exp(taurat_xy * log_mu0y)
+        log_mux0, mux0_new, _, n_steps_x = _newton_log_singles(
+            ephi2_y, sigrat_xy, men_margins, log_mux0, tol_newton, maxiter_inner
+        )
+        # Newton iterates for women, given mux0
+        ephi2_x = ephi2 * np.exp(sigrat_xy * log_mux0.reshape((-1, 1)))
+        log_mu0y, mu0y_new, muyx, n_steps_y = _newton_log_singles(
+            ephi2_x.T, taurat_xy.T, women_margins, log_mu0y, tol_newton, maxiter_inner
+        )
+        err_diff = npmaxabs(mux0_new - mux0) + npmaxabs(mu0y_new - mu0y)
+        mux0, mu0y = mux0_new, mu0y_new
+        stats.n_ipfp_iterations += 1
+        stats.n_inner_iterations += n_steps_x + n_steps_y
 
-    mux0 = mux0_in
-    mu0y = mu0y_in
-    muxy = muxy_in
+    muxy = muyx.T
     marg_err_x = mux0 + np.sum(muxy, 1) - men_margins
     marg_err_y = mu0y + np.sum(muxy, 0) - women_margins
 
     if verbose:
-        print(f"After {niter} iterations:")
+        print(f"After {stats.n_ipfp_iterations} iterations:")
         print(f"\tMargin error on x: {npmaxabs(marg_err_x)}")
         print(f"\tMargin error on y: {npmaxabs(marg_err_y)}")
     if not gr:
-        return (
+        results = (
             Matching(muxy, men_margins, women_margins),
             marg_err_x,
             marg_err_y,
         )
+        if return_stats:
+            stats.elapsed = perf_counter() - time_start
+            return (*results, stats)
+        return results
     else:  # we compute_ the derivatives
         n_sum_categories = X + Y
         n_prod_categories = X * Y
         # we work directly with (mux0, mu0y)
-        sigrat_xy = sumxy1 * sigma_x.reshape((-1, 1))
-        taurat_xy = 1.0 - sigrat_xy
-        mux0_mat = nprepeat_col(mux0, Y)
-        mu0y_mat = nprepeat_row(mu0y, X)
-        # muxy = axy * bxy * ephi2
-        axy = nppow(mux0_mat, sigrat_xy)
-        bxy = nppow(mu0y_mat, taurat_xy)
-        der_axy1, der_axy2 = nppow(mux0_mat, sigrat_xy, deriv=1)
-        der_bxy1, der_bxy2 = nppow(mu0y_mat, taurat_xy, deriv=1)
-        der_axy1_rat, der_axy2_rat = der_axy1 / axy, der_axy2 / axy
-        der_bxy1_rat, der_bxy2_rat = der_bxy1 / bxy, der_bxy2 / bxy
+        # muxy = axy * bxy * ephi2, with axy = mux0^sigrat_xy and bxy = mu0y^taurat_xy;
+        #   the ratios of their derivatives to their values are simple
+        der_axy1_rat = sigrat_xy / mux0.reshape((-1, 1))
+        der_bxy1_rat = taurat_xy / mu0y
 
         # start with the LHS of the linear system on (dmux0, dmu0y)
         lhs = np.zeros((n_sum_categories, n_sum_categories))
@@ -658,24 +1188,18 @@ def ipfp_heteroskedastic_solver(
         sumxy1_safe = sumxy1 * der_ephi2 / ephi2
 
         big_a = muxy * sumxy1_safe
-        big_b = der_axy2_rat - der_bxy2_rat
+        big_b = np.subtract.outer(log_mux0, log_mu0y)
         b_mu_s = big_b * muxy * sumxy1
         a_phi = Phi * big_a
         big_c = sumxy1 * (a_phi - b_mu_s * tau_y)
         big_d = sumxy1 * (a_phi + b_mu_s * sigma_x.reshape((-1, 1)))
 
         #  to compute_ derivatives of (mux0, mu0y) wrt Phi
-        ivar = n_sum_categories
-        for iman in range(X):
-            rhs[iman, ivar : (ivar + Y)] = -big_a[iman, :]
-            ivar += Y
-        ivar1 = X
-        ivar2 = n_sum_categories
+        ixy = np.arange(n_prod_categories)
+        x_of_xy, y_of_xy = np.divmod(ixy, Y)
         iend_phi = n_sum_categories + n_prod_categories
-        for iwoman in range(Y):
-            rhs[ivar1, ivar2:iend_phi:Y] = -big_a[:, iwoman]
-            ivar1 += 1
-            ivar2 += 1
+        rhs[x_of_xy, n_sum_categories + ixy] = -big_a.ravel()
+        rhs[X + y_of_xy, n_sum_categories + ixy] = -big_a.ravel()
 
         #  to compute_ derivatives of (mux0, mu0y) wrt sigma_x
         iend_sig = iend_phi + X
@@ -689,45 +1213,48 @@ def ipfp_heteroskedastic_solver(
 
         # solve for the derivatives of mux0 and mu0y
         dmu0 = spla.solve(lhs, rhs)
-        dmux0 = dmu0[:X, :]
-        dmu0y = dmu0[X:, :]
 
-        # now construct the derivatives of muxy
-        dmuxy = np.zeros((n_prod_categories, n_cols_rhs))
-        der1 = ephi2 * der_axy1 * bxy
-        ivar = 0
-        for iman in range(X):
-            dmuxy[ivar : (ivar + Y), :] = np.outer(der1[iman, :], dmux0[iman, :])
-            ivar += Y
-        der2 = ephi2 * der_bxy1 * axy
-        for iwoman in range(Y):
-            dmuxy[iwoman:n_prod_categories:Y, :] += np.outer(
-                der2[:, iwoman], dmu0y[iwoman, :]
+        # now construct the derivatives of muxy, a block of rows at a time,
+        #   so that each block is a contiguous part of a memory-mapped dmuxy
+        der1 = muxy * der_axy1_rat
+        der2 = muxy * der_bxy1_rat
+        if jacobian_dir is None:
+            dmuxy = np.empty((n_prod_categories, n_cols_rhs))
+            dmux0 = dmu0[:X, :]
+            dmu0y = dmu0[X:, :]
+        else:
+            jacobians = [
+                create_array(jacobian_dir, name, (n_rows, n_cols_rhs))
+                for name, n_rows in (
+                    ("dmuxy", n_prod_categories),
+                    ("dmux0", X),
+                    ("dmu0y", Y),
+                )
+            ]
+            dmuxy, dmux0, dmu0y = jacobians
+            dmux0[:] = dmu0[:X, :]
+            dmu0y[:] = dmu0[X:, :]
+        block_size = max(1, _JACOBIAN_BLOCK_ELEMENTS // n_cols_rhs)
+        for start in range(0, n_prod_categories, block_size):
+            rows = slice(start, min(start + block_size, n_prod_categories))
+            block = _heteroskedastic_dmuxy_block(
+                der1, der2, dmu0[:X, :], dmu0[X:, :], rows
             )
-
-        # add the terms that comes from differentiating ephi2
-        #  on the derivative wrt Phi
-        i = 0
-        j = n_sum_categories
-        for iman in range(X):
-            for iwoman in range(Y):
-                dmuxy[i, j] += big_a[iman, iwoman]
-                i += 1
-                j += 1
-        #  on the derivative wrt sigma_x
-        ivar = 0
-        ix = iend_phi
-        for iman in range(X):
-            dmuxy[ivar : (ivar + Y), ix] -= big_c[iman, :]
-            ivar += Y
-            ix += 1
-        # on the derivative wrt tau_y
-        iy = iend_sig
-        for iwoman in range(Y):
-            dmuxy[iwoman:n_prod_categories:Y, iy] -= big_d[:, iwoman]
-            iy += 1
-
-        return (
+            irow = np.arange(block.shape[0])
+            # add the terms that come from differentiating ephi2
+            #  on the derivative wrt Phi
+            block[irow, n_sum_categories + ixy[rows]] += big_a.ravel()[rows]
+            #  on the derivative wrt sigma_x
+            block[irow, iend_phi + x_of_xy[rows]] -= big_c.ravel()[rows]
+            # on the derivative wrt tau_y
+            block[irow, iend_sig + y_of_xy[rows]] -= big_d.ravel()[rows]
+            dmuxy[rows, :] = block
+        if jacobian_dir is not None:
+            for jacobian in jacobians:
+                jacobian.flush()
+            write_metadata(jacobian_dir, ["dmuxy", "dmux0", "dmu0y"])
+
+        results_gr = (
             Matching(muxy, men_margins, women_margins),
             marg_err_x,
             marg_err_y,
@@ -735,3 +1262,7 @@ def ipfp_heteroskedastic_solver(
             dmux0,
             dmu0y,
         )
+        if return_stats:
+            stats.elapsed = perf_counter() - time_start
+            return (*results_gr, stats)
+        return results_gr
@@ -1,26 +1,37 @@
 """matching-related utilities"""
 
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass, field
 from typing import Any, Final, Protocol, cast
 
 import numpy as np
-from bs_python_utils.bsnputils import TwoArrays, check_matrix, check_vector, npmaxabs
+import scipy.sparse as sp
+from bs_python_utils.bsnputils import (
+    ThreeArrays,
+    TwoArrays,
+    check_matrix,
+    check_vector,
+    npmaxabs,
+)
 from bs_python_utils.bsutils import bs_error_abort
+from numpy.typing import DTypeLike
 
 SINGLES_TOL: Final = 1e-3
 
 
 def get_singles(muxy: np.ndarray, n: np.ndarray, m: np.ndarray) -> TwoArrays:
-    """Computes the numbers of singles from the matches and the margins."""
-    mux0 = n - np.sum(muxy, 1)
-    mu0y = m - np.sum(muxy, 0)
+    """Computes the numbers of singles from the matches and the margins;
+    works on a single (X,Y) `muxy` or on a (B,X,Y) batch."""
+    mux0 = n - np.sum(muxy, -1)
+    mu0y = m - np.sum(muxy, -2)
     return mux0, mu0y
 
 
 def compute_margins(muxy: np.ndarray, mux0: np.ndarray, mu0y: np.ndarray) -> TwoArrays:
-    """Computes the margins from the matches and the singles."""
-    n = np.sum(muxy, 1) + mux0
-    m = np.sum(muxy, 0) + mu0y
+    """Computes the margins from the matches and the singles;
+    works on a single (X,Y) `muxy` or on a (B,X,Y) batch."""
+    n = np.sum(muxy, -1) + mux0
+    m = np.sum(muxy, -2) + mu0y
     return n, m
 
 
@@ -32,11 +43,107 @@ def _check_no_singles(mu0: np.ndarray, n_households: float, str_gender: str) ->
         )
 
 
-@dataclass
-class Matching:
+def _read_only(arr: Any) -> Any:
+    """returns a read-only view of a dense array; sparse arrays are returned as is"""
+    if sp.issparse(arr):
+        return arr
+    view = np.asarray(arr).view()
+    view.flags.writeable = False
+    return view
+
+
+def _owned(arr: Any) -> Any:
+    """returns `arr` if no one can write to it, e.g. a read-only memory map
+    or a view into the arrays of a `MatchingBatch`; otherwise a read-only copy,
+    so that the caller cannot change it after it is validated.
+    A sparse `arr` is always copied, to CSR format."""
+    if sp.issparse(arr):
+        return sp.csr_array(arr, copy=True)
+    arr = np.asarray(arr)
+    base = arr
+    while isinstance(base, np.ndarray):
+        if base.flags.writeable:
+            arr = arr.copy()
+            arr.flags.writeable = False
+            return arr
+        base = base.base
+    return arr
+
+
+class _CachedLogs:
+    """the cached logarithms shared by `Matching` and `MatchingBatch`;
+    the subclasses provide the arrays and a `_cache` dict"""
+
+    __slots__ = ()
+
+    muxy: np.ndarray
+    mux0: np.ndarray
+    mu0y: np.ndarray
+    n: np.ndarray
+    m: np.ndarray
+    _cache: dict[str, Any]
+
+    def _cached(self, name: str, compute: Callable[[], Any]) -> Any:
+        """returns the cached value of `name`, computing it on first access"""
+        cache = self._cache
+        if name not in cache:
+            cache[name] = compute()
+        return cache[name]
+
+    @property
+    def log_muxy(self) -> np.ndarray:
+        """the logarithms of `muxy`; of its stored values if it is sparse"""
+
+        def compute_log_muxy() -> np.ndarray:
+            if sp.issparse(self.muxy):
+                muxy_csr = cast(sp.csr_array, self.muxy)
+                return cast(
+                    np.ndarray,
+                    sp.csr_array(
+                        (np.log(muxy_csr.data), muxy_csr.indices, muxy_csr.indptr),
+                        shape=muxy_csr.shape,
+                    ),
+                )
+            return cast(np.ndarray, _read_only(np.log(self.muxy)))
+
+        return cast(np.ndarray, self._cached("log_muxy", compute_log_muxy))
+
+    @property
+    def log_mux0(self) -> np.ndarray:
+        """the logarithms of `mux0`"""
+        return cast(
+            np.ndarray, self._cached("log_mux0", lambda: _read_only(np.log(self.mux0)))
+        )
+
+    @property
+    def log_mu0y(self) -> np.ndarray:
+        """the logarithms of `mu0y`"""
+        return cast(
+            np.ndarray, self._cached("log_mu0y", lambda: _read_only(np.log(self.mu0y)))
+        )
+
+    @property
+    def log_n(self) -> np.ndarray:
+        """the logarithms of `n`"""
+        return cast(
+            np.ndarray, self._cached("log_n", lambda: _read_only(np.log(self.n)))
+        )
+
+    @property
+    def log_m(self) -> np.ndarray:
+        """the logarithms of `m`"""
+        return cast(
+            np.ndarray, self._cached("log_m", lambda: _read_only(np.log(self.m)))
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Matching(_CachedLogs):
     """stores the numbers of couples and singles of every type;
 
-    `muxy` is an (X,Y)-matrix
+    `muxy` is an (X,Y)-matrix; it can be a `scipy.sparse` (e.g. COO or CSR) matrix,
+        whose cells that are not stored are pairs that cannot match;
+        it is then stored in CSR format, with memory proportional to its nonzeros
     `n` is an X-vector
     `m` is an Y-vector
 
@@ -45,6 +152,11 @@ class Matching:
     `mux0` and `mu0y` are generated as the corresponding numbers of singles
     as well as the total number of households `n_households`
     and the total number of individuals `n_individuals`
+
+    A `Matching` is immutable: it is validated once when it is created,
+    on read-only copies of the arrays that the caller could still change,
+    and the derived quantities
+    (`log_muxy`, `proportions`,...) are computed on first access and cached.
     """
 
     muxy: np.ndarray
@@ -56,10 +168,11 @@ class Matching:
     mu0y: np.ndarray = field(init=False)
     n_households: float = field(init=False)
     n_individuals: float = field(init=False)
+    _cache: dict[str, Any] = field(init=False, repr=False, compare=False)
 
     def __str__(self):
         X, Y = self.muxy.shape
-        n_couples = np.sum(self.muxy)
+        n_couples = self.n_couples
         n_men, n_women = np.sum(self.n), np.sum(self.m)
         repr_str = f"This is a matching with {n_men} men and {n_women} women.\n"
         repr_str += f"   with {n_couples} couples,\n"
@@ -69,33 +182,218 @@ class Matching:
         return repr_str
 
     def __post_init__(self):
-        X, Y = check_matrix(self.muxy)
+        # the dataclass is frozen, so we set the fields with object.__setattr__;
+        # we validate our own copies of the arrays that the caller could change
+        for name in ("muxy", "n", "m"):
+            object.__setattr__(self, name, _owned(getattr(self, name)))
+        if sp.issparse(self.muxy):
+            cast(sp.csr_array, self.muxy).sum_duplicates()
+            X, Y = self.muxy.shape
+        else:
+            X, Y = check_matrix(self.muxy)
         Xn = check_vector(self.n)
         Ym = check_vector(self.m)
         if Xn != X:
             bs_error_abort(f"muxy is a ({X}, {Y}) matrix but n has {Xn} elements.")
         if Ym != Y:
             bs_error_abort(f"muxy is a ({X}, {Y}) matrix but m has {Ym} elements.")
-        self.mux0, self.mu0y = get_singles(self.muxy, self.n, self.m)
-        self.n_households = np.sum(self.muxy) + np.sum(self.mux0) + np.sum(self.mu0y)
+        mux0, mu0y = get_singles(self.muxy, self.n, self.m)
+        n_couples = float(np.sum(self.muxy))
+        n_singles = float(np.sum(mux0) + np.sum(mu0y))
+        n_households = n_couples + n_singles
+        min_xy = np.min(self.muxy)
+        if min_xy < 0.0:
+            bs_error_abort(f"The smallest muxy is {min_xy}")
         if self.no_singles:
-            _check_no_singles(self.mux0, self.n_households, "men")
-            _check_no_singles(self.mu0y, self.n_households, "women")
-        self.n_individuals = (
-            2.0 * np.sum(self.muxy) + np.sum(self.mux0) + np.sum(self.mu0y)
-        )
+            _check_no_singles(mux0, n_households, "men")
+            _check_no_singles(mu0y, n_households, "women")
+        else:
+            min_x0, min_0y = np.min(mux0), np.min(mu0y)
+            if min_x0 < 0.0:
+                bs_error_abort(f"The smallest mux0 is {min_x0}")
+            if min_0y < 0.0:
+                bs_error_abort(f"The smallest mu0y is {min_0y}")
+        object.__setattr__(self, "mux0", _read_only(mux0))
+        object.__setattr__(self, "mu0y", _read_only(mu0y))
+        object.__setattr__(self, "n_households", n_households)
+        object.__setattr__(self, "n_individuals", 2.0 * n_couples + n_singles)
+        object.__setattr__(self, "_cache", {"n_couples": n_couples})
 
     def unpack(self):
-        muxy, mux0, mu0y = self.muxy, self.mux0, self.mu0y
-        min_xy, min_x0, min_0y = np.min(muxy), np.min(mux0), np.min(mu0y)
+        return self.muxy, self.mux0, self.mu0y, self.n, self.m
+
+    def __reduce__(self):
+        # an unpickled copy, e.g. from a cache, is validated and read-only again
+        return type(self), (self.muxy, self.n, self.m, self.no_singles)
+
+    @property
+    def n_couples(self) -> float:
+        """the total number of couples"""
+        return cast(float, self._cache["n_couples"])
+
+    @property
+    def stored_cells(self) -> TwoArrays:
+        """the row and column indices of the stored cells of `muxy`,
+        in the order of `muxy.data` if it is sparse and of `muxy.ravel()` otherwise"""
+
+        def compute_stored_cells() -> TwoArrays:
+            X, Y = self.muxy.shape
+            if sp.issparse(self.muxy):
+                muxy_csr = cast(sp.csr_array, self.muxy)
+                rows = np.repeat(np.arange(X), np.diff(muxy_csr.indptr))
+                return _read_only(rows), _read_only(muxy_csr.indices)
+            rows, cols = np.divmod(np.arange(X * Y), Y)
+            return _read_only(rows), _read_only(cols)
+
+        return cast(TwoArrays, self._cached("stored_cells", compute_stored_cells))
+
+    @property
+    def proportions(self) -> ThreeArrays:
+        """`muxy`, `mux0` and `mu0y` divided by the number of households"""
+
+        def compute_proportions() -> ThreeArrays:
+            muxy, mux0, mu0y = (
+                _read_only(mu / self.n_households)
+                for mu in (self.muxy, self.mux0, self.mu0y)
+            )
+            return muxy, mux0, mu0y
+
+        return cast(ThreeArrays, self._cached("proportions", compute_proportions))
+
+
+@dataclass(frozen=True, slots=True)
+class MatchingBatch(_CachedLogs):
+    """stores `B` matchings with the same numbers of types in contiguous arrays;
+
+    `muxy` is a (B,X,Y)-array
+    `n` is a (B,X)-array
+    `m` is a (B,Y)-array
+
+    `no_singles`: if `True`, these are matchings w/o singles
+
+    `mux0`, `mu0y`, `n_households` and `n_individuals` are generated
+    as in `Matching`, with a leading dimension `B`.
+    The batch is validated once when it is created; `batch[b]` is the `b`-th
+    `Matching`, whose arrays are views into those of the batch.
+    """
+
+    muxy: np.ndarray
+    n: np.ndarray
+    m: np.ndarray
+    no_singles: bool = False
+
+    mux0: np.ndarray = field(init=False)
+    mu0y: np.ndarray = field(init=False)
+    n_households: np.ndarray = field(init=False)
+    n_individuals: np.ndarray = field(init=False)
+    _cache: dict[str, Any] = field(init=False, repr=False, compare=False)
+
+    def __str__(self):
+        B, X, Y = self.muxy.shape
+        return (
+            f"This is a batch of {B} matchings with {X} types of men and {Y} of women."
+        )
+
+    def __post_init__(self):
+        for name in ("muxy", "n", "m"):
+            object.__setattr__(self, name, _owned(getattr(self, name)))
+        if self.muxy.ndim != 3:
+            bs_error_abort(
+                f"muxy should be a (B, X, Y) array, not a {self.muxy.ndim}-dim array."
+            )
+        B, X, Y = self.muxy.shape
+        if self.n.shape != (B, X):
+            bs_error_abort(f"muxy has shape ({B}, {X}, {Y}) but n has {self.n.shape}.")
+        if self.m.shape != (B, Y):
+            bs_error_abort(f"muxy has shape ({B}, {X}, {Y}) but m has {self.m.shape}.")
+        mux0, mu0y = get_singles(self.muxy, self.n, self.m)
+        n_couples = np.sum(self.muxy, (1, 2))
+        n_singles = np.sum(mux0, 1) + np.sum(mu0y, 1)
+        n_households = n_couples + n_singles
+        min_xy = np.min(self.muxy)
         if min_xy < 0.0:
             bs_error_abort(f"The smallest muxy is {min_xy}")
-        if not self.no_singles:
+        if self.no_singles:
+            max_singles = np.maximum(np.max(np.abs(mux0), 1), np.max(np.abs(mu0y), 1))
+            if np.any(max_singles > SINGLES_TOL * n_households):
+                bs_error_abort(
+                    "In a model w/o singles, we should not have any single men or women."
+                )
+        else:
+            min_x0, min_0y = np.min(mux0), np.min(mu0y)
             if min_x0 < 0.0:
                 bs_error_abort(f"The smallest mux0 is {min_x0}")
             if min_0y < 0.0:
-                bs_error_abort(f"The smallest mux0 is {min_0y}")
-        return muxy, mux0, mu0y, self.n, self.m
+                bs_error_abort(f"The smallest mu0y is {min_0y}")
+        for name, value in (
+            ("mux0", mux0),
+            ("mu0y", mu0y),
+            ("n_households", n_households),
+            ("n_individuals", 2.0 * n_couples + n_singles),
+        ):
+            object.__setattr__(self, name, _read_only(value))
+        object.__setattr__(self, "_cache", {"n_couples": _read_only(n_couples)})
+
+    @classmethod
+    def from_matchings(cls, matchings: list[Matching]) -> "MatchingBatch":
+        """stacks a list of dense `Matching`s with the same numbers of types
+
+        Args:
+            matchings: the list of `Matching`s
+
+        Returns:
+            the `MatchingBatch`
+        """
+        if not matchings:
+            bs_error_abort("We need at least one Matching.")
+        if any(sp.issparse(mus.muxy) for mus in matchings):
+            bs_error_abort("A MatchingBatch cannot store sparse matchings.")
+        shapes = {mus.muxy.shape for mus in matchings}
+        if len(shapes) > 1:
+            bs_error_abort(f"The matchings have different shapes {shapes}.")
+        no_singles = {mus.no_singles for mus in matchings}
+        if len(no_singles) > 1:
+            bs_error_abort("The matchings should all have singles, or none of them.")
+        stacked = [
+            np.stack([getattr(mus, name) for mus in matchings])
+            for name in ("muxy", "n", "m")
+        ]
+        # no one else has the stacked arrays, so the batch need not copy them
+        for arr in stacked:
+            arr.flags.writeable = False
+        muxy, n, m = stacked
+        return cls(muxy, n, m, no_singles=no_singles.pop())
+
+    def __len__(self) -> int:
+        return int(self.muxy.shape[0])
+
+    def __getitem__(self, b: int) -> Matching:
+        return Matching(self.muxy[b], self.n[b], self.m[b], no_singles=self.no_singles)
+
+    def __iter__(self) -> Iterator[Matching]:
+        return (self[b] for b in range(len(self)))
+
+    def unpack(self):
+        return self.muxy, self.mux0, self.mu0y, self.n, self.m
+
+    @property
+    def n_couples(self) -> np.ndarray:
+        """the B total numbers of couples"""
+        return cast(np.ndarray, self._cache["n_couples"])
+
+    @property
+    def proportions(self) -> ThreeArrays:
+        """`muxy`, `mux0` and `mu0y` divided by the numbers of households"""
+
+        def compute_proportions() -> ThreeArrays:
+            n_households = self.n_households
+            return (
+                _read_only(self.muxy / n_households.reshape((-1, 1, 1))),
+                _read_only(self.mux0 / n_households.reshape((-1, 1))),
+                _read_only(self.mu0y / n_households.reshape((-1, 1))),
+            )
+
+        return cast(ThreeArrays, self._cached("proportions", compute_proportions))
 
 
 class MatchingFunction(Protocol):
@@ -119,7 +417,11 @@ def get_margins(mus: Matching) -> TwoArrays:
 
 
 def simulate_sample_from_mus(
-    mus: Matching, n_households: int, no_singles: bool = False, seed: int | None = None
+    mus: Matching,
+    n_households: int,
+    no_singles: bool = False,
+    seed: int | None = None,
+    dtype: DTypeLike | None = None,
 ) -> Matching:
     """Draw a sample of `n_households` from the matching patterns in `mus`
 
@@ -128,38 +430,53 @@ def simulate_sample_from_mus(
         n_households: the number of households requested
         no_singles: if `True`, this is a model w/o singles
         seed: an integer seed for the random number generator
+        dtype: if given, the type of the simulated numbers (e.g. `np.float32`);
+            by default they are integers
 
     Returns:
-        the sample matching patterns
+        the sample matching patterns; if `mus.muxy` is sparse,
+        so is the simulated `muxy`, with the same stored cells
     """
     rng = np.random.default_rng(seed)
     muxy, mux0, mu0y, _, _ = mus.unpack()
     X, Y = muxy.shape
+    # we only draw the stored cells of a sparse muxy
+    is_sparse = sp.issparse(muxy)
+    muxy_cells = muxy.data if is_sparse else muxy.reshape(X * Y)
     # stack all probabilities
-    XY = X * Y
+    n_cells = muxy_cells.size
     # make sure we have no zeros
     _MU_EPS = min(1, int(1e-3 * n_households))
     if no_singles:
-        pvec = muxy.reshape(XY)
+        # the multinomial needs double-precision probabilities
+        pvec = muxy_cells.astype(np.float64)
         pvec /= np.sum(pvec)
         matches = rng.multinomial(n_households, pvec)
-        muxy_sim = matches.reshape((X, Y))
+        cells_sim = matches
         mux0_sim = np.full(X, _MU_EPS)
         mu0y_sim = np.full(Y, _MU_EPS)
     else:
-        num_choices = XY + X + Y
+        num_choices = n_cells + X + Y
         pvec = np.zeros(num_choices)
-        pvec[:XY] = muxy.reshape(XY)
-        pvec[XY : (XY + X)] = mux0
-        pvec[(XY + X) :] = mu0y
+        pvec[:n_cells] = muxy_cells
+        pvec[n_cells : (n_cells + X)] = mux0
+        pvec[(n_cells + X) :] = mu0y
         pvec /= np.sum(pvec)
         matches = rng.multinomial(n_households, pvec)
-        muxy_sim = matches[:XY].reshape((X, Y))
-        mux0_sim = matches[XY : (XY + X)]
-        mu0y_sim = matches[(XY + X) :]
-        muxy_sim += _MU_EPS
+        cells_sim = matches[:n_cells]
+        mux0_sim = matches[n_cells : (n_cells + X)]
+        mu0y_sim = matches[(n_cells + X) :]
+        cells_sim += _MU_EPS
         mux0_sim += _MU_EPS
         mu0y_sim += _MU_EPS
+    if dtype is not None:
+        cells_sim = cells_sim.astype(dtype)
+        mux0_sim = mux0_sim.astype(dtype)
+        mu0y_sim = mu0y_sim.astype(dtype)
+    if is_sparse:
+        muxy_sim = sp.csr_array((cells_sim, muxy.indices, muxy.indptr), shape=(X, Y))
+    else:
+        muxy_sim = cells_sim.reshape((X, Y))
     n_sim, m_sim = compute_margins(muxy_sim, mux0_sim, mu0y_sim)
     mus_sim = Matching(muxy=muxy_sim, n=n_sim, m=m_sim, no_singles=no_singles)
     return mus_sim
@@ -402,7 +719,55 @@ def var_divide(varmus: VarianceMatching, d: float) -> VarianceMatching:
     return vardiv
 
 
-def variance_muhat(muhat: Matching) -> VarianceMatching:
+@dataclass(frozen=True)
+class SparseVarianceMatching:
+    """the variance-covariance of the observed matching patterns
+    when `muxy` is sparse.
+
+    With $N$ households and the proportions $p$ of the stored cells of `muxy`,
+    then of `mux0`, then of `mu0y`, the variance-covariance
+    of the stacked numbers is $N(\\textrm{diag}(p)-pp')$.
+    We only store $p$, so that memory is proportional to the number of stored cells.
+
+    `probs` is the vector $p$; it only has the stored cells of `muxy`
+        if `no_singles`
+    `n_households` is $N$
+    `no_singles`: if `True`, this is a model w/o singles
+    """
+
+    probs: np.ndarray
+    n_households: float
+    no_singles: bool = False
+
+    @property
+    def size(self) -> int:
+        """the number of rows and columns of the variance-covariance"""
+        return self.probs.size
+
+    def matvec(self, v: np.ndarray) -> np.ndarray:
+        """multiplies the variance-covariance by a vector or a matrix `v`"""
+        p = self.probs
+        if v.shape[0] != p.size:
+            bs_error_abort(f"v should have {p.size} rows, not {v.shape[0]}.")
+        if v.ndim == 1:
+            return cast(np.ndarray, self.n_households * (p * v - p * (p @ v)))
+        return cast(
+            np.ndarray,
+            self.n_households * (p.reshape((-1, 1)) * v - np.outer(p, p @ v)),
+        )
+
+    def diagonal(self) -> np.ndarray:
+        """the variances of the stacked numbers"""
+        p = self.probs
+        return cast(np.ndarray, self.n_households * p * (1.0 - p))
+
+    def to_dense(self) -> np.ndarray:
+        """the variance-covariance as a dense matrix; only for small problems"""
+        p = self.probs
+        return cast(np.ndarray, self.n_households * (np.diag(p) - np.outer(p, p)))
+
+
+def variance_muhat(muhat: Matching) -> VarianceMatching | SparseVarianceMatching:
     """
     Computes the unweighted variance-covariance matrix of the observed matching patterns
 
@@ -410,8 +775,19 @@ def variance_muhat(muhat: Matching) -> VarianceMatching:
         muhat: a `Matching` object
 
     Returns:
-        the corresponding `VarianceMatching` object
+        the corresponding `VarianceMatching` object;
+        a `SparseVarianceMatching` if `muhat.muxy` is sparse
     """
+    if sp.issparse(muhat.muxy):
+        n_households = muhat.n_households
+        muxy_csr = cast(sp.csr_array, muhat.muxy)
+        probs: np.ndarray = muxy_csr.data / n_households
+        if not muhat.no_singles:
+            probs = np.concatenate(
+                (probs, muhat.mux0 / n_households, muhat.mu0y / n_households)
+            )
+        return SparseVarianceMatching(probs, n_households, no_singles=muhat.no_singles)
+
     muxy, mux0, mu0y, *_ = muhat.unpack()
     X, Y = muxy.shape
     XY = X * Y
@@ -0,0 +1,349 @@
+"""Aggregates household-level microdata into a `Matching`, one chunk at a time,
+and simulates such microdata from a `Matching`.
+
+Each record is a household: the type of the husband and the type of the wife,
+with a missing value for the wife of a single man and for the husband of a single woman.
+`MatchingCounts` accumulates the numbers of couples and singles of each type
+with bulk `np.bincount` updates, so that the microdata never need to be held in memory;
+the partial counts of workers that read different parts of the data can be merged.
+
+Example:
+    ```py
+    men_types = ["HS dropout", "HS graduate", "College"]
+    women_types = men_types
+    counts = read_microdata("households.parquet", men_types, women_types)
+    mus = counts.to_matching()
+    ```
+
+`MicrodataSampler` goes the other way: it draws household records
+from a `Matching` in chunks, each with its own deterministic seed,
+so that the chunks can be generated in parallel and reproduced independently.
+"""
+
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, cast
+
+import numpy as np
+import scipy.sparse as sp
+from bs_python_utils.bsutils import bs_error_abort
+
+from cupid_matching.matching_utils import Matching, compute_margins
+
+
+@dataclass
+class MatchingCounts:
+    """the (possibly weighted) numbers of couples and singles of each type
+    in the records aggregated so far
+
+    Args:
+        muxy: the (X,Y) numbers of couples
+        mux0: the X numbers of single men
+        mu0y: the Y numbers of single women
+    """
+
+    muxy: np.ndarray
+    mux0: np.ndarray
+    mu0y: np.ndarray
+
+    def __post_init__(self):
+        X, Y = self.muxy.shape
+        if self.mux0.shape != (X,):
+            bs_error_abort(f"mux0 should have shape ({X},), not {self.mux0.shape}")
+        if self.mu0y.shape != (Y,):
+            bs_error_abort(f"mu0y should have shape ({Y},), not {self.mu0y.shape}")
+
+    @classmethod
+    def empty(cls, X: int, Y: int) -> "MatchingCounts":
+        """returns zero counts for `X` types of men and `Y` types of women"""
+        return cls(np.zeros((X, Y)), np.zeros(X), np.zeros(Y))
+
+    @property
+    def n_households(self) -> float:
+        """the (weighted) number of households aggregated so far"""
+        return float(np.sum(self.muxy) + np.sum(self.mux0) + np.sum(self.mu0y))
+
+    def add(
+        self,
+        x_types: np.ndarray,
+        y_types: np.ndarray,
+        weights: np.ndarray | None = None,
+    ) -> None:
+        """adds a chunk of households to the counts
+
+        Args:
+            x_types: the type indices of the husbands, -1 for single women
+            y_types: the type indices of the wives, -1 for single men
+            weights: the weights of the households, if any
+        """
+        X, Y = self.muxy.shape
+        n_records = x_types.size
+        if y_types.size != n_records:
+            bs_error_abort(
+                f"We have {n_records} husband types but {y_types.size} wife types."
+            )
+        if weights is not None and weights.size != n_records:
+            bs_error_abort(f"We have {n_records} records but {weights.size} weights.")
+        if np.any(x_types >= X) or np.any(y_types >= Y):
+            bs_error_abort(f"The type indices should be smaller than {X} and {Y}.")
+        has_husband, has_wife = x_types >= 0, y_types >= 0
+        if not np.all(has_husband | has_wife):
+            bs_error_abort("Some records have neither a husband nor a wife.")
+        couples = has_husband & has_wife
+        single_men = has_husband & ~has_wife
+        single_women = has_wife & ~has_husband
+
+        def count(indices: np.ndarray, selected: np.ndarray, size: int) -> np.ndarray:
+            selected_weights = None if weights is None else weights[selected]
+            return np.bincount(
+                indices[selected], weights=selected_weights, minlength=size
+            )
+
+        self.muxy += count(x_types * Y + y_types, couples, X * Y).reshape((X, Y))
+        self.mux0 += count(x_types, single_men, X)
+        self.mu0y += count(y_types, single_women, Y)
+
+    def merge(self, other: "MatchingCounts") -> "MatchingCounts":
+        """returns the sum of these counts and of `other`, e.g. from another worker"""
+        if other.muxy.shape != self.muxy.shape:
+            bs_error_abort(
+                f"We cannot merge counts of shapes {self.muxy.shape}"
+                f" and {other.muxy.shape}."
+            )
+        return MatchingCounts(
+            self.muxy + other.muxy, self.mux0 + other.mux0, self.mu0y + other.mu0y
+        )
+
+    def to_matching(self, sparse: bool = False) -> Matching:
+        """returns the `Matching` of the counts
+
+        Args:
+            sparse: if `True`, `muxy` is stored as a sparse matrix
+                whose stored cells are the observed couples;
+                the other pairs are then treated as unable to match
+
+        Returns:
+            the `Matching`
+        """
+        n, m = compute_margins(self.muxy, self.mux0, self.mu0y)
+        muxy = sp.csr_array(self.muxy) if sparse else self.muxy.copy()
+        return Matching(muxy, n, m)
+
+
+def merge_counts(partial_counts: Iterable[MatchingCounts]) -> MatchingCounts:
+    """sums the partial counts of several workers
+
+    Args:
+        partial_counts: the `MatchingCounts` of the workers
+
+    Returns:
+        the total `MatchingCounts`
+    """
+    total: MatchingCounts | None = None
+    for counts in partial_counts:
+        total = counts if total is None else total.merge(counts)
+    if total is None:
+        bs_error_abort("We need at least one MatchingCounts.")
+    return cast(MatchingCounts, total)
+
+
+def type_codes(values: Any, types: Sequence) -> np.ndarray:
+    """maps the values of a categorical attribute to type indices
+
+    Args:
+        values: an array or a `pandas.Series` of values
+        types: the list of possible values; type `i` is `types[i]`
+
+    Returns:
+        the type indices, with -1 for missing values
+    """
+    import pandas as pd
+
+    type_index = pd.Index(types)
+    if not type_index.is_unique:
+        bs_error_abort("The types should be distinct.")
+    codes = np.asarray(type_index.get_indexer(values), dtype=np.int64)
+    unknown = (codes < 0) & np.asarray(pd.notna(values))
+    if np.any(unknown):
+        unknown_values = np.unique(np.asarray(values, dtype=object)[unknown])[:5]
+        bs_error_abort(f"Some values are not in the types, e.g. {unknown_values}")
+    return codes
+
+
+def aggregate_microdata(
+    chunks: Iterable[Mapping[str, Any]],
+    men_types: Sequence,
+    women_types: Sequence,
+    husband_col: str = "husband_type",
+    wife_col: str = "wife_type",
+    weight_col: str | None = None,
+) -> MatchingCounts:
+    """aggregates chunks of household records into counts
+
+    Args:
+        chunks: an iterable of chunks, e.g. `pandas.DataFrame`s or dicts of arrays
+        men_types: the possible values of the type of the husband
+        women_types: the possible values of the type of the wife
+        husband_col: the column with the type of the husband, missing for single women
+        wife_col: the column with the type of the wife, missing for single men
+        weight_col: the column with the weights of the households, if any
+
+    Returns:
+        the `MatchingCounts`
+    """
+    counts = MatchingCounts.empty(len(men_types), len(women_types))
+    for chunk in chunks:
+        weights = (
+            None
+            if weight_col is None
+            else np.asarray(chunk[weight_col], dtype=np.float64)
+        )
+        counts.add(
+            type_codes(chunk[husband_col], men_types),
+            type_codes(chunk[wife_col], women_types),
+            weights,
+        )
+    return counts
+
+
+def iter_microdata_chunks(
+    path: str | Path, columns: list[str], chunksize: int = 1_000_000
+) -> Iterator[Any]:
+    """reads a CSV or Parquet file in chunks of `chunksize` records
+
+    Args:
+        path: the path of the file; `.parquet` and `.pq` files are read as Parquet,
+            which requires the `parquet` extra (`pyarrow`);
+            other files are read as CSV (possibly compressed)
+        columns: the columns to read
+        chunksize: the number of records in each chunk
+
+    Returns:
+        an iterator over `pandas.DataFrame`s
+    """
+    path = Path(path)
+    if path.suffix in {".parquet", ".pq"}:
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+
+        with pd.read_csv(path, usecols=columns, chunksize=chunksize) as reader:
+            yield from reader
+
+
+def read_microdata(
+    path: str | Path,
+    men_types: Sequence,
+    women_types: Sequence,
+    husband_col: str = "husband_type",
+    wife_col: str = "wife_type",
+    weight_col: str | None = None,
+    chunksize: int = 1_000_000,
+) -> MatchingCounts:
+    """streams a CSV or Parquet file of household records into counts
+
+    Args:
+        path: the path of the file
+        men_types: the possible values of the type of the husband
+        women_types: the possible values of the type of the wife
+        husband_col: the column with the type of the husband, missing for single women
+        wife_col: the column with the type of the wife, missing for single men
+        weight_col: the column with the weights of the households, if any
+        chunksize: the number of records read at a time
+
+    Returns:
+        the `MatchingCounts`; call its `to_matching` method to get a `Matching`
+    """
+    columns = [husband_col, wife_col] + ([] if weight_col is None else [weight_col])
+    return aggregate_microdata(
+        iter_microdata_chunks(path, columns, chunksize),
+        men_types,
+        women_types,
+        husband_col=husband_col,
+        wife_col=wife_col,
+        weight_col=weight_col,
+    )
+
+
+@dataclass
+class MicrodataSampler:
+    """draws household records from the matching patterns of a `Matching`
+
+    Chunk `i` is drawn with the seed sequence spawned from `seed` with key `i`,
+    so that it does not depend on the other chunks.
+
+    Args:
+        mus: the matching patterns
+        seed: the root seed
+        no_singles: if `True`, all households are couples
+    """
+
+    mus: Matching
+    seed: int = 0
+    no_singles: bool = False
+    _cdf: np.ndarray = field(init=False, repr=False)
+    _x_types: np.ndarray = field(init=False, repr=False)
+    _y_types: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        muxy, mux0, mu0y, _, _ = self.mus.unpack()
+        X, Y = muxy.shape
+        # the possible households: the couples first, then the singles
+        if sp.issparse(muxy):
+            cells = muxy.data
+            x_couples = np.repeat(np.arange(X), np.diff(muxy.indptr))
+            y_couples = muxy.indices
+        else:
+            cells = muxy.reshape(X * Y)
+            x_couples, y_couples = np.divmod(np.arange(X * Y), Y)
+        probs = [cells]
+        x_types, y_types = [x_couples], [y_couples]
+        if not self.no_singles:
+            probs += [mux0, mu0y]
+            x_types += [np.arange(X), np.full(Y, -1)]
+            y_types += [np.full(X, -1), np.arange(Y)]
+        cdf = np.cumsum(np.concatenate(probs), dtype=np.float64)
+        self._cdf = cdf / cdf[-1]
+        self._x_types = np.concatenate(x_types).astype(np.int32)
+        self._y_types = np.concatenate(y_types).astype(np.int32)
+
+    def chunk(self, chunk_index: int, chunk_size: int) -> dict[str, np.ndarray]:
+        """draws one chunk of household records
+
+        Args:
+            chunk_index: the index of the chunk, which determines its seed
+            chunk_size: the number of households in the chunk
+
+        Returns:
+            a dict with the `husband_type` and `wife_type` indices
+            of the households, with -1 for the missing partner of a single
+        """
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(chunk_index,))
+        rng = np.random.default_rng(seed_sequence)
+        households = np.searchsorted(self._cdf, rng.random(chunk_size), side="right")
+        # guard against rounding in the last element of the cdf
+        np.minimum(households, self._cdf.size - 1, out=households)
+        return {
+            "husband_type": self._x_types[households],
+            "wife_type": self._y_types[households],
+        }
+
+    def chunks(
+        self, n_households: int, chunksize: int = 1_000_000
+    ) -> Iterator[dict[str, np.ndarray]]:
+        """draws `n_households` household records, `chunksize` at a time
+
+        Args:
+            n_households: the total number of households
+            chunksize: the number of households in each chunk but the last one
+
+        Returns:
+            an iterator over the chunks returned by `chunk`
+        """
+        for chunk_index, start in enumerate(range(0, n_households, chunksize)):
+            yield self.chunk(chunk_index, min(chunksize, n_households - start))
@@ -2,10 +2,14 @@
 The entropy function and the surplus matrix must both be linear in the parameters.
 """
 
-from typing import cast
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, cast
 
 import numpy as np
-import scipy.stats as sts
+import scipy.linalg as spla
+from bs_python_utils.bsnputils import ThreeArrays, TwoArrays, npmaxabs
 from bs_python_utils.bsutils import bs_error_abort, print_stars
 
 from cupid_matching.entropy import (
@@ -13,43 +17,63 @@ from cupid_matching.entropy import (
     EntropyHessianMuMu,
     EntropyHessianMuR,
     EntropyHessians,
+    EntropyHessiansAlpha,
     numeric_hessian,
 )
 from cupid_matching.matching_utils import Matching, MatchingFunction
 from cupid_matching.min_distance_utils import (
     MDEResults,
+    MDESpecificationSearch,
+    PooledMDEResults,
     check_args_mde,
     check_indep_phi_no_singles,
+    chi2_pvalue,
     compute_estimates,
     get_initial_weighting_matrix,
     get_optimal_weighting_matrix,
-    make_D2_matrix,
+    get_variance_entropy_gradient,
     make_hessian_mde,
 )
+from cupid_matching.prepared_market import PreparedMarket, as_prepared_market
 from cupid_matching.utils import make_XY_K_mat
+from cupid_matching.weighting_matrix import (
+    IdentityWeighting,
+    InverseCovarianceWeighting,
+    WeightingMatrix,
+)
 
 
 def estimate_semilinear_mde(
-    muhat: Matching,
-    phi_bases: np.ndarray,
+    muhat: Matching | PreparedMarket,
+    phi_bases: np.ndarray | None,
     entropy: EntropyFunctions,
     no_singles: bool = False,
     additional_parameters: list | None = None,
-    initial_weighting_matrix: np.ndarray | None = None,
+    initial_weighting_matrix: np.ndarray | WeightingMatrix | None = None,
+    iterated: bool = False,
+    maxiter_mde: int = 50,
+    tol_mde: float = 1e-6,
     verbose: bool = False,
 ) -> MDEResults:
     """
     Estimates the parameters of the distributions and of the base functions.
 
     Args:
-        muhat: the observed `Matching`
-        phi_bases: an (X, Y, K) array of bases
+        muhat: the observed `Matching`, or a `PreparedMarket`
+            that caches the data shared with the Poisson GLM estimator
+        phi_bases: an (X, Y, K) array of bases; `None` if `muhat` is a `PreparedMarket`
         entropy: an `EntropyFunctions` object
         no_singles: if `True`, only couples are observed
         additional_parameters: additional parameters of the distribution of errors,
             if any
         initial_weighting_matrix: if specified, used as the weighting matrix
-            for the first step when `entropy.param_dependent` is `True`
+            for the first step when `entropy.param_dependent` is `True`;
+            it can be a dense matrix or a `WeightingMatrix`, e.g. in factored form.
+            By default we use the identity, and the first step is OLS.
+        iterated: if `True` and `entropy.param_dependent` is `True`,
+            we iterate the efficient weighting and the estimation to convergence
+        maxiter_mde: the maximum number of efficient-weighting steps if `iterated`
+        tol_mde: the tolerance on the change in the coefficients if `iterated`
         verbose: prints stuff if `True`
 
     Returns:
@@ -84,19 +108,22 @@ def estimate_semilinear_mde(
         ```
 
     """
-    X, Y, K = check_args_mde(muhat, phi_bases)
+    prepared = as_prepared_market(muhat, phi_bases)
+    muhat = prepared.muhat
+    X, Y, K = check_args_mde(muhat, prepared.phi_bases)
     XY = X * Y
     X1Y1 = (X - 1) * (Y - 1)
     parameterized_entropy = entropy.parameter_dependent
     S_mat = get_initial_weighting_matrix(
-        parameterized_entropy, initial_weighting_matrix, XY
+        parameterized_entropy, initial_weighting_matrix, X1Y1 if no_singles else XY
     )
+    var_munm = prepared.var_muhat.var_munm
 
-    phi_mat = make_XY_K_mat(phi_bases)
+    phi_mat = prepared.phi_mat
 
     # if there are no singles, we need to premultiply by the randomized double differencing matrix $D_2$
     if no_singles:
-        D2_mat, rank_D2 = make_D2_matrix(X, Y)
+        D2_mat, rank_D2 = prepared.D2_matrix
         if rank_D2 != X1Y1:
             bs_error_abort(f"The D2 matrix should have rank {X1Y1} not {rank_D2}")
         phi_mat = D2_mat @ phi_mat
@@ -130,10 +157,12 @@ def estimate_semilinear_mde(
         # if there are no singles, we need to premultiply by the randomized double differencing matrix $D_2$
         if no_singles:
             S_mat = get_optimal_weighting_matrix(
-                muhat, hessians_both, no_singles, D2_mat
+                muhat, hessians_both, no_singles, D2_mat, var_munm=var_munm
             )
         else:
-            S_mat = get_optimal_weighting_matrix(muhat, hessians_both)
+            S_mat = get_optimal_weighting_matrix(
+                muhat, hessians_both, var_munm=var_munm
+            )
 
         estimated_coefficients, varcov_coefficients = compute_estimates(
             phi_mat, S_mat, e0_hat
@@ -141,6 +170,7 @@ def estimate_semilinear_mde(
         stderrs_coefficients = np.sqrt(np.diag(varcov_coefficients))
         est_Phi = phi_mat @ estimated_coefficients
         residuals = est_Phi + e0_hat
+        n_iterations = 1
     else:  # parameterized entropy: e0(mu,r) + e(mu,r) . alpha
         e_fun = cast(MatchingFunction, entropy.e_fun)
         e_vals = e_fun(muhat, additional_parameters)
@@ -148,71 +178,88 @@ def estimate_semilinear_mde(
 
         # if there are no singles, we need to premultiply by the randomized double differencing matrix $D_2$
         if no_singles:
-            e0_hat = D2_mat @ e0_hat
+            e_hat = D2_mat @ e_hat
 
         F_hat = np.column_stack((e_hat, phi_mat))
         n_pars = e_hat.shape[1] + K
 
         # first pass with an initial weighting matrix
-        first_coeffs, _ = compute_estimates(F_hat, cast(np.ndarray, S_mat), e0_hat)
-        first_alpha = first_coeffs[:-K]
+        first_coeffs, _ = compute_estimates(
+            F_hat, cast(np.ndarray | WeightingMatrix, S_mat), e0_hat
+        )
 
         if verbose:
             print_stars("First-stage estimates:")
             print(first_coeffs)
 
-        # compute the efficient weighting matrix
+        # the parts of the efficient weighting matrix that do not depend on alpha
         hessian = entropy.hessian
+        hessian_components_e0: tuple[ThreeArrays, TwoArrays] | None = None
+        hessian_components_e: tuple[ThreeArrays, TwoArrays] | None = None
         if hessian == "provided":  # we have the analytical hessian
             e0_derivative = cast(EntropyHessians, entropy.e0_derivative)
-            e_derivative = cast(EntropyHessians, entropy.e_derivative)
             e0_derivative_mumu = cast(EntropyHessianMuMu, e0_derivative[0])
             e0_derivative_mur = cast(EntropyHessianMuR, e0_derivative[1])
-            e_derivative_mumu = cast(EntropyHessianMuMu, e_derivative[0])
-            e_derivative_mur = cast(EntropyHessianMuR, e_derivative[1])
-            hessian_components_mumu_e0 = e0_derivative_mumu(
-                muhat, additional_parameters
-            )
-            hessian_components_mur_e0 = e0_derivative_mur(muhat, additional_parameters)
-            hessian_components_mumu_e = e_derivative_mumu(muhat, additional_parameters)
-            hessian_components_mur_e = e_derivative_mur(muhat, additional_parameters)
-
-            if verbose:
-                print_stars("First-stage estimates:")
-                print(first_coeffs)
-
-            hessian_components_mumu = (
-                hessian_components_mumu_e0[i]
-                + hessian_components_mumu_e[i] @ first_alpha
-                for i in range(3)
+            hessian_components_e0 = (
+                e0_derivative_mumu(muhat, additional_parameters),
+                e0_derivative_mur(muhat, additional_parameters),
             )
-            hessian_components_mur = (
-                hessian_components_mur_e0[i] + hessian_components_mur_e[i] @ first_alpha
-                for i in range(2)
-            )
-        else:  # we use a numeric hessian
-            hessian_components_mumu, hessian_components_mur = numeric_hessian(
+            if entropy.e_derivative_alpha is None:
+                e_derivative = cast(EntropyHessians, entropy.e_derivative)
+                e_derivative_mumu = cast(EntropyHessianMuMu, e_derivative[0])
+                e_derivative_mur = cast(EntropyHessianMuR, e_derivative[1])
+                hessian_components_e = (
+                    e_derivative_mumu(muhat, additional_parameters),
+                    e_derivative_mur(muhat, additional_parameters),
+                )
+
+        # the efficient weighting matrix at alpha, then the estimates;
+        #  if `iterated`, we loop until the coefficients settle down
+        current_coeffs = first_coeffs
+        maxiter_weighting = maxiter_mde if iterated else 1
+        n_iterations = 0
+        converged = False
+        while n_iterations < maxiter_weighting:
+            current_alpha = current_coeffs[:-K]
+            hessians_both = _hessian_at_alpha(
                 entropy,
                 muhat,
-                alpha=first_alpha,
-                additional_parameters=additional_parameters,
+                current_alpha,
+                additional_parameters,
+                hessian_components_e0,
+                hessian_components_e,
             )
-        hessians_both = make_hessian_mde(
-            hessian_components_mumu, hessian_components_mur
-        )
 
-        # if there are no singles, we need to premultiply by the randomized double differencing matrix $D_2$
-        if no_singles:
-            S_mat = get_optimal_weighting_matrix(
-                muhat, hessians_both, no_singles, D2_mat
+            # if there are no singles, we need to premultiply by the randomized double differencing matrix $D_2$
+            if no_singles:
+                S_mat = get_optimal_weighting_matrix(
+                    muhat, hessians_both, no_singles, D2_mat, var_munm=var_munm
+                )
+            else:
+                S_mat = get_optimal_weighting_matrix(
+                    muhat, hessians_both, var_munm=var_munm
+                )
+
+            # estimation with the efficient weighting matrix
+            estimated_coefficients, varcov_coefficients = compute_estimates(
+                F_hat, S_mat, e0_hat
+            )
+            n_iterations += 1
+            change_coeffs = npmaxabs(estimated_coefficients - current_coeffs)
+            current_coeffs = estimated_coefficients
+            if verbose and iterated:
+                print(
+                    f"MDE iteration {n_iterations}: the coefficients changed by"
+                    f" {change_coeffs: .2e}"
+                )
+            if change_coeffs < tol_mde:
+                converged = True
+                break
+        if iterated and not converged:
+            print_stars(
+                f"The iterated MDE did not converge in {maxiter_mde} iterations."
             )
-        else:
-            S_mat = get_optimal_weighting_matrix(muhat, hessians_both)
 
-        # second pass with the efficient weighting matrix
-        estimated_coefficients, varcov_coefficients = compute_estimates(
-            F_hat, S_mat, e0_hat
-        )
         est_alpha, est_beta = (
             estimated_coefficients[:-K],
             estimated_coefficients[-K:],
@@ -241,7 +288,436 @@ def estimate_semilinear_mde(
         estimated_Phi=est_Phi,
         test_statistic=test_stat,
         ndf=ndf,
-        test_pvalue=sts.chi2.sf(test_stat, ndf),
+        test_pvalue=chi2_pvalue(test_stat, ndf),
         parameterized_entropy=parameterized_entropy,
+        number_iterations=n_iterations,
     )
     return results
+
+
+def _hessian_at_alpha(
+    entropy: EntropyFunctions,
+    muhat: Matching,
+    alpha: np.ndarray,
+    additional_parameters: list | None,
+    hessian_components_e0: tuple[ThreeArrays, TwoArrays] | None,
+    hessian_components_e: tuple[ThreeArrays, TwoArrays] | None,
+) -> np.ndarray:
+    """Returns the hessian of a parameterized entropy at $\\alpha$, reusing
+    the components that do not depend on $\\alpha$
+
+    Args:
+        entropy: the `EntropyFunctions` object
+        muhat: the observed `Matching`
+        alpha: the current estimates of the parameters of the entropy
+        additional_parameters: additional parameters of the distribution of errors,
+            if any
+        hessian_components_e0: the components of the hessian of $e_0$,
+            if it is provided
+        hessian_components_e: the components of the hessian of $e$,
+            if it is provided and not as `e_derivative_alpha`
+
+    Returns:
+        the hessian of the entropy wrt $(\\mu, r)$
+    """
+    if hessian_components_e0 is None:  # we use a numeric hessian
+        hessian_components_mumu, hessian_components_mur = numeric_hessian(
+            entropy,
+            muhat,
+            alpha=alpha,
+            additional_parameters=additional_parameters,
+        )
+        return make_hessian_mde(hessian_components_mumu, hessian_components_mur)
+
+    hessian_components_mumu_e0, hessian_components_mur_e0 = hessian_components_e0
+    if hessian_components_e is None:
+        # the hessian of e is contracted with alpha as it is computed
+        e_derivative_alpha = cast(EntropyHessiansAlpha, entropy.e_derivative_alpha)
+        hessian_components_mumu_ea = e_derivative_alpha[0](
+            muhat, alpha, additional_parameters
+        )
+        hessian_components_mur_ea = e_derivative_alpha[1](
+            muhat, alpha, additional_parameters
+        )
+    else:
+        hessian_components_mumu_e, hessian_components_mur_e = hessian_components_e
+        hessian_components_mumu_ea = tuple(
+            hessian_components_mumu_e[i] @ alpha for i in range(3)
+        )
+        hessian_components_mur_ea = tuple(
+            hessian_components_mur_e[i] @ alpha for i in range(2)
+        )
+    hessian_components_mumu = cast(
+        ThreeArrays,
+        tuple(
+            hessian_components_mumu_e0[i] + hessian_components_mumu_ea[i]
+            for i in range(3)
+        ),
+    )
+    hessian_components_mur = cast(
+        TwoArrays,
+        tuple(
+            hessian_components_mur_e0[i] + hessian_components_mur_ea[i]
+            for i in range(2)
+        ),
+    )
+    return make_hessian_mde(hessian_components_mumu, hessian_components_mur)
+
+
+@dataclass
+class _PooledMarket:
+    """the quantities of one market that do not depend on the parameters"""
+
+    muhat: Matching
+    phi_bases: np.ndarray
+    entropy: EntropyFunctions
+    additional_parameters: list | None
+    phi_mat: np.ndarray
+    e0_hat: np.ndarray
+    e_hat: np.ndarray | None
+    D2_mat: np.ndarray | None
+    var_munm: np.ndarray
+    hessian_components_e0: tuple[ThreeArrays, TwoArrays] | None
+    hessian_components_e: tuple[ThreeArrays, TwoArrays] | None
+
+    @property
+    def n_alpha(self) -> int:
+        return 0 if self.e_hat is None else self.e_hat.shape[1]
+
+    def hessian(self, alpha: np.ndarray) -> np.ndarray:
+        """the hessian of the entropy wrt $(\\mu, r)$ at $\\alpha$"""
+        if self.e_hat is not None:
+            return _hessian_at_alpha(
+                self.entropy,
+                self.muhat,
+                alpha,
+                self.additional_parameters,
+                self.hessian_components_e0,
+                self.hessian_components_e,
+            )
+        if self.hessian_components_e0 is None:  # we use a numeric hessian
+            hessian_components_mumu, hessian_components_mur = numeric_hessian(
+                self.entropy,
+                self.muhat,
+                additional_parameters=self.additional_parameters,
+            )
+        else:
+            hessian_components_mumu, hessian_components_mur = self.hessian_components_e0
+        return make_hessian_mde(hessian_components_mumu, hessian_components_mur)
+
+
+@dataclass
+class _ConcentratedMarket:
+    """the whitened quantities of one market, with the parameters of the entropy
+    partialled out: `phi_tilde` and `e0_tilde` are orthogonal to the whitened `e_hat`,
+    whose QR decomposition is `(Q_e, R_e)`
+    """
+
+    phi_tilde: np.ndarray
+    e0_tilde: np.ndarray
+    Q_e_phi: np.ndarray | None = None
+    Q_e_e0: np.ndarray | None = None
+    R_e: np.ndarray | None = None
+
+    def alpha(self, beta: np.ndarray) -> np.ndarray:
+        """the estimates of the parameters of the entropy given `beta`"""
+        if self.R_e is None:
+            return np.zeros(0)
+        Q_e_phi, Q_e_e0 = cast(np.ndarray, self.Q_e_phi), cast(np.ndarray, self.Q_e_e0)
+        return cast(
+            np.ndarray, -spla.solve_triangular(self.R_e, Q_e_phi @ beta + Q_e_e0)
+        )
+
+    def objective(self, beta: np.ndarray) -> float:
+        """the value of the MDE objective at `beta` and the optimal `alpha`"""
+        residuals = self.phi_tilde @ beta + self.e0_tilde
+        return float(residuals @ residuals)
+
+
+def _map_markets(
+    fun: Callable[[Any], Any], items: Iterable[Any], n_jobs: int
+) -> list[Any]:
+    """applies `fun` to each market, in `n_jobs` threads if `n_jobs > 1`"""
+    if n_jobs == 1:
+        return [fun(item) for item in items]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(fun, items))
+
+
+def _prepare_pooled_market(
+    prepared: PreparedMarket,
+    entropy: EntropyFunctions,
+    no_singles: bool,
+    additional_parameters: list | None,
+) -> _PooledMarket:
+    """computes the quantities of one market that do not depend on the parameters"""
+    muhat, phi_bases = prepared.muhat, prepared.phi_bases
+    X, Y, _ = check_args_mde(muhat, phi_bases)
+    phi_mat = prepared.phi_mat
+    e0_hat = entropy.e0_fun(muhat, additional_parameters).ravel()
+    e_hat = None
+    if entropy.parameter_dependent:
+        e_fun = cast(MatchingFunction, entropy.e_fun)
+        e_hat = make_XY_K_mat(e_fun(muhat, additional_parameters))
+    D2_mat = None
+    if no_singles:
+        X1Y1 = (X - 1) * (Y - 1)
+        D2_mat, rank_D2 = prepared.D2_matrix
+        if rank_D2 != X1Y1:
+            bs_error_abort(f"The D2 matrix should have rank {X1Y1} not {rank_D2}")
+        phi_mat = D2_mat @ phi_mat
+        check_indep_phi_no_singles(phi_mat, X, Y)
+        e0_hat = D2_mat @ e0_hat
+        if e_hat is not None:
+            e_hat = D2_mat @ e_hat
+
+    hessian_components_e0: tuple[ThreeArrays, TwoArrays] | None = None
+    hessian_components_e: tuple[ThreeArrays, TwoArrays] | None = None
+    if entropy.hessian == "provided":
+        e0_derivative = cast(EntropyHessians, entropy.e0_derivative)
+        hessian_components_e0 = (
+            e0_derivative[0](muhat, additional_parameters),
+            e0_derivative[1](muhat, additional_parameters),
+        )
+        if e_hat is not None and entropy.e_derivative_alpha is None:
+            e_derivative = cast(EntropyHessians, entropy.e_derivative)
+            hessian_components_e = (
+                e_derivative[0](muhat, additional_parameters),
+                e_derivative[1](muhat, additional_parameters),
+            )
+    return _PooledMarket(
+        muhat=muhat,
+        phi_bases=phi_bases,
+        entropy=entropy,
+        additional_parameters=additional_parameters,
+        phi_mat=phi_mat,
+        e0_hat=e0_hat,
+        e_hat=e_hat,
+        D2_mat=D2_mat,
+        var_munm=prepared.var_muhat.var_munm,
+        hessian_components_e0=hessian_components_e0,
+        hessian_components_e=hessian_components_e,
+    )
+
+
+def _concentrate_market(
+    market: _PooledMarket, S_mat: WeightingMatrix
+) -> _ConcentratedMarket:
+    """whitens the quantities of one market with `S_mat`
+    and partials out the parameters of the entropy, if any
+    """
+    phi_white = S_mat.whiten(market.phi_mat)
+    e0_white = S_mat.whiten(market.e0_hat)
+    if market.e_hat is None:
+        return _ConcentratedMarket(phi_tilde=phi_white, e0_tilde=e0_white)
+    Q_e, R_e = spla.qr(S_mat.whiten(market.e_hat), mode="economic")
+    Q_e_phi = Q_e.T @ phi_white
+    Q_e_e0 = Q_e.T @ e0_white
+    return _ConcentratedMarket(
+        phi_tilde=phi_white - Q_e @ Q_e_phi,
+        e0_tilde=e0_white - Q_e @ Q_e_e0,
+        Q_e_phi=Q_e_phi,
+        Q_e_e0=Q_e_e0,
+        R_e=R_e,
+    )
+
+
+def _pooled_beta(
+    concentrated: list[_ConcentratedMarket],
+) -> tuple[np.ndarray, np.ndarray]:
+    """combines the K x K normal equations of the markets
+
+    Returns:
+        the estimates of beta and the inverse of the pooled normal matrix
+    """
+    normal_matrix = sum(c.phi_tilde.T @ c.phi_tilde for c in concentrated)
+    normal_rhs = sum(c.phi_tilde.T @ c.e0_tilde for c in concentrated)
+    normal_matrix = cast(np.ndarray, normal_matrix)
+    beta = -spla.solve(normal_matrix, normal_rhs, assume_a="pos")
+    return beta, cast(np.ndarray, spla.inv(normal_matrix))
+
+
+def estimate_pooled_semilinear_mde(
+    markets: list[tuple[Matching, np.ndarray]] | list[PreparedMarket],
+    entropy: EntropyFunctions | list[EntropyFunctions],
+    no_singles: bool = False,
+    additional_parameters: list[list | None] | None = None,
+    n_jobs: int = 1,
+    verbose: bool = False,
+) -> PooledMDEResults:
+    """
+    Estimates the coefficients of the bases, common to several markets;
+    the parameters of the entropy, if any, are specific to each market.
+
+    The weighting matrix is block-diagonal across markets: each market is whitened
+    and its entropy parameters are partialled out on its own,
+    possibly in `n_jobs` threads; then only the K x K normal equations are pooled.
+
+    Args:
+        markets: a list of pairs (`muhat`, `phi_bases`) with the observed `Matching`
+            and the (X, Y, K) array of bases in each market,
+            or a list of `PreparedMarket`s;
+            X and Y may differ across markets, K may not
+        entropy: an `EntropyFunctions` object, or one per market
+        no_singles: if `True`, only couples are observed
+        additional_parameters: additional parameters of the distribution of errors
+            in each market, if any
+        n_jobs: the number of threads used to process the markets
+        verbose: prints stuff if `True`
+
+    Returns:
+        a `PooledMDEResults` instance
+    """
+    n_markets = len(markets)
+    if n_markets == 0:
+        bs_error_abort("We need at least one market.")
+    entropies = entropy if isinstance(entropy, list) else [entropy] * n_markets
+    add_params = (
+        [None] * n_markets if additional_parameters is None else additional_parameters
+    )
+    if len(entropies) != n_markets or len(add_params) != n_markets:
+        bs_error_abort(
+            f"We have {n_markets} markets; we need as many entropies"
+            " and additional parameters."
+        )
+    prepared_markets = [
+        market if isinstance(market, PreparedMarket) else PreparedMarket(*market)
+        for market in markets
+    ]
+    K = prepared_markets[0].phi_bases.shape[-1]
+    for prepared_market in prepared_markets:
+        K_market = prepared_market.phi_bases.shape[-1]
+        if K_market != K:
+            bs_error_abort(f"All markets should have {K} bases, not {K_market}.")
+
+    prepared = _map_markets(
+        lambda i: _prepare_pooled_market(
+            prepared_markets[i], entropies[i], no_singles, add_params[i]
+        ),
+        range(n_markets),
+        n_jobs,
+    )
+
+    # first pass with identity weighting to estimate the parameters of the entropies
+    alphas = [np.zeros(market.n_alpha) for market in prepared]
+    if any(market.e_hat is not None for market in prepared):
+        concentrated = _map_markets(
+            lambda market: _concentrate_market(
+                market, IdentityWeighting(market.e0_hat.size)
+            ),
+            prepared,
+            n_jobs,
+        )
+        first_beta, _ = _pooled_beta(concentrated)
+        alphas = [c.alpha(first_beta) for c in concentrated]
+        if verbose:
+            print_stars("First-stage estimates of beta:")
+            print(first_beta)
+
+    # the efficient weighting matrix is block-diagonal across markets
+    def _efficient_concentration(i: int) -> _ConcentratedMarket:
+        market = prepared[i]
+        var_entropy_gradient = get_variance_entropy_gradient(
+            market.muhat,
+            market.hessian(alphas[i]),
+            no_singles,
+            market.D2_mat,
+            var_munm=market.var_munm,
+        )
+        return _concentrate_market(
+            market, InverseCovarianceWeighting(var_entropy_gradient)
+        )
+
+    concentrated = _map_markets(_efficient_concentration, range(n_markets), n_jobs)
+    estimated_beta, varcov_beta = _pooled_beta(concentrated)
+    estimated_alphas = [c.alpha(estimated_beta) for c in concentrated]
+
+    test_stat = sum(c.objective(estimated_beta) for c in concentrated)
+    n_rows = sum(market.e0_hat.size for market in prepared)
+    n_alphas = sum(market.n_alpha for market in prepared)
+    ndf = n_rows - K - n_alphas
+    n_households = 0.0
+    for prepared_market in prepared_markets:
+        muxyhat, *_, nhat, mhat = prepared_market.muhat.unpack()
+        n_households += np.sum(nhat) + np.sum(mhat) - np.sum(muxyhat)
+
+    return PooledMDEResults(
+        n_markets=n_markets,
+        K=K,
+        number_households=cast(int, n_households),
+        estimated_beta=estimated_beta,
+        varcov_beta=varcov_beta,
+        stderrs_beta=np.sqrt(np.diag(varcov_beta)),
+        estimated_alphas=estimated_alphas,
+        estimated_Phis=[
+            market.phi_bases @ estimated_beta for market in prepared_markets
+        ],
+        test_statistic=test_stat,
+        test_pvalue=chi2_pvalue(test_stat, ndf),
+        ndf=ndf,
+    )
+
+
+def prepare_mde_specification_search(
+    muhat: Matching | PreparedMarket,
+    phi_bases: np.ndarray | None,
+    entropy: EntropyFunctions,
+    no_singles: bool = False,
+    additional_parameters: list | None = None,
+) -> MDESpecificationSearch:
+    """
+    Prepares the MDE of a model with a parameter-free entropy
+    for a search over subsets of the bases. The variance of the data,
+    the hessian of the entropy and the factorization of the optimal weighting matrix
+    do not depend on which bases are used, so we only compute them once.
+
+    Args:
+        muhat: the observed `Matching`, or a `PreparedMarket`
+        phi_bases: an (X, Y, K) array of all candidate bases;
+            `None` if `muhat` is a `PreparedMarket`
+        entropy: an `EntropyFunctions` object, which must be parameter-free
+        no_singles: if `True`, only couples are observed
+        additional_parameters: additional parameters of the distribution of errors,
+            if any
+
+    Returns:
+        an `MDESpecificationSearch` instance; use its `evaluate`
+        and `evaluate_batch` methods to estimate models with subsets of the bases
+
+    Example:
+        ```py
+        search = prepare_mde_specification_search(mus_sim, phi_bases, entropy_choo_siow)
+        results = search.evaluate_batch([[0, 1], [0, 2], [0, 1, 2]])
+        pvalues = [res.test_pvalue for res in results]
+        ```
+    """
+    if entropy.parameter_dependent:
+        bs_error_abort(
+            "The specification search requires a parameter-free entropy:"
+            " otherwise the optimal weighting matrix depends on the bases."
+        )
+    prepared = as_prepared_market(muhat, phi_bases)
+    market = _prepare_pooled_market(
+        prepared, entropy, no_singles, additional_parameters
+    )
+    var_entropy_gradient = get_variance_entropy_gradient(
+        prepared.muhat,
+        market.hessian(np.zeros(0)),
+        no_singles,
+        market.D2_mat,
+        var_munm=market.var_munm,
+    )
+    S_mat = InverseCovarianceWeighting(var_entropy_gradient)
+    phi_white = S_mat.whiten(market.phi_mat)
+    e0_white = S_mat.whiten(market.e0_hat)
+    X, Y, _ = prepared.phi_bases.shape
+    return MDESpecificationSearch(
+        X=X,
+        Y=Y,
+        number_households=cast(int, prepared.muhat.n_households),
+        no_singles=no_singles,
+        phi_mat=market.phi_mat,
+        gram=phi_white.T @ phi_white,
+        cross=phi_white.T @ e0_white,
+        e0_norm2=float(e0_white @ e0_white),
+    )
@@ -1,10 +1,12 @@
 """Utility programs used in `min_distance.py`."""
 
+from collections.abc import Sequence
 from dataclasses import dataclass
-from typing import cast
+from typing import Any, cast
 
 import numpy as np
 import scipy.linalg as spla
+import scipy.sparse as sp
 from bs_python_utils.bsnputils import ThreeArrays, TwoArrays, npmaxabs
 from bs_python_utils.bsutils import bs_error_abort, print_stars
 
@@ -12,12 +14,29 @@ from cupid_matching.entropy import (
     fill_hessianMuMu_from_components,
     fill_hessianMuR_from_components,
 )
-from cupid_matching.matching_utils import Matching, variance_muhat
+from cupid_matching.matching_utils import Matching, VarianceMatching, variance_muhat
+from cupid_matching.weighting_matrix import (
+    IdentityWeighting,
+    WeightingMatrix,
+    weighted_least_squares,
+)
+
+
+def chi2_pvalue(test_stat: float | np.ndarray, ndf: int) -> Any:
+    """returns the p-value(s) of a $\\chi^2(ndf)$ test
+
+    `scipy.stats` is slow to import, so we only load it when we need a p-value.
+    """
+    import scipy.stats as sts
+
+    return sts.chi2.sf(test_stat, ndf)
 
 
 def check_args_mde(muhat: Matching, phi_bases: np.ndarray) -> tuple[int, int, int]:
     """check that the arguments to the MDE are consistent"""
     muxyhat, *_ = muhat.unpack()
+    if sp.issparse(muxyhat):
+        bs_error_abort("The MDE needs a dense muxy.")
     X, Y = muxyhat.shape
     ndims_phi = phi_bases.ndim
     if ndims_phi != 3:
@@ -31,13 +50,16 @@ def check_args_mde(muhat: Matching, phi_bases: np.ndarray) -> tuple[int, int, in
 
 
 def get_initial_weighting_matrix(
-    parameterized_entropy: bool, initial_weighting_matrix: np.ndarray | None, XY: int
-) -> np.ndarray | None:
+    parameterized_entropy: bool,
+    initial_weighting_matrix: np.ndarray | WeightingMatrix | None,
+    XY: int,
+) -> np.ndarray | WeightingMatrix | None:
     """returns the initial weighting matrix for the MDE when the entropy is parameterized
 
     Args:
         parameterized_entropy: if `True`, the entropy has unknown parameters
-        initial_weighting_matrix: the initial weighting matrix, if provided
+        initial_weighting_matrix: the initial weighting matrix, if provided,
+            as a dense matrix or as a `WeightingMatrix`
         XY: = X*Y
 
     Returns:
@@ -48,7 +70,7 @@ def get_initial_weighting_matrix(
             print_stars(
                 "Using the identity matrix as weighting matrix in the first step."
             )
-            S_mat = np.eye(XY)
+            S_mat: np.ndarray | WeightingMatrix = IdentityWeighting(XY)
         else:
             S_mat = initial_weighting_matrix
         return S_mat
@@ -121,43 +143,79 @@ def make_hessian_mde(
     return cast(np.ndarray, hessians_both)
 
 
-def get_optimal_weighting_matrix(
+def get_variance_entropy_gradient(
     muhat: Matching,
     hessians_both: np.ndarray,
     no_singles: bool = False,
     D2_mat: np.ndarray | None = None,
+    var_munm: np.ndarray | None = None,
 ) -> np.ndarray:
-    """compute the $S^\ast$ matrix used in the second step of the MDE
+    """compute the variance of the estimated gradient of the entropy,
+    whose inverse is the $S^\\ast$ matrix used in the second step of the MDE
 
     Args:
         muhat: the observed `Matching`
         hessians_both: the Hessian of the entropy function
+        no_singles: if `True`, only couples are observed
+        D2_mat: the double differencing matrix, if `no_singles`
+        var_munm: the variance of $(\\mu, n, m)$, if it was already computed
+
+    Returns:
+        the variance of the gradient of the entropy
     """
-    var_muhat = variance_muhat(muhat)
-    var_munm = var_muhat.var_munm
+    if var_munm is None:
+        var_munm = cast(VarianceMatching, variance_muhat(muhat)).var_munm
     var_entropy_gradient = hessians_both @ var_munm @ hessians_both.T
     if no_singles:
         if D2_mat is None:
             bs_error_abort("D2_mat should not be None when no_singles is True")
         else:
             var_entropy_gradient = D2_mat @ var_entropy_gradient @ D2_mat.T
+    return cast(np.ndarray, var_entropy_gradient)
+
+
+def get_optimal_weighting_matrix(
+    muhat: Matching,
+    hessians_both: np.ndarray,
+    no_singles: bool = False,
+    D2_mat: np.ndarray | None = None,
+    var_munm: np.ndarray | None = None,
+) -> np.ndarray:
+    """compute the $S^\ast$ matrix used in the second step of the MDE
+
+    Args:
+        muhat: the observed `Matching`
+        hessians_both: the Hessian of the entropy function
+        no_singles: if `True`, only couples are observed
+        D2_mat: the double differencing matrix, if `no_singles`
+        var_munm: the variance of $(\\mu, n, m)$, if it was already computed
+
+    Returns:
+        the optimal weighting matrix
+    """
+    var_entropy_gradient = get_variance_entropy_gradient(
+        muhat, hessians_both, no_singles, D2_mat, var_munm
+    )
     S_mat = spla.inv(var_entropy_gradient)
     return cast(np.ndarray, S_mat)
 
 
 def compute_estimates(
-    M: np.ndarray, S_mat: np.ndarray, d: np.ndarray
+    M: np.ndarray, S_mat: np.ndarray | WeightingMatrix, d: np.ndarray
 ) -> tuple[np.ndarray, np.ndarray]:
     """Returns the QGLS estimates and their variance-covariance.
 
     Args:
         M: an (XY,p) matrix
-        S_mat: an (XY, XY) weighting matrix
+        S_mat: an (XY, XY) weighting matrix, dense or as a `WeightingMatrix`
         d: an XY-vector
 
     Returns:
         the p-vector of estimates and their estimated (p,p) variance
     """
+    if not isinstance(S_mat, np.ndarray):
+        # we solve the whitened least-squares problem by QR
+        return weighted_least_squares(M, S_mat, d)
     M_T = M.T
     M_S_d = M_T @ S_mat @ d
     M_S_M = M_T @ S_mat @ M
@@ -184,6 +242,7 @@ class MDEResults:
         test_pvalue: the p-value of the test
         ndf: the number of degrees of freedom
         parameterized_entropy: True if the derivative of the entropy has unknown parameters
+        number_iterations: the number of efficient-weighting steps
     """
 
     X: int
@@ -198,6 +257,7 @@ class MDEResults:
     test_pvalue: float
     ndf: int
     parameterized_entropy: bool | None = False
+    number_iterations: int = 1
 
     def __str__(self):
         line_stars = "*" * 80 + "\n"
@@ -210,6 +270,10 @@ class MDEResults:
         model_str = f"The data has {self.number_households} households\n\n"
         model_str += f"The model has {self.X}x{self.Y} margins\n {entropy_str} \n"
         model_str += f"We use {self.K} basis functions.\n\n"
+        if self.number_iterations > 1:
+            model_str += (
+                f"The iterated MDE took {self.number_iterations} weighting steps.\n\n"
+            )
         repr_str = line_stars + model_str
         repr_str += "The estimated coefficients (and their standard errors) are\n\n"
         if self.parameterized_entropy:
@@ -285,3 +349,151 @@ class MDEResults:
         if true_coeffs is not None:
             return cast(float, discrepancy)
         return None
+
+
+@dataclass
+class PooledMDEResults:
+    """
+    The results from the pooled minimum-distance estimation on several markets.
+
+    Args:
+        n_markets: the number of markets
+        K: the number of bases
+        number_households: the total number of households in the samples
+        estimated_beta: the estimated coefficients of the bases, common to all markets
+        varcov_beta: their estimated var-covar
+        stderrs_beta: their estimated stderrs
+        estimated_alphas: the estimated parameters of the entropy in each market,
+            if it is parameterized
+        estimated_Phis: the estimated joint surplus in each market
+        test_statistic: the value of the misspecification statistic
+        test_pvalue: the p-value of the test
+        ndf: the number of degrees of freedom
+    """
+
+    n_markets: int
+    K: int
+    number_households: int
+    estimated_beta: np.ndarray
+    varcov_beta: np.ndarray
+    stderrs_beta: np.ndarray
+    estimated_alphas: list[np.ndarray]
+    estimated_Phis: list[np.ndarray]
+    test_statistic: float
+    test_pvalue: float
+    ndf: int
+
+    def __str__(self):
+        line_stars = "*" * 80 + "\n"
+        repr_str = line_stars
+        repr_str += f"The data has {self.number_households} households"
+        repr_str += f" in {self.n_markets} markets.\n"
+        repr_str += f"We use {self.K} basis functions.\n\n"
+        repr_str += "The estimated coefficients (and their standard errors) are\n\n"
+        for i, coeff in enumerate(self.estimated_beta):
+            repr_str += (
+                f"   base {i + 1}: {coeff: > 10.3f} "
+                + f"({self.stderrs_beta[i]: .3f})\n"
+            )
+        repr_str += "\nSpecification test:\n"
+        repr_str += (
+            f"   the value of the test statistic is {self.test_statistic: > 10.3f}\n"
+        )
+        repr_str += (
+            f"     for a chi2({self.ndf}), the p-value is {self.test_pvalue: > 10.3f}\n"
+        )
+        return repr_str + line_stars
+
+
+@dataclass
+class MDESpecificationSearch:
+    """
+    The data-dependent parts of the MDE for a parameter-free entropy,
+    whitened by the optimal weighting matrix once and for all.
+    The estimates for any subset of the bases only require
+    solving K x K systems in the Gram matrix of the whitened bases.
+
+    Args:
+        X: the number of types of men
+        Y: the number of types of women
+        number_households: the number of households in the sample
+        no_singles: if `True`, only couples are observed
+        phi_mat: the reshaped (and double-differenced if `no_singles`) bases
+        gram: the Gram matrix $\\Phi' S \\Phi$ of the bases
+        cross: the vector $\\Phi' S e_0$
+        e0_norm2: the scalar $e_0' S e_0$
+    """
+
+    X: int
+    Y: int
+    number_households: int
+    no_singles: bool
+    phi_mat: np.ndarray
+    gram: np.ndarray
+    cross: np.ndarray
+    e0_norm2: float
+
+    @property
+    def K(self) -> int:
+        """the total number of bases"""
+        return int(self.gram.shape[0])
+
+    def evaluate(self, subset: list[int] | np.ndarray) -> MDEResults:
+        """the MDE results when we only use the bases in `subset`"""
+        return self.evaluate_batch([subset])[0]
+
+    def evaluate_batch(
+        self, subsets: Sequence[list[int] | np.ndarray]
+    ) -> list[MDEResults]:
+        """the MDE results for each of the `subsets` of the bases;
+        subsets of the same size are solved together
+
+        Args:
+            subsets: a list of lists of indices of bases
+
+        Returns:
+            a list of `MDEResults`, in the order of `subsets`
+        """
+        subsets_arr = [np.asarray(subset, dtype=int) for subset in subsets]
+        results: list[MDEResults | None] = [None] * len(subsets_arr)
+        by_size: dict[int, list[int]] = {}
+        for i_subset, subset in enumerate(subsets_arr):
+            if subset.size == 0 or np.unique(subset).size != subset.size:
+                bs_error_abort("Each subset should be nonempty, with distinct bases.")
+            if np.min(subset) < 0 or np.max(subset) >= self.K:
+                bs_error_abort(f"The bases should be in [0, {self.K - 1}].")
+            by_size.setdefault(subset.size, []).append(i_subset)
+
+        n_rows = self.phi_mat.shape[0]
+        for n_pars, indices in by_size.items():
+            idx = np.stack([subsets_arr[i] for i in indices])
+            gram_sub = self.gram[idx[:, :, None], idx[:, None, :]]
+            cross_sub = self.cross[idx]
+            varcov_sub = np.linalg.inv(gram_sub)
+            coeffs_sub = -np.einsum("sij,sj->si", varcov_sub, cross_sub)
+            # the minimized objective is e0'Se0 - cross' gram^{-1} cross
+            test_stats = self.e0_norm2 + np.einsum("si,si->s", cross_sub, coeffs_sub)
+            ndf = n_rows - n_pars
+            pvalues = chi2_pvalue(test_stats, ndf)
+            for j, i_subset in enumerate(indices):
+                est_Phi = self.phi_mat[:, idx[j]] @ coeffs_sub[j]
+                est_Phi = (
+                    est_Phi.reshape((self.X - 1, self.Y - 1))
+                    if self.no_singles
+                    else est_Phi.reshape((self.X, self.Y))
+                )
+                results[i_subset] = MDEResults(
+                    X=self.X,
+                    Y=self.Y,
+                    K=n_pars,
+                    number_households=self.number_households,
+                    estimated_coefficients=coeffs_sub[j],
+                    varcov_coefficients=varcov_sub[j],
+                    stderrs_coefficients=np.sqrt(np.diag(varcov_sub[j])),
+                    estimated_Phi=est_Phi,
+                    test_statistic=float(test_stats[j]),
+                    test_pvalue=float(pvalues[j]),
+                    ndf=ndf,
+                    parameterized_entropy=False,
+                )
+        return cast(list[MDEResults], results)
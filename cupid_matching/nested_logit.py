@@ -13,7 +13,11 @@ import numpy as np
 from bs_python_utils.bsnputils import ThreeArrays, TwoArrays
 from bs_python_utils.bsutils import bs_error_abort
 
-from cupid_matching.entropy import EntropyFunctions, EntropyHessians
+from cupid_matching.entropy import (
+    EntropyFunctions,
+    EntropyHessians,
+    EntropyHessiansAlpha,
+)
 from cupid_matching.matching_utils import Matching
 from cupid_matching.utils import NestsList, change_indices
 
@@ -282,6 +286,81 @@ e_derivative_nested_logit = (
 )
 
 
+def e_derivative_mu_nested_logit_alpha(
+    muhat: Matching, alpha: np.ndarray, additional_parameters: list | None = None
+) -> ThreeArrays:
+    """Returns the derivatives of $e \\cdot \\alpha$
+     wrt $\\mu$ for the nested logit.
+
+    Args:
+        muhat: a Matching
+        alpha: the parameters $(\\rho, \\delta)$ of the nests
+        additional_parameters: a list with the nest structure
+
+    Returns:
+        the parameter-dependent part of the hessian of the entropy
+        wrt $(\\mu,\\mu)$, contracted with `alpha`.
+    """
+    nests_for_each_x, nests_for_each_y = _get_params(additional_parameters)
+    nests_x = change_indices(nests_for_each_x)
+    nests_y = change_indices(nests_for_each_y)
+    n_rhos = len(nests_for_each_x)
+    rhos, deltas = alpha[:n_rhos], alpha[n_rhos:]
+
+    muxy, *_ = muhat.unpack()
+    X, Y = muxy.shape
+
+    hess_x = np.zeros((X, Y, Y))
+    hess_y = np.zeros((X, Y, X))
+    hess_xy = np.zeros((X, Y))
+    der_logxy = 1.0 / muxy
+    all_x, all_y = np.arange(X), np.arange(Y)
+
+    for rho, nest_list in zip(rhos, nests_x, strict=True):
+        nest = np.asarray(nest_list, dtype=np.intp)
+        rho_der_logxn = rho / np.sum(muxy[:, nest], 1)
+        hess_x[np.ix_(all_x, nest, nest)] += rho_der_logxn.reshape((-1, 1, 1))
+        hess_xy[:, nest] += rho_der_logxn.reshape((-1, 1)) - rho * der_logxy[:, nest]
+
+    for delta, nest_list in zip(deltas, nests_y, strict=True):
+        nest = np.asarray(nest_list, dtype=np.intp)
+        delta_der_logny = delta / np.sum(muxy[nest, :], 0)
+        hess_y[np.ix_(nest, all_y, nest)] += delta_der_logny.reshape((1, -1, 1))
+        hess_xy[nest, :] += delta_der_logny - delta * der_logxy[nest, :]
+
+    return hess_x, hess_y, hess_xy
+
+
+def e_derivative_r_nested_logit_alpha(
+    muhat: Matching, alpha: np.ndarray, additional_parameters: list | None = None
+) -> TwoArrays:
+    """Returns the derivatives of $e \\cdot \\alpha$
+     wrt $r$ for the nested logit.
+
+    Args:
+        muhat: a Matching
+        alpha: the parameters $(\\rho, \\delta)$ of the nests
+        additional_parameters: a list with the nest structure
+
+    Returns:
+        the parameter-dependent part of the hessian of the entropy
+        wrt $(\\mu,r)$, contracted with `alpha`.
+    """
+    muxy, *_ = muhat.unpack()
+    X, Y = muxy.shape
+
+    hess_n = np.zeros((X, Y))
+    hess_m = np.zeros((X, Y))
+
+    return hess_n, hess_m
+
+
+e_derivative_alpha_nested_logit = (
+    e_derivative_mu_nested_logit_alpha,
+    e_derivative_r_nested_logit_alpha,
+)
+
+
 def setup_standard_nested_logit(
     nests_for_each_x: NestsList, nests_for_each_y: NestsList
 ) -> tuple[EntropyFunctions, EntropyFunctions]:
@@ -303,6 +382,7 @@ def setup_standard_nested_logit(
         hessian="provided",
         e0_derivative=cast(EntropyHessians, e0_derivative_nested_logit),
         e_derivative=cast(EntropyHessians, e_derivative_nested_logit),
+        e_derivative_alpha=cast(EntropyHessiansAlpha, e_derivative_alpha_nested_logit),
         description="Two-layer nested logit with analytic Hessian\n" + nest_description,
     )
 
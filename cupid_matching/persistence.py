@@ -0,0 +1,241 @@
+"""Saves and loads matchings, variances and estimation results in a binary format.
+
+An object is saved in a directory that contains a `metadata.json` file
+(the format version, the version of `cupid_matching`, the class of the object
+and its scalar fields) and one `.npy` file per array.
+The arrays are loaded as read-only memory maps by default, so that large arrays
+such as `var_allmus`, `varcov_gamma` or IPFP Jacobians are only read when used,
+and can be shared by several processes without copies.
+(We do not use `.npz` archives, as their members cannot be memory-mapped.)
+
+Example:
+    ```py
+    save_results(mde_results, "results/mde")
+    mde_results = load_results("results/mde")
+    save_arrays("results/jacobians", {"dmus_xy": dmus_xy})
+    arrays, _ = load_arrays("results/jacobians")
+    ```
+"""
+
+import json
+from dataclasses import fields
+from importlib import import_module
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Any, Literal, cast
+
+import numpy as np
+import scipy.sparse as sp
+from bs_python_utils.bsutils import bs_error_abort
+
+from cupid_matching.matching_utils import Matching
+
+FORMAT_VERSION = 1
+"""the version of the format written by `save_arrays` and `save_results`"""
+
+_METADATA_FILE = "metadata.json"
+
+# the classes that `save_results` handles, and the modules that define them
+_RESULTS_CLASSES: dict[str, str] = {
+    "Matching": "matching_utils",
+    "VarianceMatching": "matching_utils",
+    "MDEResults": "min_distance_utils",
+    "PooledMDEResults": "min_distance_utils",
+    "PoissonGLMResults": "poisson_glm_utils",
+    "PoissonGLMMultiMarketResults": "poisson_glm_utils",
+}
+
+
+def _package_version() -> str | None:
+    try:
+        return version("cupid_matching")
+    except PackageNotFoundError:
+        return None
+
+
+def _to_json(value: Any) -> Any:
+    """converts numpy scalars to Python scalars for `json`"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def save_arrays(
+    path: str | Path,
+    arrays: dict[str, np.ndarray],
+    metadata: dict[str, Any] | None = None,
+) -> None:
+    """saves arrays, e.g. IPFP Jacobians, and JSON-serializable metadata
+
+    Args:
+        path: the directory to write to; it is created if needed
+        arrays: the arrays, by name
+        metadata: additional metadata, e.g. the scalar fields of an object
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path / f"{name}.npy", np.asarray(array), allow_pickle=False)
+    write_metadata(path, list(arrays), metadata)
+
+
+def create_array(
+    path: str | Path, name: str, shape: tuple[int, ...], dtype: Any = np.float64
+) -> np.memmap:
+    """creates a memory-mapped array to be filled in place, e.g. block by block;
+    call `write_metadata` when all the arrays in `path` are complete
+
+    Args:
+        path: the directory to write to; it is created if needed
+        name: the name of the array
+        shape: its shape
+        dtype: its type
+
+    Returns:
+        the writable memory map, initialized to zeros
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(
+        path / f"{name}.npy", mode="w+", dtype=dtype, shape=shape
+    )
+
+
+def write_metadata(
+    path: str | Path, array_names: list[str], metadata: dict[str, Any] | None = None
+) -> None:
+    """writes the metadata of the arrays saved in `path`
+
+    Args:
+        path: the directory the arrays were saved to
+        array_names: the names of the arrays
+        metadata: additional metadata
+    """
+    full_metadata = {
+        "format_version": FORMAT_VERSION,
+        "cupid_matching_version": _package_version(),
+        "arrays": sorted(array_names),
+    }
+    if metadata is not None:
+        full_metadata |= {key: _to_json(value) for key, value in metadata.items()}
+    with open(Path(path) / _METADATA_FILE, "w") as f:
+        json.dump(full_metadata, f, indent=2)
+
+
+def load_arrays(
+    path: str | Path, mmap: bool = True
+) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+    """loads arrays saved by `save_arrays`
+
+    Args:
+        path: the directory they were saved to
+        mmap: if `True`, the arrays are read-only memory maps
+
+    Returns:
+        the arrays, by name, and the metadata
+    """
+    path = Path(path)
+    metadata_path = path / _METADATA_FILE
+    if not metadata_path.exists():
+        bs_error_abort(f"{path} does not contain a {_METADATA_FILE} file.")
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    format_version = metadata.get("format_version")
+    if not isinstance(format_version, int) or format_version > FORMAT_VERSION:
+        bs_error_abort(
+            f"{path} has format version {format_version}; we can only read"
+            f" versions up to {FORMAT_VERSION}."
+        )
+    mmap_mode: Literal["r"] | None = "r" if mmap else None
+    arrays = {
+        name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode, allow_pickle=False)
+        for name in metadata["arrays"]
+    }
+    return arrays, metadata
+
+
+def save_results(results: Any, path: str | Path) -> None:
+    """saves a `Matching`, a `VarianceMatching`, or the results of an estimator
+
+    Args:
+        results: a `Matching`, `VarianceMatching`, `MDEResults`, `PooledMDEResults`,
+            `PoissonGLMResults` or `PoissonGLMMultiMarketResults`
+        path: the directory to write to; it is created if needed
+    """
+    class_name = type(results).__name__
+    if class_name not in _RESULTS_CLASSES:
+        bs_error_abort(f"We cannot save a {class_name}.")
+    arrays: dict[str, np.ndarray] = {}
+    scalars: dict[str, Any] = {}
+    list_lengths: dict[str, int] = {}
+    if isinstance(results, Matching):
+        # the other fields are recomputed from these
+        muxy = results.muxy
+        if sp.issparse(muxy):
+            muxy_csr = cast(sp.csr_array, muxy)
+            arrays |= {
+                "muxy_data": muxy_csr.data,
+                "muxy_indices": muxy_csr.indices,
+                "muxy_indptr": muxy_csr.indptr,
+            }
+            scalars["muxy_shape"] = list(muxy_csr.shape)
+        else:
+            arrays["muxy"] = muxy
+        arrays |= {"n": results.n, "m": results.m}
+        scalars["no_singles"] = results.no_singles
+    else:
+        for result_field in fields(results):
+            value = getattr(results, result_field.name)
+            if isinstance(value, np.ndarray):
+                arrays[result_field.name] = value
+            elif isinstance(value, list):
+                # a list of arrays, one per market
+                list_lengths[result_field.name] = len(value)
+                for i, array in enumerate(value):
+                    arrays[f"{result_field.name}_{i}"] = array
+            else:
+                scalars[result_field.name] = _to_json(value)
+    save_arrays(
+        path,
+        arrays,
+        {"class": class_name, "scalars": scalars, "lists": list_lengths},
+    )
+
+
+def load_results(path: str | Path, mmap: bool = True) -> Any:
+    """loads an object saved by `save_results`, without recomputing anything
+
+    Args:
+        path: the directory it was saved to
+        mmap: if `True`, its arrays are read-only memory maps
+
+    Returns:
+        the object
+    """
+    arrays, metadata = load_arrays(path, mmap=mmap)
+    class_name = metadata.get("class")
+    if not isinstance(class_name, str) or class_name not in _RESULTS_CLASSES:
+        bs_error_abort(f"{path} does not contain results that we can load.")
+    class_name = cast(str, class_name)
+    scalars = metadata.get("scalars", {})
+    if class_name == "Matching":
+        if "muxy_shape" in scalars:
+            muxy = sp.csr_array(
+                (arrays["muxy_data"], arrays["muxy_indices"], arrays["muxy_indptr"]),
+                shape=tuple(scalars["muxy_shape"]),
+            )
+        else:
+            muxy = arrays["muxy"]
+        return Matching(
+            muxy, arrays["n"], arrays["m"], no_singles=scalars["no_singles"]
+        )
+    # the lists of arrays, one per market, are rebuilt from their items
+    field_values: dict[str, Any] = dict(arrays)
+    for name, length in metadata.get("lists", {}).items():
+        field_values[name] = [field_values.pop(f"{name}_{i}") for i in range(length)]
+    results_class = getattr(
+        import_module(f"cupid_matching.{_RESULTS_CLASSES[class_name]}"), class_name
+    )
+    # we set the fields directly, as __post_init__ would recompute the derived ones
+    results = object.__new__(results_class)
+    for name, value in (field_values | scalars).items():
+        object.__setattr__(results, name, value)
+    return results
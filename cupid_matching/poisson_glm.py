@@ -2,15 +2,25 @@
 using Poisson GLM.
 """
 
+from dataclasses import dataclass, field
 from math import sqrt
+from typing import TYPE_CHECKING, cast
 
 import numpy as np
 import scipy.linalg as spla
-from sklearn import linear_model
+from bs_python_utils.bsutils import bs_error_abort, print_stars
 
-from cupid_matching.matching_utils import Matching, VarianceMatching, variance_muhat
-from cupid_matching.poisson_glm_utils import PoissonGLMResults, prepare_data
-from cupid_matching.utils import make_XY_K_mat
+from cupid_matching.ipfp_solvers import ipfp_homoskedastic_solver
+from cupid_matching.matching_utils import Matching, VarianceMatching
+from cupid_matching.poisson_glm_utils import (
+    PoissonGLMMultiMarketResults,
+    PoissonGLMResults,
+)
+from cupid_matching.prepared_market import PreparedMarket, as_prepared_market
+
+if TYPE_CHECKING:
+    # sklearn is slow to import, so we only load it when we fit a model
+    from sklearn import linear_model
 
 
 def _stderrs_u(
@@ -156,24 +166,28 @@ def _stderrs_v_no_singles(
 
 
 def choo_siow_poisson_glm(
-    muhat: Matching,
-    phi_bases: np.ndarray,
+    muhat: Matching | PreparedMarket,
+    phi_bases: np.ndarray | None = None,
     no_singles: bool = False,
     tol: float | None = 1e-12,
     max_iter: int | None = 10000,
     verbose: int | None = 1,
+    initial_gamma: np.ndarray | None = None,
 ) -> PoissonGLMResults:
     """Estimates the semilinear Choo and Siow homoskedastic (2006) model
         using Poisson GLM.
 
     Args:
-        muhat: the observed Matching
-        phi_bases: an (X, Y, K) array of bases
+        muhat: the observed Matching, or a `PreparedMarket`
+            that caches the data shared with the minimum distance estimator
+        phi_bases: an (X, Y, K) array of bases; `None` if `muhat` is a `PreparedMarket`
         no_singles: if True, we do not observe the singles
         tol: tolerance level for `linear_model.PoissonRegressor.fit`
         max_iter: maximum number of iterations
             for `linear_model.PoissonRegressor.fit`
         verbose: defines how much output we want (0 = least)
+        initial_gamma: if given, the starting point of the regression,
+            e.g. the `estimated_gamma` of a fit on a similar sample
 
     Returns:
         a `PoissonGLMResults` instance
@@ -217,78 +231,47 @@ def choo_siow_poisson_glm(
         ```
 
     """
+    estimator = PoissonGLMEstimator(
+        no_singles=no_singles, tol=tol, max_iter=max_iter, verbose=verbose
+    )
+    return estimator.fit(muhat, phi_bases, initial_gamma=initial_gamma)
+
+
+def _poisson_glm_results(
+    prepared: PreparedMarket, no_singles: bool, clf: "linear_model.PoissonRegressor"
+) -> PoissonGLMResults:
+    """fits the regressor `clf` on the prepared market and computes the estimates
+    and their standard errors; `clf` starts from its `coef_` if it has `warm_start`
+    """
+    muhat, phi_bases = prepared.muhat, prepared.phi_bases
     X, Y, K = phi_bases.shape
     XY = X * Y
 
-    # the vector of weights for the Poisson regression
-    w = (
-        2 * np.ones(XY)
-        if no_singles
-        else np.concatenate((2 * np.ones(XY), np.ones(X + Y)))
-    )
-    # reshape the bases
-    phi_mat = make_XY_K_mat(phi_bases)
-
-    id_X = np.eye(X)
-    id_Y = np.eye(Y)
-    ones_X = np.ones((X, 1))
-    ones_Y = np.ones((Y, 1))
-    if no_singles:
-        Z_unweighted = np.hstack(
-            [-np.kron(id_X, ones_Y), -np.kron(ones_X, id_Y), phi_mat]
-        )
-        # we need to normalize u_1 = 0, so we delete the first column
-        Z_unweighted = Z_unweighted[:, 1:]
-    else:
-        zeros_XK = np.zeros((X, K))
-        zeros_YK = np.zeros((Y, K))
-        zeros_XY = np.zeros((X, Y))
-        zeros_YX = np.zeros((Y, X))
-        Z_unweighted = np.vstack(
-            [
-                np.hstack([-np.kron(id_X, ones_Y), -np.kron(ones_X, id_Y), phi_mat]),
-                np.hstack([-id_X, zeros_XY, zeros_XK]),
-                np.hstack([zeros_YX, -id_Y, zeros_YK]),
-            ]
-        )
+    Z_unweighted, w = prepared.glm_design(no_singles)
     Z = Z_unweighted / w.reshape((-1, 1))
 
-    var_muhat = variance_muhat(muhat)
     (
         muhat_norm,
         var_muhat_norm,
         n_households,
         n_individuals,
-    ) = prepare_data(muhat, var_muhat, no_singles=no_singles)
-
-    clf = linear_model.PoissonRegressor(
-        fit_intercept=False,
-        tol=tol,
-        verbose=verbose,
-        alpha=0,
-        max_iter=max_iter,
-    )
+    ) = prepared.glm_data(no_singles)
+
     if no_singles:
         muxyhat_norm = muhat_norm[:XY]
         clf.fit(Z, muxyhat_norm, sample_weight=w)
     else:
         clf.fit(Z, muhat_norm, sample_weight=w)
-    gamma_est = clf.coef_
+    gamma_est = clf.coef_.copy()
 
     # we compute_ the variance-covariance of the estimator
     var_allmus_norm = var_muhat_norm.var_allmus
     var_norm = var_allmus_norm[:XY, :XY] if no_singles else var_allmus_norm
-    nr, nc = Z.shape
+    nr = Z.shape[0]
     exp_Zg = np.exp(Z @ gamma_est).reshape(nr)
-    A_hat = np.zeros((nc, nc))
-    B_hat = np.zeros((nc, nc))
-    for i in range(nr):
-        Zi = Z[i, :]
-        wi = w[i]
-        A_hat += wi * exp_Zg[i] * np.outer(Zi, Zi)
-        for j in range(nr):
-            Zj = Z[j, :]
-            B_hat += wi * w[j] * var_norm[i, j] * np.outer(Zi, Zj)
+    A_hat = Z.T @ ((w * exp_Zg).reshape((-1, 1)) * Z)
+    w_Z = w.reshape((-1, 1)) * Z
+    B_hat = w_Z.T @ var_norm @ w_Z
 
     A_inv = spla.inv(A_hat)
     varcov_gamma = A_inv @ B_hat @ A_inv
@@ -344,6 +327,329 @@ def choo_siow_poisson_glm(
         stderrs_beta=beta_std,
         stderrs_u=u_std,
         stderrs_v=v_std,
+        n_iterations=int(clf.n_iter_),
     )
 
     return results
+
+
+@dataclass
+class PoissonGLMEstimator:
+    """A Poisson GLM estimator that keeps its regressor between fits:
+    each fit starts from the coefficients of the previous one,
+    so that fits on bootstrap replicates or on nearby specifications
+    converge in fewer iterations.
+
+    Args:
+        no_singles: if True, we do not observe the singles
+        tol: tolerance level for `linear_model.PoissonRegressor.fit`
+        max_iter: maximum number of iterations
+            for `linear_model.PoissonRegressor.fit`
+        verbose: defines how much output we want (0 = least)
+
+    Example:
+        ```py
+        estimator = PoissonGLMEstimator(verbose=0)
+        results = [estimator.fit(mus_boot, phi_bases) for mus_boot in bootstrap_samples]
+        ```
+    """
+
+    no_singles: bool = False
+    tol: float | None = 1e-12
+    max_iter: int | None = 10000
+    verbose: int | None = 0
+    regressor: "linear_model.PoissonRegressor" = field(init=False, repr=False)
+
+    def __post_init__(self):
+        from sklearn import linear_model
+
+        self.regressor = linear_model.PoissonRegressor(
+            fit_intercept=False,
+            tol=self.tol,
+            verbose=self.verbose,
+            alpha=0,
+            max_iter=self.max_iter,
+            warm_start=True,
+        )
+
+    @property
+    def gamma(self) -> np.ndarray | None:
+        """the coefficients of the last fit, if any"""
+        return cast(np.ndarray | None, getattr(self.regressor, "coef_", None))
+
+    def fit(
+        self,
+        muhat: Matching | PreparedMarket,
+        phi_bases: np.ndarray | None = None,
+        initial_gamma: np.ndarray | None = None,
+    ) -> PoissonGLMResults:
+        """estimates the model on a market, starting from `initial_gamma` if given,
+        from the previous estimates if they have the right size, and from zero otherwise
+
+        Args:
+            muhat: the observed Matching, or a `PreparedMarket`
+            phi_bases: an (X, Y, K) array of bases;
+                `None` if `muhat` is a `PreparedMarket`
+            initial_gamma: if given, the starting point of the regression
+
+        Returns:
+            a `PoissonGLMResults` instance
+        """
+        prepared = as_prepared_market(muhat, phi_bases)
+        X, Y, K = prepared.phi_bases.shape
+        n_gamma = (X - 1 if self.no_singles else X) + Y + K
+        if initial_gamma is not None:
+            if initial_gamma.shape != (n_gamma,):
+                bs_error_abort(
+                    f"initial_gamma should have shape ({n_gamma},),"
+                    f" not {initial_gamma.shape}"
+                )
+            self.regressor.coef_ = initial_gamma.astype(float)
+        elif self.gamma is not None and self.gamma.shape != (n_gamma,):
+            del self.regressor.coef_
+        return _poisson_glm_results(prepared, self.no_singles, self.regressor)
+
+
+@dataclass
+class _GLMMarketFit:
+    """the fit of one market at given `beta`,
+    with the fixed effects concentrated out"""
+
+    muxy: np.ndarray
+    mux0: np.ndarray
+    mu0y: np.ndarray
+    loglik: float
+    gradient: np.ndarray
+    schur: np.ndarray
+    proj_u: np.ndarray
+    proj_v: np.ndarray
+
+
+def _xlogy(x: np.ndarray, y: np.ndarray) -> float:
+    """returns $\\sum x \\log y$, with $0 \\log 0 = 0$"""
+    return float(np.sum(np.where(x > 0.0, x * np.log(np.where(x > 0.0, y, 1.0)), 0.0)))
+
+
+def _fit_market_glm(
+    phi_bases: np.ndarray,
+    muhat_norm: tuple[np.ndarray, np.ndarray, np.ndarray],
+    beta: np.ndarray,
+    tol_ipfp: float,
+) -> _GLMMarketFit:
+    """solves for the fixed effects of one market given `beta` by IPFP,
+    and returns the concentrated log-likelihood, its gradient and its hessian
+
+    Args:
+        phi_bases: the (X, Y, K) bases of the market
+        muhat_norm: the normalized observed `(muxy, mux0, mu0y)`
+        beta: the current basis coefficients
+        tol_ipfp: the tolerance of the IPFP solver
+
+    Returns:
+        a `_GLMMarketFit`
+    """
+    muxy_hat, mux0_hat, mu0y_hat = muhat_norm
+    n_norm = np.sum(muxy_hat, 1) + mux0_hat
+    m_norm = np.sum(muxy_hat, 0) + mu0y_hat
+    # the first-order conditions in the fixed effects are the IPFP margin equations
+    mus, *_ = ipfp_homoskedastic_solver(
+        phi_bases @ beta, n_norm, m_norm, tol=tol_ipfp, method="newton"
+    )
+    muxy, mux0, mu0y, *_ = mus.unpack()
+    loglik = (
+        2.0 * (_xlogy(muxy_hat, muxy) - np.sum(muxy))
+        + _xlogy(mux0_hat, mux0)
+        - np.sum(mux0)
+        + _xlogy(mu0y_hat, mu0y)
+        - np.sum(mu0y)
+    )
+    gradient = np.einsum("xyk,xy->k", phi_bases, muxy_hat - muxy)
+
+    # the blocks of the hessian of minus the log-likelihood
+    #  in beta and in the fixed effects f = (a, b)
+    half_muxy = muxy / 2.0
+    X = muxy.shape[0]
+    A_bb = np.einsum("xyk,xyl,xy->kl", phi_bases, phi_bases, half_muxy)
+    A_bf = -np.concatenate(
+        (
+            np.einsum("xyk,xy->kx", phi_bases, half_muxy),
+            np.einsum("xyk,xy->ky", phi_bases, half_muxy),
+        ),
+        axis=1,
+    )
+    A_ff = np.block(
+        [
+            [np.diag(np.sum(half_muxy, 1) + mux0), half_muxy],
+            [half_muxy.T, np.diag(np.sum(half_muxy, 0) + mu0y)],
+        ]
+    )
+    proj = spla.solve(A_ff, A_bf.T, assume_a="pos").T
+    schur = A_bb - proj @ A_bf.T
+    return _GLMMarketFit(
+        muxy=muxy,
+        mux0=mux0,
+        mu0y=mu0y,
+        loglik=loglik,
+        gradient=gradient,
+        schur=schur,
+        proj_u=proj[:, :X],
+        proj_v=proj[:, X:],
+    )
+
+
+def _variance_score_glm(
+    phi_bases: np.ndarray,
+    muhat_norm: tuple[np.ndarray, np.ndarray, np.ndarray],
+    fit: _GLMMarketFit,
+    n_individuals: float,
+    n_households: float,
+) -> np.ndarray:
+    """the variance of the score in `beta` of one market,
+    with the fixed effects partialled out; we use the multinomial structure
+    of the variance of the observed matching patterns,
+    so that we never form an (XY, XY) matrix
+    """
+    muxy_hat, mux0_hat, mu0y_hat = muhat_norm
+    c_xy = (
+        phi_bases
+        + fit.proj_u.T.reshape((-1, 1, phi_bases.shape[2]))
+        + fit.proj_v.T.reshape((1, -1, phi_bases.shape[2]))
+    )
+    c_x0, c_0y = fit.proj_u.T, fit.proj_v.T
+    second_moment = (
+        np.einsum("xyk,xyl,xy->kl", c_xy, c_xy, muxy_hat)
+        + np.einsum("xk,xl,x->kl", c_x0, c_x0, mux0_hat)
+        + np.einsum("yk,yl,y->kl", c_0y, c_0y, mu0y_hat)
+    )
+    first_moment = (
+        np.einsum("xyk,xy->k", c_xy, muxy_hat) + c_x0.T @ mux0_hat + c_0y.T @ mu0y_hat
+    )
+    return cast(
+        np.ndarray,
+        second_moment / n_individuals
+        - np.outer(first_moment, first_moment) / n_households,
+    )
+
+
+def choo_siow_poisson_glm_multimarket(
+    markets: list[tuple[Matching, np.ndarray]],
+    tol: float = 1e-10,
+    maxiter: int = 100,
+    tol_ipfp: float = 1e-12,
+    verbose: bool = False,
+) -> PoissonGLMMultiMarketResults:
+    """Estimates the semilinear Choo and Siow homoskedastic (2006) model
+        by Poisson GLM on several markets, with common basis coefficients `beta`
+        and market-specific fixed effects `u` and `v`.
+
+    Given `beta`, the first-order conditions in the fixed effects of a market
+    are the margin equations of the Choo and Siow model, so we concentrate them out
+    with the IPFP solver; then we take Newton steps on `beta`
+    with the Schur complements of the per-market hessians.
+    Memory use is linear in the total number of cells.
+
+    Args:
+        markets: a list of pairs (`muhat`, `phi_bases`) with the observed `Matching`
+            and the (X, Y, K) array of bases in each market;
+            X and Y may differ across markets, K may not
+        tol: the tolerance on the Newton steps on `beta`
+        maxiter: the maximum number of Newton steps
+        tol_ipfp: the tolerance of the IPFP solver
+        verbose: prints stuff if `True`
+
+    Returns:
+        a `PoissonGLMMultiMarketResults` instance
+    """
+    n_markets = len(markets)
+    if n_markets == 0:
+        bs_error_abort("We need at least one market.")
+    K = markets[0][1].shape[-1]
+    for muhat, phi_bases in markets:
+        if muhat.no_singles:
+            bs_error_abort("We only handle markets with singles.")
+        if phi_bases.shape != (*muhat.muxy.shape, K):
+            bs_error_abort(
+                f"phi_bases should have shape {(*muhat.muxy.shape, K)},"
+                f" not {phi_bases.shape}."
+            )
+
+    # we normalize all markets by the total number of individuals
+    n_households_markets = [muhat.n_households for muhat, _ in markets]
+    n_households = sum(n_households_markets)
+    n_individuals = sum(
+        float(np.sum(muhat.n) + np.sum(muhat.m)) for muhat, _ in markets
+    )
+    muhats_norm = []
+    for muhat, _ in markets:
+        muxy, mux0, mu0y, *_ = muhat.unpack()
+        muhats_norm.append(
+            (muxy / n_individuals, mux0 / n_individuals, mu0y / n_individuals)
+        )
+
+    def fit_all(beta: np.ndarray) -> list[_GLMMarketFit]:
+        return [
+            _fit_market_glm(phi_bases, muhat_norm, beta, tol_ipfp)
+            for (_, phi_bases), muhat_norm in zip(markets, muhats_norm, strict=True)
+        ]
+
+    beta = np.zeros(K)
+    fits = fit_all(beta)
+    loglik = sum(fit.loglik for fit in fits)
+    n_iterations = 0
+    while n_iterations < maxiter:
+        hessian = sum(fit.schur for fit in fits)
+        gradient = sum(fit.gradient for fit in fits)
+        step = spla.solve(hessian, gradient, assume_a="pos")
+        # the concentrated log-likelihood is concave; we halve the step if needed
+        step_size = 1.0
+        while True:
+            new_fits = fit_all(beta + step_size * step)
+            new_loglik = sum(fit.loglik for fit in new_fits)
+            if new_loglik >= loglik - 1e-12 * abs(loglik) or step_size < 1e-8:
+                break
+            step_size /= 2.0
+        beta += step_size * step
+        fits, loglik = new_fits, new_loglik
+        n_iterations += 1
+        max_step = np.max(np.abs(step_size * step))
+        if verbose:
+            print(
+                f"Newton step {n_iterations}: log-likelihood {loglik: .8f},"
+                f" largest change in beta {max_step: .2e}"
+            )
+        if max_step < tol:
+            break
+    else:
+        print_stars(
+            f"The multi-market Poisson GLM did not converge in {maxiter} iterations."
+        )
+
+    # the sandwich variance of beta
+    hessian = sum(fit.schur for fit in fits)
+    var_score = sum(
+        _variance_score_glm(phi_bases, muhat_norm, fit, n_individuals, n_h)
+        for (_, phi_bases), muhat_norm, fit, n_h in zip(
+            markets, muhats_norm, fits, n_households_markets, strict=True
+        )
+    )
+    hessian_inv = spla.inv(hessian)
+    varcov_beta = hessian_inv @ var_score @ hessian_inv
+
+    estimated_us, estimated_vs = [], []
+    for (muhat, _), fit in zip(markets, fits, strict=True):
+        estimated_us.append(-np.log(fit.mux0 * n_individuals / muhat.n))
+        estimated_vs.append(-np.log(fit.mu0y * n_individuals / muhat.m))
+
+    return PoissonGLMMultiMarketResults(
+        n_markets=n_markets,
+        K=K,
+        number_households=cast(int, n_households),
+        number_individuals=cast(int, n_individuals),
+        estimated_beta=beta,
+        varcov_beta=varcov_beta,
+        stderrs_beta=np.sqrt(np.diag(varcov_beta)),
+        estimated_us=estimated_us,
+        estimated_vs=estimated_vs,
+        estimated_Phis=[phi_bases @ beta for _, phi_bases in markets],
+        n_iterations=n_iterations,
+    )
@@ -8,6 +8,7 @@ from bs_python_utils.bsnputils import npmaxabs
 from bs_python_utils.bsutils import bs_error_abort, print_stars
 
 from cupid_matching.matching_utils import Matching, VarianceMatching, var_divide
+from cupid_matching.utils import make_XY_K_mat
 
 
 @dataclass
@@ -31,6 +32,7 @@ class PoissonGLMResults:
         stderrs_u: np.ndarray
         stderrs_v: np.ndarray
         estimated_Phi: np.ndarray
+        n_iterations: the number of iterations of the Poisson regression
     """
 
     X: int
@@ -49,6 +51,7 @@ class PoissonGLMResults:
     stderrs_u: np.ndarray
     stderrs_v: np.ndarray
     estimated_Phi: np.ndarray
+    n_iterations: int = 0
 
     def __str__(self):
         line_stars = "*" * 80 + "\n"
@@ -138,6 +141,59 @@ class PoissonGLMResults:
             print_stars(repr_str)
 
 
+def make_glm_design(
+    phi_bases: np.ndarray,
+    no_singles: bool = False,
+    phi_mat: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Builds the design matrix of the Poisson GLM, before weighting, and the weights.
+
+    Args:
+        phi_bases: an (X, Y, K) array of bases
+        no_singles: if True, we do not observe singles
+        phi_mat: the bases reshaped into an (XY, K) matrix, if already available
+
+    Returns:
+        the unweighted design matrix `Z_unweighted` and the vector of weights `w`
+    """
+    X, Y, K = phi_bases.shape
+    XY = X * Y
+
+    # the vector of weights for the Poisson regression
+    w = (
+        2 * np.ones(XY)
+        if no_singles
+        else np.concatenate((2 * np.ones(XY), np.ones(X + Y)))
+    )
+    # reshape the bases
+    if phi_mat is None:
+        phi_mat = make_XY_K_mat(phi_bases)
+
+    id_X = np.eye(X)
+    id_Y = np.eye(Y)
+    ones_X = np.ones((X, 1))
+    ones_Y = np.ones((Y, 1))
+    if no_singles:
+        Z_unweighted = np.hstack(
+            [-np.kron(id_X, ones_Y), -np.kron(ones_X, id_Y), phi_mat]
+        )
+        # we need to normalize u_1 = 0, so we delete the first column
+        Z_unweighted = Z_unweighted[:, 1:]
+    else:
+        zeros_XK = np.zeros((X, K))
+        zeros_YK = np.zeros((Y, K))
+        zeros_XY = np.zeros((X, Y))
+        zeros_YX = np.zeros((Y, X))
+        Z_unweighted = np.vstack(
+            [
+                np.hstack([-np.kron(id_X, ones_Y), -np.kron(ones_X, id_Y), phi_mat]),
+                np.hstack([-id_X, zeros_XY, zeros_XK]),
+                np.hstack([zeros_YX, -id_Y, zeros_YK]),
+            ]
+        )
+    return Z_unweighted, w
+
+
 def prepare_data(
     muhat: Matching,
     var_muhat: VarianceMatching,
@@ -158,7 +214,7 @@ def prepare_data(
         the number of individuals
     """
     muxy, mux0, mu0y, *_ = muhat.unpack()
-    n_couples = np.sum(muxy)
+    n_couples = muhat.n_couples
     if no_singles:
         mux0 = np.zeros(mux0.shape)
         mu0y = np.zeros(mu0y.shape)
@@ -174,3 +230,50 @@ def prepare_data(
         n_households,
         n_individuals,
     )
+
+
+@dataclass
+class PoissonGLMMultiMarketResults:
+    """Stores and formats the estimation results on several markets.
+
+    Args:
+        n_markets: the number of markets
+        K: the number of bases
+        number_households: the total number of households
+        number_individuals: the total number of individuals
+        estimated_beta: the estimated basis coefficients, common to all markets
+        varcov_beta: their estimated var-covar
+        stderrs_beta: their estimated stderrs
+        estimated_us: the estimated utilities of men in each market
+        estimated_vs: the estimated utilities of women in each market
+        estimated_Phis: the estimated joint surplus in each market
+        n_iterations: the number of Newton steps on `beta`
+    """
+
+    n_markets: int
+    K: int
+    number_households: int
+    number_individuals: int
+    estimated_beta: np.ndarray
+    varcov_beta: np.ndarray
+    stderrs_beta: np.ndarray
+    estimated_us: list[np.ndarray]
+    estimated_vs: list[np.ndarray]
+    estimated_Phis: list[np.ndarray]
+    n_iterations: int
+
+    def __str__(self):
+        line_stars = "*" * 80 + "\n"
+        model_str = f"The data has {self.number_households} households"
+        model_str += f" in {self.n_markets} markets.\n\n"
+        model_str += f"We use {self.K} basis functions.\n\n"
+        repr_str = line_stars + model_str
+        repr_str += (
+            "The estimated basis coefficients (and their standard errors) are\n\n"
+        )
+        for i in range(self.K):
+            repr_str += (
+                f"   base_{i + 1}: {self.estimated_beta[i]: > 10.3f}  "
+                + f"({self.stderrs_beta[i]: .3f})\n"
+            )
+        return repr_str + line_stars
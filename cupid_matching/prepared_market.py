@@ -0,0 +1,108 @@
+"""A market prepared for estimation: the observed `Matching` and the bases,
+with the artifacts shared by the minimum distance and the Poisson GLM estimators
+computed on first use and cached.
+"""
+
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import cast
+
+import numpy as np
+import scipy.sparse as sp
+from bs_python_utils.bsutils import bs_error_abort
+
+from cupid_matching.matching_utils import Matching, VarianceMatching, variance_muhat
+from cupid_matching.min_distance_utils import make_D2_matrix
+from cupid_matching.poisson_glm_utils import make_glm_design, prepare_data
+from cupid_matching.utils import make_XY_K_mat
+
+
+@dataclass
+class PreparedMarket:
+    """
+    The observed `Matching` and the bases, with cached derived quantities.
+    Both `estimate_semilinear_mde` and `choo_siow_poisson_glm` accept it
+    in lieu of `(muhat, phi_bases)`.
+
+    Args:
+        muhat: the observed `Matching`
+        phi_bases: an (X, Y, K) array of bases
+    """
+
+    muhat: Matching
+    phi_bases: np.ndarray
+    _glm_data: dict[bool, tuple[np.ndarray, VarianceMatching, int, int]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _glm_design: dict[bool, tuple[np.ndarray, np.ndarray]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if sp.issparse(self.muhat.muxy):
+            bs_error_abort("The estimators need a Matching with a dense muxy.")
+        if self.phi_bases.ndim != 3:
+            bs_error_abort(
+                f"phi_bases should have 3 dimensions, not {self.phi_bases.ndim}"
+            )
+        X, Y = self.muhat.muxy.shape
+        Xp, Yp, K = self.phi_bases.shape
+        if Xp != X or Yp != Y:
+            bs_error_abort(
+                f"phi_bases should have shape ({X}, {Y}, {K}) not ({Xp}, {Yp}, {K})"
+            )
+
+    @cached_property
+    def var_muhat(self) -> VarianceMatching:
+        """the variance-covariance of the observed matching patterns"""
+        return cast(VarianceMatching, variance_muhat(self.muhat))
+
+    @cached_property
+    def phi_mat(self) -> np.ndarray:
+        """the bases reshaped into an (XY, K) matrix"""
+        return make_XY_K_mat(self.phi_bases)
+
+    @cached_property
+    def D2_matrix(self) -> tuple[np.ndarray, int]:
+        """the double differencing matrix used without singles, and its rank"""
+        X, Y, _ = self.phi_bases.shape
+        return make_D2_matrix(X, Y)
+
+    def glm_data(
+        self, no_singles: bool = False
+    ) -> tuple[np.ndarray, VarianceMatching, int, int]:
+        """the normalized data for the Poisson GLM, as returned by `prepare_data`"""
+        if no_singles not in self._glm_data:
+            self._glm_data[no_singles] = prepare_data(
+                self.muhat, self.var_muhat, no_singles=no_singles
+            )
+        return self._glm_data[no_singles]
+
+    def glm_design(self, no_singles: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """the unweighted design matrix `Z` of the Poisson GLM and its weights `w`"""
+        if no_singles not in self._glm_design:
+            self._glm_design[no_singles] = make_glm_design(
+                self.phi_bases, no_singles=no_singles, phi_mat=self.phi_mat
+            )
+        return self._glm_design[no_singles]
+
+
+def as_prepared_market(
+    muhat: Matching | PreparedMarket, phi_bases: np.ndarray | None
+) -> PreparedMarket:
+    """returns a `PreparedMarket`, building it from `(muhat, phi_bases)` if needed
+
+    Args:
+        muhat: the observed `Matching`, or a `PreparedMarket`
+        phi_bases: an (X, Y, K) array of bases; must be `None` with a `PreparedMarket`
+
+    Returns:
+        the `PreparedMarket`
+    """
+    if isinstance(muhat, PreparedMarket):
+        if phi_bases is not None:
+            bs_error_abort("phi_bases should be None when we have a PreparedMarket.")
+        return muhat
+    if phi_bases is None:
+        bs_error_abort("We need phi_bases with a Matching.")
+    return PreparedMarket(muhat, cast(np.ndarray, phi_bases))
@@ -0,0 +1,224 @@
+"""Weighting matrices for the minimum distance estimator.
+
+A weighting matrix $S$ is represented by an operator that can "whiten" an array,
+that is, compute $L' A$ for some factor $L$ with $S=LL'$.
+Then $A'SB = (L'A)'(L'B)$ and the weighted least-squares problem
+$\\min_\\beta (M\\beta+d)'S(M\\beta+d)$ is an ordinary least-squares problem
+in the whitened $L'M$ and $L'd$, which we solve by QR.
+"""
+
+from dataclasses import dataclass, field
+from typing import Protocol, cast
+
+import numpy as np
+import scipy.linalg as spla
+from bs_python_utils.bsutils import bs_error_abort
+
+
+class WeightingMatrix(Protocol):
+    """the interface of a weighting matrix $S=LL'$"""
+
+    @property
+    def size(self) -> int:
+        """the number of rows and columns of $S$"""
+        ...
+
+    def whiten(self, A: np.ndarray) -> np.ndarray:
+        """returns $L'A$ for a vector or matrix `A` with `size` rows"""
+        ...
+
+    def to_dense(self) -> np.ndarray:
+        """returns $S$ as a dense matrix"""
+        ...
+
+
+def _check_rows(A: np.ndarray, size: int) -> None:
+    if A.shape[0] != size:
+        bs_error_abort(f"The array should have {size} rows, not {A.shape[0]}.")
+
+
+@dataclass
+class IdentityWeighting:
+    """the identity weighting matrix, for unweighted least squares
+
+    Args:
+        size: the number of rows and columns
+    """
+
+    size: int
+
+    def whiten(self, A: np.ndarray) -> np.ndarray:
+        _check_rows(A, self.size)
+        return A
+
+    def to_dense(self) -> np.ndarray:
+        return np.eye(self.size)
+
+
+@dataclass
+class DiagonalWeighting:
+    """a diagonal weighting matrix
+
+    Args:
+        weights: the nonnegative diagonal of $S$
+    """
+
+    weights: np.ndarray
+    sqrt_weights: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.weights.ndim != 1:
+            bs_error_abort("The weights should be a vector.")
+        if np.any(self.weights < 0.0):
+            bs_error_abort("The weights should be nonnegative.")
+        self.sqrt_weights = np.sqrt(self.weights)
+
+    @property
+    def size(self) -> int:
+        return self.weights.size
+
+    def whiten(self, A: np.ndarray) -> np.ndarray:
+        _check_rows(A, self.size)
+        if A.ndim == 1:
+            return cast(np.ndarray, self.sqrt_weights * A)
+        return cast(np.ndarray, self.sqrt_weights.reshape((-1, 1)) * A)
+
+    def to_dense(self) -> np.ndarray:
+        return np.diag(self.weights)
+
+
+@dataclass
+class DenseWeighting:
+    """a dense positive definite weighting matrix; we whiten with its Cholesky factor
+
+    Args:
+        matrix: the matrix $S$
+    """
+
+    matrix: np.ndarray
+    chol_upper: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        n_rows, n_cols = self.matrix.shape
+        if n_rows != n_cols:
+            bs_error_abort(f"The matrix should be square, not ({n_rows}, {n_cols}).")
+        try:
+            # S = U'U, so that L = U'
+            self.chol_upper = spla.cholesky(self.matrix, lower=False)
+        except np.linalg.LinAlgError:
+            bs_error_abort("The weighting matrix should be positive definite.")
+
+    @property
+    def size(self) -> int:
+        return int(self.matrix.shape[0])
+
+    def whiten(self, A: np.ndarray) -> np.ndarray:
+        _check_rows(A, self.size)
+        return cast(np.ndarray, self.chol_upper @ A)
+
+    def to_dense(self) -> np.ndarray:
+        return self.matrix
+
+
+@dataclass
+class FactoredWeighting:
+    """a weighting matrix given by a factor $L$ such that $S=LL'$;
+    $L$ need not be square, so that $S$ may be low-rank.
+
+    Args:
+        factor: an (n, r) matrix $L$
+    """
+
+    factor: np.ndarray
+
+    def __post_init__(self):
+        if self.factor.ndim != 2:
+            bs_error_abort("The factor should be a matrix.")
+
+    @property
+    def size(self) -> int:
+        return int(self.factor.shape[0])
+
+    def whiten(self, A: np.ndarray) -> np.ndarray:
+        _check_rows(A, self.size)
+        return cast(np.ndarray, self.factor.T @ A)
+
+    def to_dense(self) -> np.ndarray:
+        return cast(np.ndarray, self.factor @ self.factor.T)
+
+
+@dataclass
+class InverseCovarianceWeighting:
+    """the inverse $S=V^{-1}$ of a positive definite covariance matrix $V$;
+    with $V=CC'$ its Cholesky decomposition, we whiten with $C^{-1}$
+    and we never invert $V$.
+
+    Args:
+        covariance: the matrix $V$
+    """
+
+    covariance: np.ndarray
+    chol_lower: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        n_rows, n_cols = self.covariance.shape
+        if n_rows != n_cols:
+            bs_error_abort(
+                f"The covariance should be square, not ({n_rows}, {n_cols})."
+            )
+        try:
+            self.chol_lower = spla.cholesky(self.covariance, lower=True)
+        except np.linalg.LinAlgError:
+            bs_error_abort("The covariance matrix should be positive definite.")
+
+    @property
+    def size(self) -> int:
+        return int(self.covariance.shape[0])
+
+    def whiten(self, A: np.ndarray) -> np.ndarray:
+        _check_rows(A, self.size)
+        return cast(np.ndarray, spla.solve_triangular(self.chol_lower, A, lower=True))
+
+    def to_dense(self) -> np.ndarray:
+        return cast(np.ndarray, spla.inv(self.covariance))
+
+
+def quadratic_form(S_mat: WeightingMatrix, u: np.ndarray) -> float:
+    """returns $u'Su$
+
+    Args:
+        S_mat: a weighting matrix
+        u: a vector
+
+    Returns:
+        the value of the quadratic form
+    """
+    u_white = S_mat.whiten(u)
+    return float(u_white @ u_white)
+
+
+def weighted_least_squares(
+    M: np.ndarray, S_mat: WeightingMatrix, d: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """minimizes $(M\\beta+d)'S(M\\beta+d)$ by a QR decomposition of $L'M$
+
+    Args:
+        M: an (n, p) matrix
+        S_mat: an (n, n) weighting matrix
+        d: an n-vector
+
+    Returns:
+        the p-vector of estimates $\\beta$ and the (p, p) matrix $(M'SM)^{-1}$
+    """
+    M_white = S_mat.whiten(M)
+    d_white = S_mat.whiten(d)
+    n_white, p = M_white.shape
+    if n_white < p:
+        bs_error_abort(f"We have {p} coefficients but only {n_white} whitened rows.")
+    Q_mat, R_mat = spla.qr(M_white, mode="economic")
+    if np.min(np.abs(np.diag(R_mat))) <= 1e-12 * np.max(np.abs(np.diag(R_mat))):
+        bs_error_abort("The weighted least-squares problem is rank-deficient.")
+    est_coeffs = -spla.solve_triangular(R_mat, Q_mat.T @ d_white)
+    R_inv = spla.solve_triangular(R_mat, np.eye(p))
+    varcov_coeffs = R_inv @ R_inv.T
+    return est_coeffs, varcov_coeffs
@@ -0,0 +1,186 @@
+from dataclasses import replace
+
+import numpy as np
+import scipy.sparse as sp
+from pytest import fixture, mark
+
+import cupid_matching.choo_siow as cs
+import cupid_matching.choo_siow_gender_heteroskedastic as csgh
+import cupid_matching.choo_siow_heteroskedastic as csh
+import cupid_matching.choo_siow_no_singles as csns
+from cupid_matching.choo_siow_gender_heteroskedastic import (
+    entropy_choo_siow_gender_heteroskedastic,
+)
+from cupid_matching.choo_siow_heteroskedastic import entropy_choo_siow_heteroskedastic
+from cupid_matching.matching_utils import Matching, MatchingBatch
+from cupid_matching.min_distance import estimate_semilinear_mde
+from cupid_matching.model_classes import ChooSiowPrimitives
+from cupid_matching.nested_logit import setup_standard_nested_logit
+
+entropy_nested_logit, _ = setup_standard_nested_logit(
+    [[1, 3], [2, 4, 5]], [[1, 2], [3, 4]]
+)
+
+
+@fixture
+def _matching_example():
+    rng = np.random.default_rng(0)
+    X, Y = 4, 5
+    muxy = rng.uniform(1.0, 2.0, size=(X, Y))
+    n = np.sum(muxy, 1) + rng.uniform(1.0, 2.0, size=X)
+    m = np.sum(muxy, 0) + rng.uniform(1.0, 2.0, size=Y)
+    return Matching(muxy, n, m)
+
+
+@mark.parametrize(
+    "entropy, n_alpha",
+    [
+        (entropy_choo_siow_heteroskedastic, 8),
+        (entropy_choo_siow_gender_heteroskedastic, 1),
+        (entropy_nested_logit, 4),
+    ],
+)
+def test_e_derivative_alpha(_matching_example, entropy, n_alpha):
+    alpha = np.linspace(0.5, 1.5, n_alpha)
+    additional_parameters = entropy.additional_parameters
+    e_derivative_mumu, e_derivative_mur = entropy.e_derivative
+    e_derivative_mumu_alpha, e_derivative_mur_alpha = entropy.e_derivative_alpha
+    for hess, hess_alpha in zip(
+        e_derivative_mumu(_matching_example, additional_parameters),
+        e_derivative_mumu_alpha(_matching_example, alpha, additional_parameters),
+        strict=True,
+    ):
+        assert np.allclose(hess @ alpha, hess_alpha)
+    for hess, hess_alpha in zip(
+        e_derivative_mur(_matching_example, additional_parameters),
+        e_derivative_mur_alpha(_matching_example, alpha, additional_parameters),
+        strict=True,
+    ):
+        assert np.allclose(hess @ alpha, hess_alpha)
+
+
+def test_mde_with_e_derivative_alpha():
+    rng = np.random.default_rng(1)
+    X, Y, K = 4, 3, 2
+    phi_bases = rng.normal(size=(X, Y, K))
+    choo_siow_instance = ChooSiowPrimitives(
+        phi_bases @ np.ones(K), np.ones(X), np.ones(Y)
+    )
+    mus_sim = choo_siow_instance.simulate(100_000, seed=1)
+    entropy = entropy_choo_siow_gender_heteroskedastic
+    mde_alpha = estimate_semilinear_mde(mus_sim, phi_bases, entropy)
+    mde_full = estimate_semilinear_mde(
+        mus_sim, phi_bases, replace(entropy, e_derivative_alpha=None)
+    )
+    assert np.allclose(
+        mde_alpha.estimated_coefficients, mde_full.estimated_coefficients
+    )
+    assert np.allclose(mde_alpha.varcov_coefficients, mde_full.varcov_coefficients)
+
+
+@mark.parametrize(
+    "kernel",
+    [
+        csh.e_choo_siow_heteroskedastic,
+        csh.e0_derivative_mu_heteroskedastic,
+        csh.e0_derivative_r_heteroskedastic,
+        csh.e_derivative_mu_heteroskedastic,
+        csh.e_derivative_r_heteroskedastic,
+        csgh.e_choo_siow_gender_heteroskedastic,
+        csgh.e0_derivative_mu_gender_heteroskedastic,
+        csgh.e0_derivative_r_gender_heteroskedastic,
+        csgh.e_derivative_mu_gender_heteroskedastic,
+        csgh.e_derivative_r_gender_heteroskedastic,
+    ],
+)
+def test_entropy_kernels_out(_matching_example, kernel):
+    result = kernel(_matching_example)
+    if isinstance(result, np.ndarray):
+        out = np.full_like(result, np.nan)
+        assert kernel(_matching_example, out=out) is out
+        assert np.array_equal(out, result)
+    else:
+        out = tuple(np.full_like(arr, np.nan) for arr in result)
+        result_out = kernel(_matching_example, out=out)
+        for arr, arr_out, buffer in zip(result, result_out, out, strict=True):
+            assert arr_out is buffer
+            assert np.array_equal(arr_out, arr)
+
+
+def test_e_heteroskedastic_derivatives(_matching_example):
+    # the loop-free kernels agree with the formulas cell by cell
+    muxy, mux0, mu0y, *_ = _matching_example.unpack()
+    X, Y = muxy.shape
+    e_vals = csh.e_choo_siow_heteroskedastic(_matching_example)
+    hess_x, hess_y, hess_xy = csh.e_derivative_mu_heteroskedastic(_matching_example)
+    hess_n, hess_m = csh.e_derivative_r_heteroskedastic(_matching_example)
+    for x in range(1, X):
+        assert np.allclose(e_vals[x, :, x - 1], -np.log(muxy[x, :] / mux0[x]))
+        assert np.allclose(hess_x[x, :, :, x - 1], -1.0 / mux0[x])
+        assert np.allclose(hess_n[x, :, x - 1], 1.0 / mux0[x])
+    for y in range(Y):
+        i = X - 1 + y
+        assert np.allclose(e_vals[:, y, i], -np.log(muxy[:, y] / mu0y[y]))
+        assert np.allclose(hess_y[:, y, :, i], -1.0 / mu0y[y])
+        assert np.allclose(hess_xy[:, y, i], -1.0 / muxy[:, y] - 1.0 / mu0y[y])
+        assert np.allclose(hess_m[:, y, i], 1.0 / mu0y[y])
+    n_nonzero = Y * (X - 1) + X * Y
+    assert np.count_nonzero(e_vals) == n_nonzero
+    assert np.count_nonzero(hess_n) + np.count_nonzero(hess_m) == n_nonzero
+
+
+@mark.parametrize(
+    "e0_fun, no_singles",
+    [
+        (cs.e0_fun_choo_siow, False),
+        (cs.e0_fun_choo_siow_corrected, False),
+        (csns.e0_fun_choo_siow_no_singles, True),
+        (csns.e0_fun_choo_siow_no_singles_corrected, True),
+    ],
+)
+def test_e0_fun_batch(e0_fun, no_singles):
+    rng = np.random.default_rng(2)
+    B, X, Y = 6, 4, 5
+    muxy = rng.uniform(1.0, 2.0, size=(B, X, Y))
+    n, m = np.sum(muxy, 2), np.sum(muxy, 1)
+    if not no_singles:
+        n += rng.uniform(1.0, 2.0, size=(B, X))
+        m += rng.uniform(1.0, 2.0, size=(B, Y))
+    batch = MatchingBatch(muxy, n, m, no_singles=no_singles)
+    e0_batch = e0_fun(batch)
+    assert e0_batch.shape == (B, X, Y)
+    for e0_b, mus_b in zip(e0_batch, batch, strict=True):
+        assert np.allclose(e0_b, e0_fun(mus_b))
+
+
+@mark.parametrize("e0_fun", [cs.e0_fun_choo_siow, cs.e0_fun_choo_siow_corrected])
+def test_e0_fun_sparse(_matching_example, e0_fun):
+    muxy = _matching_example.muxy
+    stored = np.arange(muxy.size).reshape(muxy.shape) % 3 != 0
+    muxy_stored = np.where(stored, muxy, 0.0)
+    n = np.sum(muxy_stored, 1) + _matching_example.mux0
+    m = np.sum(muxy_stored, 0) + _matching_example.mu0y
+    mus_sparse = Matching(sp.csr_array(muxy_stored), n, m)
+    # a dense matching with negligible numbers of couples in the other cells
+    mus_dense = Matching(np.where(stored, muxy, 1e-300), n, m)
+    e0_sparse = e0_fun(mus_sparse)
+    assert sp.issparse(e0_sparse)
+    assert np.allclose(e0_sparse.toarray()[stored], e0_fun(mus_dense)[stored])
+    val_sparse, _ = cs._entropy_choo_siow(mus_sparse, deriv=1)
+    assert np.isclose(val_sparse, cs._entropy_choo_siow(mus_dense, deriv=0))
+
+
+@mark.parametrize(
+    "e0_fun",
+    [csns.e0_fun_choo_siow_no_singles, csns.e0_fun_choo_siow_no_singles_corrected],
+)
+def test_e0_fun_no_singles_sparse(_matching_example, e0_fun):
+    muxy = _matching_example.muxy
+    stored = np.arange(muxy.size).reshape(muxy.shape) % 3 != 0
+    muxy_stored = np.where(stored, muxy, 0.0)
+    n, m = np.sum(muxy_stored, 1), np.sum(muxy_stored, 0)
+    mus_sparse = Matching(sp.csr_array(muxy_stored), n, m, no_singles=True)
+    mus_dense = Matching(np.where(stored, muxy, 1e-300), n, m, no_singles=True)
+    e0_sparse = e0_fun(mus_sparse)
+    assert sp.issparse(e0_sparse)
+    assert np.allclose(e0_sparse.toarray()[stored], e0_fun(mus_dense)[stored])
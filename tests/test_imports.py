@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+import cupid_matching
+
+HEAVY_MODULES = ["sklearn", "scipy.stats", "altair", "streamlit"]
+
+
+def _loaded_heavy_modules(statement: str) -> list[str]:
+    """runs `statement` in a fresh interpreter and returns the heavy modules it loads"""
+    code = (
+        f"import sys\n{statement}\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    loaded = completed.stdout.strip()
+    return loaded.split(",") if loaded else []
+
+
+def test_import_is_light():
+    assert _loaded_heavy_modules("import cupid_matching") == []
+    assert (
+        _loaded_heavy_modules(
+            "from cupid_matching import ipfp_homoskedastic_solver, Matching"
+        )
+        == []
+    )
+    assert (
+        _loaded_heavy_modules("from cupid_matching import estimate_semilinear_mde")
+        == []
+    )
+
+
+def test_lazy_names():
+    for name in cupid_matching.__all__:
+        assert getattr(cupid_matching, name) is not None
+    # sklearn is only loaded when we set up a Poisson regression
+    assert (
+        _loaded_heavy_modules("from cupid_matching import choo_siow_poisson_glm") == []
+    )
+    assert "sklearn" in _loaded_heavy_modules(
+        "import cupid_matching; cupid_matching.PoissonGLMEstimator()"
+    )
@@ -1,6 +1,8 @@
 import numpy as np
+import scipy.sparse as sp
 from pytest import fixture
 
+from cupid_matching import ipfp_solvers
 from cupid_matching.ipfp_solvers import (
     ipfp_gender_heteroskedastic_solver,
     ipfp_heteroskedastic_solver,
@@ -8,6 +10,7 @@ from cupid_matching.ipfp_solvers import (
     ipfp_homoskedastic_solver,
 )
 from cupid_matching.matching_utils import Matching
+from cupid_matching.persistence import load_arrays
 
 
 @fixture
@@ -96,3 +99,151 @@ def test_ipfp_hetero(_matching_phi_hetero):
     assert np.allclose(mus.muxy, muxy_th)
     assert np.allclose(mus.mux0, mux0_th)
     assert np.allclose(mus.mu0y, mu0y_th)
+
+
+def test_ipfp_homo_newton(_matching_phi):
+    mus_th, phi = _matching_phi
+    muxy_th, mux0_th, mu0y_th, n_th, m_th = mus_th.unpack()
+    mus, marg_err_x, marg_err_y, stats = ipfp_homoskedastic_solver(
+        phi, n_th, m_th, tol=1e-12, method="newton", return_stats=True
+    )
+    assert np.allclose(mus.muxy, muxy_th)
+    assert np.allclose(mus.mux0, mux0_th)
+    assert np.allclose(mus.mu0y, mu0y_th)
+    assert np.max(np.abs(marg_err_x)) < 1e-12
+    assert np.max(np.abs(marg_err_y)) < 1e-12
+    assert stats.n_newton_iterations > 0
+
+
+def test_ipfp_gender_hetero_gradient(_matching_phi_gender_hetero):
+    mus_th, phi, tau = _matching_phi_gender_hetero
+    _, _, _, n_th, m_th = mus_th.unpack()
+    X, Y = phi.shape
+    n_f, m_f = n_th.astype(float), m_th.astype(float)
+    _, _, _, dmuxy, dmux0, dmu0y = ipfp_gender_heteroskedastic_solver(
+        phi, n_f, m_f, tau=tau, tol=1e-12, gr=True
+    )
+
+    def solve_mus(params):
+        n, m = params[:X], params[X : (X + Y)]
+        phi_p = params[(X + Y) : -1].reshape((X, Y))
+        mus, *_ = ipfp_gender_heteroskedastic_solver(
+            phi_p, n, m, tau=params[-1], tol=1e-12
+        )
+        return np.concatenate((mus.muxy.ravel(), mus.mux0, mus.mu0y))
+
+    # compare with central finite differences
+    params = np.concatenate((n_f, m_f, phi.ravel(), [tau]))
+    eps = 1e-6
+    der_num = np.zeros((X * Y + X + Y, params.size))
+    for i in range(params.size):
+        params_p, params_m = params.copy(), params.copy()
+        params_p[i] += eps
+        params_m[i] -= eps
+        der_num[:, i] = (solve_mus(params_p) - solve_mus(params_m)) / (2.0 * eps)
+    der = np.vstack((dmuxy, dmux0, dmu0y))
+    assert np.allclose(der, der_num, atol=1e-5)
+
+
+def _hetero_numerical_jacobian(phi, n_f, m_f, sigx1, tauy):
+    """the derivatives of (muxy, mux0, mu0y) by central finite differences"""
+    X, Y = phi.shape
+
+    def solve_mus(params):
+        n, m = params[:X], params[X : (X + Y)]
+        i_sig = X + Y + X * Y
+        phi_p = params[(X + Y) : i_sig].reshape((X, Y))
+        sigma_x, tau_y = params[i_sig : (i_sig + X)], params[(i_sig + X) :]
+        mus, *_ = ipfp_heteroskedastic_solver(phi_p, n, m, sigma_x, tau_y, tol=1e-12)
+        return np.concatenate((mus.muxy.ravel(), mus.mux0, mus.mu0y))
+
+    # compare with central finite differences
+    params = np.concatenate((n_f, m_f, phi.ravel(), sigx1, tauy))
+    eps = 1e-6
+    der_num = np.zeros((X * Y + X + Y, params.size))
+    for i in range(params.size):
+        params_p, params_m = params.copy(), params.copy()
+        params_p[i] += eps
+        params_m[i] -= eps
+        der_num[:, i] = (solve_mus(params_p) - solve_mus(params_m)) / (2.0 * eps)
+    return der_num
+
+
+def test_ipfp_hetero_gradient(_matching_phi_hetero):
+    mus_th, phi, sigx1, tauy = _matching_phi_hetero
+    n_f, m_f = mus_th.n.astype(float), mus_th.m.astype(float)
+    _, _, _, dmuxy, dmux0, dmu0y, stats = ipfp_heteroskedastic_solver(
+        phi, n_f, m_f, sigx1, tauy, tol=1e-12, gr=True, return_stats=True
+    )
+    assert stats.n_inner_iterations >= stats.n_ipfp_iterations > 0
+    der_num = _hetero_numerical_jacobian(phi, n_f, m_f, sigx1, tauy)
+    der = np.vstack((dmuxy, dmux0, dmu0y))
+    assert np.allclose(der, der_num, atol=1e-5)
+
+
+def test_ipfp_sparse(_matching_phi):
+    _, phi = _matching_phi
+    X, Y = phi.shape
+    n, m = np.arange(7.0, 7.0 + X), np.arange(6.0, 6.0 + Y)
+    # infeasible pairs are implicit zeros of a sparse Phi
+    #   and very negative values of a dense Phi
+    feasible = np.array([[1, 0, 1], [0, 1, 1], [1, 1, 0], [0, 0, 1]], dtype=bool)
+    phi_sparse = sp.csr_array(np.where(feasible, phi, 0.0))
+    phi_dense = np.where(feasible, phi, -100.0)
+    for solver, kwargs in [
+        (ipfp_homoskedastic_solver, {}),
+        (ipfp_homoskedastic_solver, {"method": "newton"}),
+        (ipfp_gender_heteroskedastic_solver, {"tau": 0.7}),
+    ]:
+        mus_sparse, *_ = solver(phi_sparse, n, m, tol=1e-12, **kwargs)
+        mus_dense, *_ = solver(phi_dense, n, m, tol=1e-12, **kwargs)
+        assert sp.issparse(mus_sparse.muxy)
+        assert mus_sparse.muxy.nnz == np.sum(feasible)
+        assert np.allclose(mus_sparse.muxy.toarray(), mus_dense.muxy)
+        assert np.allclose(mus_sparse.mux0, mus_dense.mux0)
+        assert np.allclose(mus_sparse.mu0y, mus_dense.mu0y)
+    muxy_no_singles = np.exp(phi_dense / 2.0)
+    n_ns, m_ns = np.sum(muxy_no_singles, 1), np.sum(muxy_no_singles, 0)
+    muxy_sparse, *_ = ipfp_homoskedastic_no_singles_solver(phi_sparse, n_ns, m_ns)
+    assert np.allclose(muxy_sparse.toarray(), muxy_no_singles)
+
+
+def test_ipfp_homo_float32(_matching_phi):
+    mus_th, phi = _matching_phi
+    muxy_th, mux0_th, mu0y_th, n_th, m_th = mus_th.unpack()
+    mus, *_ = ipfp_homoskedastic_solver(phi, n_th, m_th, dtype=np.float32)
+    assert mus.muxy.dtype == np.float32
+    assert mus.mux0.dtype == np.float32
+    assert np.allclose(mus.muxy, muxy_th, rtol=1e-5)
+    assert np.allclose(mus.mux0, mux0_th, rtol=1e-5)
+    mus, *_ = ipfp_homoskedastic_solver(
+        phi, n_th, m_th, tol=1e-12, dtype=np.float32, refine=True
+    )
+    assert mus.muxy.dtype == np.float64
+    assert np.allclose(mus.muxy, muxy_th, rtol=1e-10)
+    assert np.allclose(mus.mu0y, mu0y_th, rtol=1e-10)
+
+
+def test_ipfp_hetero_gradient_memmap(_matching_phi_hetero, tmp_path, monkeypatch):
+    mus_th, phi, sigx1, tauy = _matching_phi_hetero
+    n_f, m_f = mus_th.n.astype(float), mus_th.m.astype(float)
+    _, _, _, dmuxy, dmux0, dmu0y = ipfp_heteroskedastic_solver(
+        phi, n_f, m_f, sigx1, tauy, tol=1e-12, gr=True
+    )
+    # use several small blocks of rows
+    monkeypatch.setattr(ipfp_solvers, "_JACOBIAN_BLOCK_ELEMENTS", 7 * phi.size)
+    *_, dmuxy_mm, dmux0_mm, dmu0y_mm = ipfp_heteroskedastic_solver(
+        phi, n_f, m_f, sigx1, tauy, tol=1e-12, gr=True, jacobian_dir=tmp_path
+    )
+    assert isinstance(dmuxy_mm, np.memmap)
+    # the blocks of rows are contiguous in the row-major file
+    assert dmuxy_mm.flags.c_contiguous and not dmuxy_mm.flags.f_contiguous
+    der_num = _hetero_numerical_jacobian(phi, n_f, m_f, sigx1, tauy)
+    der_mm = np.vstack((dmuxy_mm, dmux0_mm, dmu0y_mm))
+    assert np.allclose(der_mm, der_num, atol=1e-5)
+    assert np.allclose(dmuxy_mm, dmuxy)
+    assert np.allclose(dmux0_mm, dmux0)
+    assert np.allclose(dmu0y_mm, dmu0y)
+    jacobians, _ = load_arrays(tmp_path)
+    assert np.allclose(jacobians["dmuxy"], dmuxy)
+    assert jacobians.keys() == {"dmuxy", "dmux0", "dmu0y"}
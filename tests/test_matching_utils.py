@@ -1,12 +1,18 @@
+import pickle
+from dataclasses import FrozenInstanceError
 from math import isclose
 
 import numpy as np
-from pytest import fixture
+import scipy.sparse as sp
+from pytest import fixture, raises
 
 from cupid_matching.matching_utils import (
     Matching,
+    MatchingBatch,
+    SparseVarianceMatching,
     compute_margins,
     get_singles,
+    simulate_sample_from_mus,
     var_divide,
     variance_muhat,
 )
@@ -48,6 +54,129 @@ def test_init_matching(_matching_example):
     assert np.allclose(mu0y, mu0y_th)
 
 
+def test_matching_immutable_and_cached(_matching_example):
+    muxy, mux0, mu0y, n, m = _matching_example
+    mus = Matching(muxy, n, m)
+    with raises(FrozenInstanceError):
+        mus.muxy = muxy
+    with raises(ValueError):
+        mus.mux0[0] = 1.0
+    assert not hasattr(mus, "__dict__")
+    assert isclose(mus.n_couples, np.sum(muxy))
+    assert mus.log_muxy is mus.log_muxy
+    assert np.allclose(mus.log_muxy, np.log(muxy))
+    assert np.allclose(mus.log_mux0, np.log(mux0))
+    assert np.allclose(mus.log_mu0y, np.log(mu0y))
+    assert np.allclose(mus.log_n, np.log(n))
+    assert np.allclose(mus.log_m, np.log(m))
+    muxy_prop, mux0_prop, mu0y_prop = mus.proportions
+    assert np.allclose(muxy_prop, muxy / mus.n_households)
+    assert isclose(np.sum(muxy_prop) + np.sum(mux0_prop) + np.sum(mu0y_prop), 1.0)
+    # copies made by pickling, e.g. by a cache, are read-only too
+    mus_copy = pickle.loads(pickle.dumps(mus))
+    assert np.array_equal(mus_copy.mux0, mus.mux0)
+    with raises(ValueError):
+        mus_copy.muxy[0, 0] = 1.0
+
+
+def test_matching_owns_its_arrays(_matching_example):
+    muxy, mux0, _, n, m = _matching_example
+    muxy_source, n_source = muxy.copy(), n.copy()
+    mus = Matching(muxy_source, n_source, m)
+    log_muxy = mus.log_muxy.copy()
+    # changing the arrays of the caller does not change the validated matching
+    muxy_source[0, 0] += 1.0
+    n_source[0] += 1.0
+    assert np.array_equal(mus.muxy, muxy)
+    assert np.array_equal(mus.n, n)
+    assert np.allclose(mus.mux0, mux0)
+    assert np.array_equal(mus.log_muxy, log_muxy)
+    muxy_sparse = sp.csr_array(muxy)
+    mus_sparse = Matching(muxy_sparse, n, m)
+    muxy_sparse.data[0] += 1.0
+    assert np.array_equal(mus_sparse.muxy.toarray(), muxy)
+    batch_source = np.stack([muxy, muxy])
+    batch = MatchingBatch(batch_source, np.stack([n, n]), np.stack([m, m]))
+    batch_source[1, 0, 0] += 1.0
+    assert np.array_equal(batch[1].muxy, muxy)
+
+
+def test_matching_validated_at_creation(_matching_example):
+    muxy, _, _, n, m = _matching_example
+    with raises(SystemExit):
+        Matching(muxy, n - 10.0, m)
+
+
+def test_matching_batch(_matching_example):
+    muxy, mux0, mu0y, n, m = _matching_example
+    matchings = [
+        Matching(muxy * (b + 1.0), n * (b + 1.0), m * (b + 1.0)) for b in range(3)
+    ]
+    batch = MatchingBatch.from_matchings(matchings)
+    assert len(batch) == 3
+    assert np.allclose(batch.mux0, np.stack([mus.mux0 for mus in matchings]))
+    assert np.allclose(batch.mu0y[1], 2.0 * mu0y)
+    assert np.allclose(batch.n_households, [mus.n_households for mus in matchings])
+    assert np.allclose(batch.n_individuals, [mus.n_individuals for mus in matchings])
+    assert np.allclose(batch.n_couples, [mus.n_couples for mus in matchings])
+    assert np.allclose(batch.log_muxy[2], matchings[2].log_muxy)
+    assert np.allclose(batch.proportions[1][0], matchings[0].proportions[1])
+    n_batch, m_batch = compute_margins(batch.muxy, batch.mux0, batch.mu0y)
+    assert np.allclose(n_batch, batch.n)
+    assert np.allclose(m_batch, batch.m)
+    mus_1 = batch[1]
+    assert np.shares_memory(mus_1.muxy, batch.muxy)
+    assert np.allclose(mus_1.mux0, 2.0 * mux0)
+    assert len(list(batch)) == 3
+    with raises(SystemExit):
+        MatchingBatch(batch.muxy, batch.n[:, :-1], batch.m)
+
+
+def test_sparse_matching(_matching_example):
+    muxy, _, _, n, m = _matching_example
+    # the second man cannot match with the second woman
+    muxy_sparse = sp.coo_array(np.where([[1, 1, 1], [1, 0, 1]], muxy, 0.0))
+    n_sparse = n - np.array([0.0, 1.0])
+    m_sparse = m - np.array([0.0, 1.0, 0.0])
+    mus = Matching(muxy_sparse, n_sparse, m_sparse)
+    mus_dense = Matching(muxy_sparse.toarray(), n_sparse, m_sparse)
+    assert sp.issparse(mus.muxy) and mus.muxy.nnz == 5
+    assert np.allclose(mus.mux0, mus_dense.mux0)
+    assert np.allclose(mus.mu0y, mus_dense.mu0y)
+    assert isclose(mus.n_households, mus_dense.n_households)
+    rows, cols = mus.stored_cells
+    assert np.allclose(mus.muxy.data, mus_dense.muxy[rows, cols])
+
+    mus_sim = simulate_sample_from_mus(mus, 1_000, seed=0)
+    assert sp.issparse(mus_sim.muxy)
+    assert np.array_equal(mus_sim.muxy.indices, mus.muxy.indices)
+
+    var_sparse = variance_muhat(mus)
+    assert isinstance(var_sparse, SparseVarianceMatching)
+    stored = np.concatenate((rows * 3 + cols, 6 + np.arange(5)))
+    var_dense = variance_muhat(mus_dense).var_allmus[np.ix_(stored, stored)]
+    assert np.allclose(var_sparse.to_dense(), var_dense)
+    v = np.arange(var_sparse.size, dtype=float)
+    assert np.allclose(var_sparse.matvec(v), var_dense @ v)
+    assert np.allclose(var_sparse.diagonal(), np.diag(var_dense))
+
+
+def test_simulate_sample_dtype(_matching_example):
+    muxy, _, _, n, m = _matching_example
+    mus = Matching(muxy.astype(np.float32), n.astype(np.float32), m.astype(np.float32))
+    assert mus.mux0.dtype == np.float32
+    mus_sim = simulate_sample_from_mus(mus, 10_000, seed=1, dtype=np.float32)
+    for mus_arr in (mus_sim.muxy, mus_sim.mux0, mus_sim.n, mus_sim.m):
+        assert mus_arr.dtype == np.float32
+    mus_sim_int = simulate_sample_from_mus(mus, 10_000, seed=1)
+    assert np.issubdtype(mus_sim_int.muxy.dtype, np.integer)
+    assert np.array_equal(mus_sim_int.muxy, mus_sim.muxy)
+    # the no-singles branch used to normalize muxy in place
+    muxy_copy = mus.muxy.copy()
+    simulate_sample_from_mus(mus, 10_000, no_singles=True, seed=1)
+    assert np.array_equal(mus.muxy, muxy_copy)
+
+
 def test_variancematching(_matching_example):
     muxy, mux0_0, mu0y_0, n, m = _matching_example
     mus = Matching(muxy, n, m)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from pytest import fixture, mark
+
+from cupid_matching.microdata import (
+    MatchingCounts,
+    MicrodataSampler,
+    aggregate_microdata,
+    merge_counts,
+    read_microdata,
+)
+from cupid_matching.model_classes import ChooSiowPrimitives
+
+men_types = ["low", "mid", "high"]
+women_types = ["low", "high"]
+
+
+@fixture
+def _microdata():
+    rng = np.random.default_rng(0)
+    n_records = 10_000
+    husbands = rng.choice(np.array(men_types + [None], dtype=object), n_records)
+    wives = rng.choice(np.array(women_types + [None], dtype=object), n_records)
+    wives[pd.isna(husbands) & pd.isna(wives)] = "low"
+    weights = rng.uniform(0.5, 1.5, n_records)
+    records = pd.DataFrame(
+        {"husband_type": husbands, "wife_type": wives, "weight": weights}
+    )
+    # the counts computed directly
+    X, Y = len(men_types), len(women_types)
+    muxy, mux0, mu0y = np.zeros((X, Y)), np.zeros(X), np.zeros(Y)
+    for husband, wife, weight in zip(husbands, wives, weights, strict=True):
+        if husband is None:
+            mu0y[women_types.index(wife)] += weight
+        elif wife is None:
+            mux0[men_types.index(husband)] += weight
+        else:
+            muxy[men_types.index(husband), women_types.index(wife)] += weight
+    return records, (muxy, mux0, mu0y)
+
+
+def test_aggregate_microdata(_microdata):
+    records, (muxy, mux0, mu0y) = _microdata
+    chunks = [records.iloc[i : i + 999] for i in range(0, len(records), 999)]
+    counts = aggregate_microdata(chunks, men_types, women_types, weight_col="weight")
+    assert np.allclose(counts.muxy, muxy)
+    assert np.allclose(counts.mux0, mux0)
+    assert np.allclose(counts.mu0y, mu0y)
+    # partial counts of two workers
+    half = len(chunks) // 2
+    counts_merged = merge_counts(
+        [
+            aggregate_microdata(part, men_types, women_types, weight_col="weight")
+            for part in (chunks[:half], chunks[half:])
+        ]
+    )
+    assert np.allclose(counts_merged.muxy, counts.muxy)
+    mus = counts.to_matching()
+    assert np.isclose(mus.n_households, np.sum(records.weight))
+    assert np.allclose(mus.mux0, mux0)
+
+
+@mark.parametrize("suffix", [".csv", ".parquet"])
+def test_read_microdata(_microdata, tmp_path, suffix):
+    records, _ = _microdata
+    path = tmp_path / f"records{suffix}"
+    if suffix == ".csv":
+        records.to_csv(path, index=False)
+    else:
+        records.to_parquet(path)
+    counts = read_microdata(path, men_types, women_types, chunksize=1_000)
+    counts_unweighted = aggregate_microdata([records], men_types, women_types)
+    assert np.array_equal(counts.muxy, counts_unweighted.muxy)
+    assert np.array_equal(counts.mu0y, counts_unweighted.mu0y)
+    assert counts.n_households == len(records)
+
+
+def test_matching_counts_add():
+    counts = MatchingCounts.empty(2, 3)
+    counts.add(np.array([0, 1, -1, 1]), np.array([2, -1, 0, 2]))
+    assert np.array_equal(counts.muxy, [[0, 0, 1], [0, 0, 1]])
+    assert np.array_equal(counts.mux0, [0, 1])
+    assert np.array_equal(counts.mu0y, [1, 0, 0])
+
+
+def test_microdata_sampler():
+    rng = np.random.default_rng(2)
+    X, Y = 4, 3
+    mus = ChooSiowPrimitives(
+        rng.normal(size=(X, Y)), rng.uniform(0.5, 1.5, X), rng.uniform(0.5, 1.5, Y)
+    ).ipfp_solve()
+    sampler = MicrodataSampler(mus, seed=7)
+    n_households = 1_000_000
+    counts = MatchingCounts.empty(X, Y)
+    chunks = list(sampler.chunks(n_households, chunksize=300_000))
+    assert [chunk["wife_type"].size for chunk in chunks] == [300_000] * 3 + [100_000]
+    for chunk in chunks:
+        counts.add(chunk["husband_type"], chunk["wife_type"])
+    proportions = counts.muxy / n_households
+    assert np.allclose(proportions, mus.muxy / mus.n_households, atol=3e-3)
+    # each chunk can be reproduced on its own
+    chunk_2 = MicrodataSampler(mus, seed=7).chunk(2, 300_000)
+    assert np.array_equal(chunk_2["husband_type"], chunks[2]["husband_type"])
+    assert not np.array_equal(chunks[1]["husband_type"], chunks[2]["husband_type"])
+    couples_only = MicrodataSampler(mus, no_singles=True).chunk(0, 1_000)
+    assert np.all(couples_only["husband_type"] >= 0)
+    assert np.all(couples_only["wife_type"] >= 0)
@@ -0,0 +1,145 @@
+import numpy as np
+from pytest import fixture, mark
+
+from cupid_matching.choo_siow import entropy_choo_siow
+from cupid_matching.choo_siow_gender_heteroskedastic import (
+    entropy_choo_siow_gender_heteroskedastic,
+)
+from cupid_matching.min_distance import (
+    estimate_pooled_semilinear_mde,
+    estimate_semilinear_mde,
+    prepare_mde_specification_search,
+)
+from cupid_matching.model_classes import ChooSiowPrimitives
+from cupid_matching.weighting_matrix import FactoredWeighting
+
+
+@fixture
+def _mde_example():
+    rng = np.random.default_rng(1)
+    X, Y, K = 10, 8, 3
+    phi_bases = rng.normal(size=(X, Y, K))
+    choo_siow_instance = ChooSiowPrimitives(
+        phi_bases @ np.ones(K), rng.uniform(0.5, 1.5, X), rng.uniform(0.5, 1.5, Y)
+    )
+    mus_sim = choo_siow_instance.simulate(1_000_000, seed=1)
+    return mus_sim, phi_bases
+
+
+def test_iterated_mde(_mde_example):
+    mus_sim, phi_bases = _mde_example
+    entropy = entropy_choo_siow_gender_heteroskedastic
+    mde_two_step = estimate_semilinear_mde(mus_sim, phi_bases, entropy)
+    assert mde_two_step.number_iterations == 1
+    mde_iterated = estimate_semilinear_mde(
+        mus_sim, phi_bases, entropy, iterated=True, tol_mde=1e-8
+    )
+    assert 1 < mde_iterated.number_iterations < 50
+    assert np.allclose(
+        mde_iterated.estimated_coefficients,
+        mde_two_step.estimated_coefficients,
+        atol=1e-2,
+    )
+    assert np.allclose(mde_iterated.estimated_coefficients, 1.0, atol=0.05)
+
+
+def test_iterated_mde_maxiter(_mde_example):
+    mus_sim, phi_bases = _mde_example
+    mde_iterated = estimate_semilinear_mde(
+        mus_sim,
+        phi_bases,
+        entropy_choo_siow_gender_heteroskedastic,
+        iterated=True,
+        maxiter_mde=2,
+        tol_mde=0.0,
+    )
+    assert mde_iterated.number_iterations == 2
+
+
+def test_mde_factored_weighting(_mde_example):
+    mus_sim, phi_bases = _mde_example
+    X, Y, _ = phi_bases.shape
+    factor = np.random.default_rng(3).uniform(size=(X * Y, X * Y))
+    entropy = entropy_choo_siow_gender_heteroskedastic
+    mde_dense = estimate_semilinear_mde(
+        mus_sim, phi_bases, entropy, initial_weighting_matrix=factor @ factor.T
+    )
+    mde_factored = estimate_semilinear_mde(
+        mus_sim, phi_bases, entropy, initial_weighting_matrix=FactoredWeighting(factor)
+    )
+    assert np.allclose(
+        mde_dense.estimated_coefficients, mde_factored.estimated_coefficients
+    )
+
+
+@fixture
+def _pooled_example():
+    rng = np.random.default_rng(4)
+    beta = np.array([1.0, -0.5, 0.3])
+    markets = []
+    for i_market in range(4):
+        X, Y = rng.integers(5, 9, size=2)
+        phi_bases = rng.normal(size=(X, Y, beta.size))
+        choo_siow_instance = ChooSiowPrimitives(
+            phi_bases @ beta, rng.uniform(0.5, 1.5, X), rng.uniform(0.5, 1.5, Y)
+        )
+        mus_sim = choo_siow_instance.simulate(200_000, seed=i_market)
+        markets.append((mus_sim, phi_bases))
+    return markets, beta
+
+
+@mark.parametrize(
+    "entropy", [entropy_choo_siow, entropy_choo_siow_gender_heteroskedastic]
+)
+def test_pooled_mde_one_market(_pooled_example, entropy):
+    markets, _ = _pooled_example
+    mde_single = estimate_semilinear_mde(*markets[0], entropy)
+    mde_pooled = estimate_pooled_semilinear_mde(markets[:1], entropy)
+    n_alpha = mde_pooled.estimated_alphas[0].size
+    assert np.allclose(
+        mde_pooled.estimated_beta, mde_single.estimated_coefficients[n_alpha:]
+    )
+    assert np.allclose(
+        mde_pooled.estimated_alphas[0], mde_single.estimated_coefficients[:n_alpha]
+    )
+    assert np.allclose(
+        mde_pooled.varcov_beta, mde_single.varcov_coefficients[n_alpha:, n_alpha:]
+    )
+    assert np.isclose(mde_pooled.test_statistic, mde_single.test_statistic)
+    assert mde_pooled.ndf == mde_single.ndf
+
+
+def test_pooled_mde(_pooled_example):
+    markets, beta = _pooled_example
+    entropy = entropy_choo_siow_gender_heteroskedastic
+    mde_pooled = estimate_pooled_semilinear_mde(markets, entropy)
+    mde_threads = estimate_pooled_semilinear_mde(markets, entropy, n_jobs=2)
+    assert np.allclose(mde_pooled.estimated_beta, mde_threads.estimated_beta)
+    assert len(mde_pooled.estimated_alphas) == len(markets)
+    assert np.allclose(mde_pooled.estimated_beta, beta, atol=0.05)
+    assert all(
+        Phi.shape == phi_bases.shape[:2]
+        for Phi, (_, phi_bases) in zip(mde_pooled.estimated_Phis, markets, strict=True)
+    )
+
+
+@mark.parametrize("no_singles", [False, True])
+def test_mde_specification_search(_mde_example, no_singles):
+    mus_sim, phi_bases = _mde_example
+    search = prepare_mde_specification_search(
+        mus_sim, phi_bases, entropy_choo_siow, no_singles=no_singles
+    )
+    subsets = [[0, 1, 2], [2, 0], [1]]
+    for subset, mde_search in zip(subsets, search.evaluate_batch(subsets), strict=True):
+        mde_direct = estimate_semilinear_mde(
+            mus_sim, phi_bases[:, :, subset], entropy_choo_siow, no_singles=no_singles
+        )
+        assert np.allclose(
+            mde_search.estimated_coefficients, mde_direct.estimated_coefficients
+        )
+        assert np.allclose(
+            mde_search.varcov_coefficients, mde_direct.varcov_coefficients
+        )
+        assert np.isclose(mde_search.test_statistic, mde_direct.test_statistic)
+        assert mde_search.ndf == mde_direct.ndf
+        assert np.allclose(mde_search.estimated_Phi, mde_direct.estimated_Phi)
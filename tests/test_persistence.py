@@ -0,0 +1,68 @@
+import numpy as np
+import scipy.sparse as sp
+
+from cupid_matching.choo_siow import entropy_choo_siow
+from cupid_matching.matching_utils import Matching, variance_muhat
+from cupid_matching.min_distance import estimate_semilinear_mde
+from cupid_matching.model_classes import ChooSiowPrimitives
+from cupid_matching.persistence import (
+    load_arrays,
+    load_results,
+    save_arrays,
+    save_results,
+)
+from cupid_matching.poisson_glm import choo_siow_poisson_glm
+
+
+def _simulated_market():
+    rng = np.random.default_rng(8)
+    X, Y, K = 5, 4, 2
+    phi_bases = rng.normal(size=(X, Y, K))
+    choo_siow_instance = ChooSiowPrimitives(
+        phi_bases @ np.ones(K), rng.uniform(0.5, 1.5, X), rng.uniform(0.5, 1.5, Y)
+    )
+    return choo_siow_instance.simulate(100_000, seed=1), phi_bases
+
+
+def test_save_load_matching(tmp_path):
+    mus, _ = _simulated_market()
+    save_results(mus, tmp_path / "mus")
+    mus_loaded = load_results(tmp_path / "mus")
+    assert isinstance(mus_loaded, Matching)
+    assert np.array_equal(mus_loaded.muxy, mus.muxy)
+    assert np.array_equal(mus_loaded.mu0y, mus.mu0y)
+    mus_sparse = Matching(sp.csr_array(mus.muxy), mus.n, mus.m)
+    save_results(mus_sparse, tmp_path / "mus_sparse")
+    mus_sparse_loaded = load_results(tmp_path / "mus_sparse", mmap=False)
+    assert sp.issparse(mus_sparse_loaded.muxy)
+    assert np.array_equal(mus_sparse_loaded.muxy.toarray(), mus.muxy)
+
+
+def test_save_load_results(tmp_path):
+    mus, phi_bases = _simulated_market()
+    var_mus = variance_muhat(mus)
+    save_results(var_mus, tmp_path / "var_mus")
+    var_mus_loaded = load_results(tmp_path / "var_mus")
+    assert isinstance(var_mus_loaded.var_allmus, np.memmap)
+    assert np.array_equal(var_mus_loaded.var_allmus, var_mus.var_allmus)
+    assert np.array_equal(var_mus_loaded.var_munm, var_mus.var_munm)
+
+    mde_results = estimate_semilinear_mde(mus, phi_bases, entropy_choo_siow)
+    save_results(mde_results, tmp_path / "mde")
+    mde_loaded = load_results(tmp_path / "mde")
+    assert str(mde_loaded) == str(mde_results)
+
+    glm_results = choo_siow_poisson_glm(mus, phi_bases, verbose=0)
+    save_results(glm_results, tmp_path / "glm")
+    glm_loaded = load_results(tmp_path / "glm", mmap=False)
+    assert np.array_equal(glm_loaded.varcov_gamma, glm_results.varcov_gamma)
+    assert glm_loaded.n_iterations == glm_results.n_iterations
+
+
+def test_save_load_arrays(tmp_path):
+    jacobian = np.arange(12.0).reshape((3, 4))
+    save_arrays(tmp_path, {"jacobian": jacobian}, {"tol": 1e-9})
+    arrays, metadata = load_arrays(tmp_path)
+    assert np.array_equal(arrays["jacobian"], jacobian)
+    assert metadata["tol"] == 1e-9
+    assert metadata["format_version"] == 1
@@ -0,0 +1,76 @@
+import numpy as np
+from pytest import fixture
+
+from cupid_matching.model_classes import ChooSiowPrimitives
+from cupid_matching.poisson_glm import (
+    PoissonGLMEstimator,
+    choo_siow_poisson_glm,
+    choo_siow_poisson_glm_multimarket,
+)
+
+
+@fixture
+def _glm_markets():
+    rng = np.random.default_rng(5)
+    beta = np.array([1.0, -0.5, 0.3])
+    markets = []
+    for i_market in range(5):
+        X, Y = rng.integers(4, 8, size=2)
+        phi_bases = rng.normal(size=(X, Y, beta.size))
+        choo_siow_instance = ChooSiowPrimitives(
+            phi_bases @ beta, rng.uniform(0.5, 1.5, X), rng.uniform(0.5, 1.5, Y)
+        )
+        mus_sim = choo_siow_instance.simulate(1_000_000, seed=i_market)
+        markets.append((mus_sim, phi_bases))
+    return markets, beta
+
+
+def test_poisson_glm_multimarket_one_market(_glm_markets):
+    markets, _ = _glm_markets
+    glm_single = choo_siow_poisson_glm(*markets[0], verbose=0)
+    glm_multi = choo_siow_poisson_glm_multimarket(markets[:1])
+    assert np.allclose(glm_multi.estimated_beta, glm_single.estimated_beta, atol=1e-5)
+    assert np.allclose(glm_multi.stderrs_beta, glm_single.stderrs_beta, rtol=1e-4)
+    assert np.allclose(glm_multi.estimated_us[0], glm_single.estimated_u, atol=1e-5)
+    assert np.allclose(glm_multi.estimated_vs[0], glm_single.estimated_v, atol=1e-5)
+
+
+def test_poisson_glm_multimarket(_glm_markets):
+    markets, beta = _glm_markets
+    glm_multi = choo_siow_poisson_glm_multimarket(markets)
+    assert glm_multi.n_iterations < 20
+    assert np.allclose(glm_multi.estimated_beta, beta, atol=0.02)
+    assert len(glm_multi.estimated_us) == len(markets)
+    # pooling markets is more precise than using one of them
+    glm_first = choo_siow_poisson_glm_multimarket(markets[:1])
+    assert np.all(glm_multi.stderrs_beta < glm_first.stderrs_beta)
+
+
+def test_poisson_glm_warm_start():
+    rng = np.random.default_rng(6)
+    X, Y, K = 8, 7, 3
+    phi_bases = rng.normal(size=(X, Y, K))
+    choo_siow_instance = ChooSiowPrimitives(
+        phi_bases @ np.array([1.0, -0.5, 0.3]),
+        rng.uniform(0.5, 1.5, X),
+        rng.uniform(0.5, 1.5, Y),
+    )
+    mus_1 = choo_siow_instance.simulate(1_000_000, seed=1)
+    mus_2 = choo_siow_instance.simulate(1_000_000, seed=2)
+    glm_1 = choo_siow_poisson_glm(mus_1, phi_bases, verbose=0)
+    glm_cold = choo_siow_poisson_glm(mus_2, phi_bases, verbose=0)
+    glm_warm = choo_siow_poisson_glm(
+        mus_2, phi_bases, verbose=0, initial_gamma=glm_1.estimated_gamma
+    )
+    assert 0 < glm_warm.n_iterations < glm_cold.n_iterations
+    assert np.allclose(glm_warm.estimated_beta, glm_cold.estimated_beta, atol=1e-4)
+
+    estimator = PoissonGLMEstimator()
+    estimator.fit(mus_1, phi_bases)
+    glm_stateful = estimator.fit(mus_2, phi_bases)
+    assert glm_stateful.n_iterations < glm_cold.n_iterations
+    assert np.allclose(glm_stateful.estimated_beta, glm_cold.estimated_beta, atol=1e-4)
+    # a specification with fewer bases starts afresh
+    glm_fewer = estimator.fit(mus_2, phi_bases[:, :, :2])
+    assert glm_fewer.estimated_beta.size == 2
+    assert estimator.gamma is not None and estimator.gamma.size == X + Y + 2
@@ -0,0 +1,34 @@
+import numpy as np
+
+from cupid_matching.choo_siow import entropy_choo_siow
+from cupid_matching.min_distance import estimate_semilinear_mde
+from cupid_matching.model_classes import ChooSiowPrimitives
+from cupid_matching.poisson_glm import choo_siow_poisson_glm
+from cupid_matching.prepared_market import PreparedMarket
+
+
+def test_prepared_market():
+    rng = np.random.default_rng(6)
+    X, Y, K = 5, 4, 3
+    phi_bases = rng.normal(size=(X, Y, K))
+    choo_siow_instance = ChooSiowPrimitives(
+        phi_bases @ np.ones(K), np.ones(X), np.ones(Y)
+    )
+    mus_sim = choo_siow_instance.simulate(100_000, seed=6)
+    prepared = PreparedMarket(mus_sim, phi_bases)
+
+    mde_prepared = estimate_semilinear_mde(prepared, None, entropy_choo_siow)
+    var_muhat = prepared.var_muhat
+    glm_prepared = choo_siow_poisson_glm(prepared, verbose=0)
+    # the variance was computed once and shared by both estimators
+    assert prepared.var_muhat is var_muhat
+    assert False in prepared._glm_design
+
+    mde_direct = estimate_semilinear_mde(mus_sim, phi_bases, entropy_choo_siow)
+    glm_direct = choo_siow_poisson_glm(mus_sim, phi_bases, verbose=0)
+    assert np.allclose(
+        mde_prepared.estimated_coefficients, mde_direct.estimated_coefficients
+    )
+    assert np.allclose(mde_prepared.test_statistic, mde_direct.test_statistic)
+    assert np.allclose(glm_prepared.estimated_beta, glm_direct.estimated_beta)
+    assert np.allclose(glm_prepared.varcov_gamma, glm_direct.varcov_gamma)
@@ -0,0 +1,45 @@
+import numpy as np
+from pytest import fixture, mark
+
+from cupid_matching.weighting_matrix import (
+    DenseWeighting,
+    DiagonalWeighting,
+    FactoredWeighting,
+    IdentityWeighting,
+    InverseCovarianceWeighting,
+    quadratic_form,
+    weighted_least_squares,
+)
+
+n_rows, n_cols = 12, 3
+
+
+@fixture
+def _ls_example():
+    rng = np.random.default_rng(2)
+    M = rng.normal(size=(n_rows, n_cols))
+    d = rng.normal(size=n_rows)
+    factor = rng.normal(size=(n_rows, n_rows))
+    return M, d, factor
+
+
+def _weighting_matrices(factor):
+    return [
+        IdentityWeighting(n_rows),
+        DiagonalWeighting(np.arange(1.0, n_rows + 1.0)),
+        DenseWeighting(factor @ factor.T),
+        FactoredWeighting(factor),
+        InverseCovarianceWeighting(factor @ factor.T),
+    ]
+
+
+@mark.parametrize("i_weighting", range(5))
+def test_weighted_least_squares(_ls_example, i_weighting):
+    M, d, factor = _ls_example
+    S_op = _weighting_matrices(factor)[i_weighting]
+    S_mat = S_op.to_dense()
+    assert np.isclose(quadratic_form(S_op, d), d @ S_mat @ d)
+    M_S_M = M.T @ S_mat @ M
+    est_coeffs, varcov_coeffs = weighted_least_squares(M, S_op, d)
+    assert np.allclose(est_coeffs, -np.linalg.solve(M_S_M, M.T @ S_mat @ d))
+    assert np.allclose(varcov_coeffs, np.linalg.inv(M_S_M))